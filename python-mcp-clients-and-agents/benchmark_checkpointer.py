@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.graph import StateGraph, MessagesState, START, END
+
+from checkpointer import SqliteCheckpointer, DEFAULT_COMMIT_INTERVAL_SECONDS
+
+# Measures what checkpointing costs an agent step. A one-node graph stands in for the agent
+# (no model or tools involved): every step appends a user and an assistant message to one
+# thread, the way a REPL turn does, so the checkpointed state grows along the session.
+# Reported per backend: step latency, latency of the checkpoint writes (aput/aput_writes)
+# within a step, number of real commits and database size.
+
+def format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+def percentile(values, q):
+    """Nearest-rank percentile, so the script needs nothing beyond the agent's own dependencies."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+def build_graph(checkpointer, reply_chars):
+    reply = "x" * reply_chars
+
+    async def respond(state: MessagesState):
+        return {"messages": [AIMessage(content=reply)]}
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("respond", respond)
+    graph.add_edge(START, "respond")
+    graph.add_edge("respond", END)
+    return graph.compile(checkpointer=checkpointer)
+
+def time_writes(saver, write_times):
+    """Wraps the saver's write methods so the time spent in them is added to write_times[-1]."""
+    for name in ("aput", "aput_writes"):
+        method = getattr(saver, name)
+
+        async def timed(*args, method=method, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                write_times[-1] += time.perf_counter() - start
+
+        setattr(saver, name, timed)
+
+@asynccontextmanager
+async def open_backend(name, path):
+    if name == "memory":
+        yield InMemorySaver()
+    elif name == "sqlite-stock":
+        async with aiosqlite.connect(path) as conn:
+            yield AsyncSqliteSaver(conn)
+    elif name == "sqlite-normal":
+        async with SqliteCheckpointer.open(path, commit_interval=0) as saver:
+            yield saver
+    else:
+        async with SqliteCheckpointer.open(path, commit_interval=DEFAULT_COMMIT_INTERVAL_SECONDS) as saver:
+            yield saver
+
+async def run_backend(name, steps, reply_chars, directory):
+    path = os.path.join(directory, f"{name}.sqlite")
+    step_times, write_times = [], []
+    async with open_backend(name, path) as saver:
+        time_writes(saver, write_times)
+        graph = build_graph(saver, reply_chars)
+        config = {"configurable": {"thread_id": "benchmark"}}
+        start_all = time.perf_counter()
+        for step in range(steps):
+            write_times.append(0.0)
+            start = time.perf_counter()
+            await graph.ainvoke({"messages": [{"role": "user", "content": f"question {step}"}]}, config=config)
+            step_times.append(time.perf_counter() - start)
+        total = time.perf_counter() - start_all
+        commits = saver.stats()["commits"] if isinstance(saver, SqliteCheckpointer) else None
+    size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    return name, [t * 1000 for t in step_times], [t * 1000 for t in write_times], total, commits, size
+
+def print_report(rows, steps):
+    print(f"\n{'backend':<16}{'step p50':>10}{'step p95':>10}{'write p50':>11}{'write p95':>11}{'total s':>9}{'commits':>9}{'db size':>11}")
+    for name, step_ms, write_ms, total, commits, size in rows:
+        print(f"{name:<16}{percentile(step_ms, 50):>10.3f}{percentile(step_ms, 95):>10.3f}"
+              f"{percentile(write_ms, 50):>11.3f}{percentile(write_ms, 95):>11.3f}{total:>9.2f}"
+              f"{commits if commits is not None else '-':>9}{format_bytes(size) if name != 'memory' else '-':>11}")
+    print(f"(latencies in ms over {steps} steps; sqlite-stock commits on every write)")
+
+async def run_benchmark(steps=200, reply_chars=500, backends=None):
+    backends = backends or ["memory", "sqlite-stock", "sqlite-normal", "sqlite-batched"]
+    with tempfile.TemporaryDirectory() as directory:
+        rows = [await run_backend(name, steps, reply_chars, directory) for name in backends]
+    print_report(rows, steps)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-step checkpoint write latency of the agent checkpointers.")
+    parser.add_argument("--steps", type=int, default=200, help="Agent steps (turns) on one thread")
+    parser.add_argument("--reply-chars", type=int, default=500, help="Length of every assistant reply")
+    parser.add_argument("--backends", nargs="+", choices=["memory", "sqlite-stock", "sqlite-normal", "sqlite-batched"],
+                        help="Backends to compare (default: all)")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.steps, args.reply_chars, args.backends))
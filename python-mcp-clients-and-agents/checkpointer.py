@@ -0,0 +1,179 @@
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import aiosqlite
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+# Persistent agent checkpoints, so a thread_id's history survives restarts and stays on
+# disk instead of growing in RAM.
+#
+# SqliteCheckpointer is LangGraph's AsyncSqliteSaver tuned for per-step writes:
+#   * WAL journal with synchronous=NORMAL: a commit appends to the WAL without an fsync
+#     (the WAL is synced when it is checkpointed into the database). A power loss can
+#     lose the last commits, never consistency.
+#   * Batched commits: every put commits in the stock saver. Here commit() only schedules
+#     one real commit `commit_interval` seconds later, so the checkpoint and writes of an
+#     agent step, and of steps in quick succession, share a transaction. The same
+#     connection reads its own uncommitted rows, so the agent always sees its latest state;
+#     a crash loses at most the last `commit_interval` seconds of checkpoints.
+#   * Pruning: only the newest `keep_last` checkpoints of every thread (and subgraph
+#     namespace) are kept, with their pending writes. The agents here use plain channels,
+#     so every checkpoint holds the full state and older ones are only needed for
+#     time travel. Pruning runs on open, every `prune_interval` checkpoints of a thread
+#     and on close; free pages are reclaimed with VACUUM once they make up a quarter
+#     of the file.
+
+# AGENT_CHECKPOINTER selects the backend: "memory", or "sqlite:<path>" (relative to the working directory)
+DEFAULT_CHECKPOINTER = f"sqlite:{os.path.join(os.path.dirname(os.path.abspath(__file__)), '.agent_checkpoints.sqlite')}"
+CHECKPOINTER_URL = os.environ.get("AGENT_CHECKPOINTER", DEFAULT_CHECKPOINTER)
+
+DEFAULT_COMMIT_INTERVAL_SECONDS = 0.05
+DEFAULT_KEEP_LAST_CHECKPOINTS = 50
+DEFAULT_PRUNE_INTERVAL = 100
+VACUUM_FREE_RATIO = 0.25
+
+PRUNE_CHECKPOINTS_SQL = """
+DELETE FROM checkpoints WHERE rowid IN (
+    SELECT rowid FROM (
+        SELECT rowid, ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS age
+        FROM checkpoints WHERE (? IS NULL OR thread_id = ?)
+    ) WHERE age > ?
+)
+"""
+PRUNE_WRITES_SQL = """
+DELETE FROM writes WHERE (? IS NULL OR thread_id = ?) AND NOT EXISTS (
+    SELECT 1 FROM checkpoints c
+    WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id
+)
+"""
+
+
+class BatchedCommitConnection(aiosqlite.Connection):
+    """aiosqlite connection whose commit() is deferred and coalesced; flush() commits right away."""
+
+    def __init__(self, connector, commit_interval: float = DEFAULT_COMMIT_INTERVAL_SECONDS, iter_chunk_size: int = 64):
+        super().__init__(connector, iter_chunk_size)
+        self.commit_interval = commit_interval
+        self.pending_commit: Optional[asyncio.Task] = None
+        self.commits = 0
+
+    async def commit(self):
+        if self.commit_interval <= 0:
+            return await self.flush()
+        if self.pending_commit is None:
+            self.pending_commit = asyncio.create_task(self._commit_later())
+
+    async def _commit_later(self):
+        await asyncio.sleep(self.commit_interval)
+        self.pending_commit = None
+        await self._commit()
+
+    async def flush(self):
+        if self.pending_commit is not None:
+            self.pending_commit.cancel()
+            self.pending_commit = None
+        await self._commit()
+
+    async def _commit(self):
+        self.commits += 1
+        await super().commit()
+
+    async def close(self):
+        if self._connection is not None:
+            await self.flush()
+        await super().close()
+
+
+class SqliteCheckpointer(AsyncSqliteSaver):
+    """AsyncSqliteSaver with synchronous=NORMAL, batched commits and pruning of old checkpoints (see above)."""
+
+    def __init__(self, conn: BatchedCommitConnection, *, keep_last: Optional[int] = DEFAULT_KEEP_LAST_CHECKPOINTS,
+                 prune_interval: int = DEFAULT_PRUNE_INTERVAL, serde=None):
+        super().__init__(conn, serde=serde)
+        self.keep_last = keep_last
+        self.prune_interval = prune_interval
+        self.puts_since_prune = {}  # thread_id -> checkpoints written since its last pruning
+
+    @classmethod
+    @asynccontextmanager
+    async def open(cls, path: str, commit_interval: float = DEFAULT_COMMIT_INTERVAL_SECONDS, **kwargs):
+        """Opens (creating if needed) the database at `path`; pending commits are flushed on exit."""
+        conn = BatchedCommitConnection(lambda: sqlite3.connect(path, check_same_thread=False), commit_interval)
+        async with conn:
+            saver = cls(conn, **kwargs)
+            await saver.setup()
+            await saver.prune()
+            try:
+                yield saver
+            finally:
+                await saver.prune()
+                await saver.compact()
+
+    async def setup(self):
+        if self.is_setup:
+            return
+        await super().setup()
+        async with self.lock:
+            await self.conn.execute("PRAGMA synchronous=NORMAL")
+            await self.conn.execute("PRAGMA busy_timeout=5000")
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        if self.keep_last and self.prune_interval:
+            thread_id = str(config["configurable"]["thread_id"])
+            self.puts_since_prune[thread_id] = self.puts_since_prune.get(thread_id, 0) + 1
+            if self.puts_since_prune[thread_id] >= self.prune_interval:
+                await self.prune(thread_id)
+        return next_config
+
+    async def prune(self, thread_id: Optional[str] = None, keep_last: Optional[int] = None) -> int:
+        """
+        Deletes all but the newest `keep_last` checkpoints (default: the saver's) of one thread, or of every
+        thread, together with the writes of deleted checkpoints. Returns the number of checkpoints deleted.
+        """
+        keep_last = keep_last or self.keep_last
+        if not keep_last:
+            return 0
+        await self.setup()
+        async with self.lock:
+            cursor = await self.conn.execute(PRUNE_CHECKPOINTS_SQL, (thread_id, thread_id, keep_last))
+            deleted = cursor.rowcount
+            await self.conn.execute(PRUNE_WRITES_SQL, (thread_id, thread_id))
+            await self.conn.commit()
+        if thread_id is None:
+            self.puts_since_prune.clear()
+        else:
+            self.puts_since_prune[thread_id] = 0
+        return deleted
+
+    async def compact(self):
+        """Commits, folds the WAL back into the database and VACUUMs once enough pages are free."""
+        async with self.lock:
+            await self.conn.flush()
+            [(page_count,)] = await self.conn.execute_fetchall("PRAGMA page_count")
+            [(free_pages,)] = await self.conn.execute_fetchall("PRAGMA freelist_count")
+            if page_count and free_pages / page_count >= VACUUM_FREE_RATIO:
+                await self.conn.execute("VACUUM")
+            await self.conn.execute_fetchall("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def stats(self) -> dict:
+        return {"commits": self.conn.commits}
+
+
+@asynccontextmanager
+async def open_checkpointer(url: str = CHECKPOINTER_URL, **kwargs):
+    """
+    Opens the checkpointer selected by `url`: "memory" for an InMemorySaver, or "sqlite:<path>" for a
+    SqliteCheckpointer (keyword arguments are passed on to SqliteCheckpointer.open).
+    """
+    if url == "memory":
+        yield InMemorySaver()
+    elif url.startswith("sqlite:"):
+        async with SqliteCheckpointer.open(url[len("sqlite:"):], **kwargs) as saver:
+            yield saver
+    else:
+        raise ValueError(f"Unknown checkpointer {url!r}: expected 'memory' or 'sqlite:<path>'")
@@ -0,0 +1,127 @@
+import os
+import json
+from typing import Any, Optional
+
+from langchain.agents.middleware import AgentMiddleware, SummarizationMiddleware
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+# Keeps the prompt of a long-running thread within a token budget. The REPL reuses one thread,
+# so without this every model call resends the whole session, long RAG results included.
+#
+# HistoryTrimMiddleware rewrites old messages in the agent state before each model call
+# (the checkpoint shrinks with it):
+#   * tool outputs from before the last `keep_recent_turns` user turns are cut to
+#     `max_tool_chars`; the agent has long since used them,
+#   * all but the latest `write_todos` call are replaced by a short marker, both the
+#     plan in the call's arguments and its result, since every call restates the whole
+#     plan (the tool_call id is kept, so calls and results still pair up),
+# and logs the prompt size of every model call (estimated, and as reported by the model).
+# Turns that still don't fit are summarized by LangChain's SummarizationMiddleware, which
+# runs after it (see history_middleware()).
+
+# Token budget of the conversation history; beyond it older turns are summarized
+HISTORY_TOKEN_BUDGET = int(os.environ.get("AGENT_HISTORY_TOKEN_BUDGET", "8000"))
+DEFAULT_MAX_TOOL_CHARS = 1500
+DEFAULT_KEEP_RECENT_TURNS = 2
+# Messages kept verbatim after a summary
+DEFAULT_KEEP_MESSAGES = 20
+
+TRUNCATED_SUFFIX = " characters of an earlier tool result]"
+TRUNCATED_MARKER = "\n...[truncated {n}" + TRUNCATED_SUFFIX
+SUPERSEDED_PLAN = "[Superseded plan]"
+SUPERSEDED_PLAN_ARGS = {"plan": SUPERSEDED_PLAN}
+
+
+def message_text(message) -> str:
+    content = message.content
+    if isinstance(content, list):
+        return " ".join(c.get("text", "") if isinstance(c, dict) else str(c) for c in content)
+    return content
+
+
+class HistoryTrimMiddleware(AgentMiddleware):
+    def __init__(self, max_tool_chars: int = DEFAULT_MAX_TOOL_CHARS, keep_recent_turns: int = DEFAULT_KEEP_RECENT_TURNS,
+                 plan_tool: str = "write_todos", log=print):
+        super().__init__()
+        self.max_tool_chars = max_tool_chars
+        self.keep_recent_turns = keep_recent_turns
+        self.plan_tool = plan_tool
+        self.log = log
+
+    def trimmed_messages(self, messages: list) -> list:
+        """The messages that need rewriting, as copies with the same ids (add_messages replaces them in place)."""
+        human_indices = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        # Tool results at or after this index belong to recent turns and are left intact
+        recent_start = human_indices[-self.keep_recent_turns] if len(human_indices) >= self.keep_recent_turns else 0
+
+        plan_results = [i for i, m in enumerate(messages) if isinstance(m, ToolMessage) and m.name == self.plan_tool]
+        superseded = set(plan_results[:-1])
+        superseded_calls = {messages[i].tool_call_id for i in superseded}
+
+        updates = []
+        for i, message in enumerate(messages):
+            if message.id is None:
+                continue
+            if isinstance(message, AIMessage):
+                if any(tc["id"] in superseded_calls and tc["args"] != SUPERSEDED_PLAN_ARGS for tc in message.tool_calls):
+                    tool_calls = [{**tc, "args": SUPERSEDED_PLAN_ARGS} if tc["id"] in superseded_calls else tc
+                                  for tc in message.tool_calls]
+                    additional_kwargs = dict(message.additional_kwargs)
+                    # Gemini also keeps the raw arguments of its last function call here
+                    function_call = additional_kwargs.get("function_call")
+                    if isinstance(function_call, dict) and function_call.get("name") == self.plan_tool:
+                        additional_kwargs["function_call"] = {**function_call, "arguments": json.dumps(SUPERSEDED_PLAN_ARGS)}
+                    updates.append(message.model_copy(update={"tool_calls": tool_calls, "additional_kwargs": additional_kwargs}))
+                continue
+            if not isinstance(message, ToolMessage):
+                continue
+            text = message_text(message)
+            if i in superseded:
+                if len(text) > len(SUPERSEDED_PLAN):
+                    updates.append(message.model_copy(update={"content": SUPERSEDED_PLAN}))
+            elif i < recent_start and len(text) > self.max_tool_chars and not text.endswith(TRUNCATED_SUFFIX):
+                cut = len(text) - self.max_tool_chars
+                updates.append(message.model_copy(update={"content": text[:self.max_tool_chars] + TRUNCATED_MARKER.format(n=cut)}))
+        return updates
+
+    def before_model(self, state, runtime) -> Optional[dict[str, Any]]:
+        messages = state["messages"]
+        updates = self.trimmed_messages(messages)
+        if not updates:
+            return None
+        before = count_tokens_approximately(messages)
+        by_id = {m.id: m for m in updates}
+        after = count_tokens_approximately([by_id.get(m.id, m) for m in messages])
+        self.log(f"   ✂️  Trimmed {len(updates)} old tool calls/results: ~{before} -> ~{after} history tokens")
+        return {"messages": updates}
+
+    async def abefore_model(self, state, runtime) -> Optional[dict[str, Any]]:
+        return self.before_model(state, runtime)
+
+    def log_prompt_size(self, request, response):
+        prompt = ([request.system_message] if request.system_message else []) + request.messages
+        reported = None
+        result = getattr(response, "result", None) or [response]
+        if isinstance(result[-1], AIMessage) and result[-1].usage_metadata:
+            reported = result[-1].usage_metadata.get("input_tokens")
+        self.log(f"   🧮 Prompt: {len(request.messages)} messages, ~{count_tokens_approximately(prompt)} tokens"
+                 + (f" (model reported {reported} input tokens)" if reported is not None else ""))
+
+    def wrap_model_call(self, request, handler):
+        response = handler(request)
+        self.log_prompt_size(request, response)
+        return response
+
+    async def awrap_model_call(self, request, handler):
+        response = await handler(request)
+        self.log_prompt_size(request, response)
+        return response
+
+
+def history_middleware(model, token_budget: int = HISTORY_TOKEN_BUDGET, **trim_kwargs) -> list:
+    """Trimming, then summarization of what still exceeds `token_budget`; put before other middleware."""
+    return [
+        HistoryTrimMiddleware(**trim_kwargs),
+        SummarizationMiddleware(model, trigger=("tokens", token_budget), keep=("messages", DEFAULT_KEEP_MESSAGES)),
+    ]
@@ -1,196 +1,178 @@
 import asyncio
 import os
-from contextlib import AsyncExitStack
-from typing import List, Optional, Type, Any
-from pydantic import BaseModel, Field, create_model
+import time
 
 from dotenv import load_dotenv
 from langchain_google_vertexai import ChatVertexAI
-from langchain_core.tools import tool, StructuredTool
 from langchain.agents import create_agent
 from langchain.agents.middleware import HumanInTheLoopMiddleware
 from langchain.agents.middleware import TodoListMiddleware
-from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.types import Command
 from langchain_core.messages import SystemMessage, ToolMessage, AIMessage, HumanMessage
 
-# Import MCP SDK
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+# MCP client wrapper and the shared Todo tool live in mcp_client.py
+from mcp_client import MultiServerMCPClient, load_server_registry, write_todos, tool_result_cache, format_cache_activity
+from mcp_client import ToolStepTimer, format_latency
+# Conversation history is checkpointed to SQLite (see checkpointer.py), so it survives restarts
+from checkpointer import open_checkpointer, CHECKPOINTER_URL
+# Bounds the prompt of the long-lived thread (see history_budget.py)
+from history_budget import history_middleware
 
 load_dotenv()
 
-# --- 1. Helper: Dynamic Schema Conversion ---
-def jsonschema_to_pydantic(schema: dict, model_name: str) -> Type[BaseModel]:
-    """Converts MCP JSON Schema to Pydantic for LangChain/Gemini compatibility."""
-    fields = {}
-    required_fields = schema.get("required", [])
-    properties = schema.get("properties", {})
-
-    for field_name, field_def in properties.items():
-        field_type = str
-        t = field_def.get("type")
-        if t == "integer": field_type = int
-        elif t == "number": field_type = float
-        elif t == "boolean": field_type = bool
-        elif t == "array": field_type = list
-        elif t == "object": field_type = dict
-        
-        # --- FIX START ---
-        if field_name not in required_fields:
-            field_type = Optional[field_type]
-            default = None
-        else:
-            default = ...
-        # --- FIX END ---
-        fields[field_name] = (field_type, Field(default=default, description=field_def.get("description")))
-
-    return create_model(model_name, **fields)
-
-# --- 2. MCP Client Wrapper ---
-class MultiServerMCPClient:
-    def __init__(self):
-        self.exit_stack = AsyncExitStack()
-        self.sessions = []
-        self.tools = []
-
-    async def connect_server(self, name: str, command: str, args: List[str], cwd: Optional[str] = None, env: Optional[dict] = None):
-        print(f"🔌 Connecting to {name} server...")
-        server_params = StdioServerParameters(command=command, args=args, cwd=cwd, env={**os.environ, **(env or {})})
-
-        try:
-            read, write = await self.exit_stack.enter_async_context(stdio_client(server_params))
-            session = await self.exit_stack.enter_async_context(ClientSession(read, write))
-            await session.initialize()
-            mcp_tools = await session.list_tools()
-            self.sessions.append(session)
-
-            for tool_def in mcp_tools.tools:
-                args_schema = jsonschema_to_pydantic(tool_def.inputSchema, f"{tool_def.name}Schema")
-
-                async def make_tool_func(tool_name=tool_def.name, **kwargs):
-                    try:
-                        result = await session.call_tool(tool_name, arguments=kwargs)
-                        if result.isError: return f"Tool Error: {result.content}"
-                        
-                        texts = [c.text for c in result.content if c.type == "text"]
-                        final_text = "\n".join(texts)
-                        return final_text if final_text.strip() else "Task completed."
-                    except Exception as e:
-                        return f"Execution Error: {str(e)}"
-
-                lc_tool = StructuredTool.from_function(
-                    func=None,
-                    coroutine=make_tool_func,
-                    name=tool_def.name,
-                    description=tool_def.description or f"MCP Tool: {tool_def.name}",
-                    args_schema=args_schema 
-                )
-                self.tools.append(lc_tool)
-                
-            print(f"   ✅ Connected to {name}. Found {len(mcp_tools.tools)} tools.")
-        except Exception as e:
-            print(f"   ❌ Failed to connect to {name}: {e}")
-
-    async def cleanup(self):
-        await self.exit_stack.aclose()
-
-# --- 3. Robust Todo Tool Definition ---
-class TodoItem(BaseModel):
-    task: str = Field(..., description="The task description")
-    status: str = Field(..., description="Status: 'pending', 'in_progress', or 'completed'")
-
-class TodoInput(BaseModel):
-    todos: List[TodoItem] = Field(..., description="List of tasks to plan")
+# Print model tokens and tool activity as they happen; AGENT_STREAM=0 waits for the whole run and prints a trace
+STREAM_OUTPUT = os.environ.get("AGENT_STREAM", "1") != "0"
 
-@tool(args_schema=TodoInput)
-def write_todos(todos: List[TodoItem]):
-    """
-    Create and manage a list of todo items. 
-    ALWAYS use this tool first to plan out the steps.
-    IMPORTANT: After marking the final task as 'completed', you MUST generate a text response to the user with the final answer.
-    """
-    formatted = "\n".join([f"{i+1}. [{t.status.upper()}] {t.task}" for i, t in enumerate(todos)])
-    return f"Current Plan:\n{formatted}"
-
-# --- 4. Main REPL ---
+# --- 1. Main REPL ---
 async def main():
-    base_dir = os.getcwd() 
-    math_server = os.path.join(base_dir, "../javascript-mcp-and-agents/math_server.js")
-    memory_server = os.path.join(base_dir, "../javascript-mcp-and-agents/memory_server.js")
-    weather_server = os.path.join(base_dir, "../typescript-weather-mcp-server", "build", "index.js")
-    rag_server = os.path.join(base_dir, "../python-rag-mcp-server/rag_server.py")
-    venv_python = os.path.join(base_dir, "../python-rag-mcp-server/mcp-rag-env", "bin", "python")
-
     client = MultiServerMCPClient()
     try:
-        await client.connect_server("math", "node", [math_server])
-        await client.connect_server("weather", "node", [weather_server])
-        await client.connect_server("memory", "node", [memory_server])
-        rag_server_dir = os.path.join(base_dir, "../python-rag-mcp-server")
-        await client.connect_server("rag", venv_python, [rag_server], cwd=rag_server_dir)
-
-        model = ChatVertexAI(model="gemini-2.5-flash", temperature=0)
-
-        hitl_middleware = HumanInTheLoopMiddleware(
-            interrupt_on={"write_todos": True},
-            description_prefix="⚠️  REVIEW REQUIRED",
-        )
+        async with open_checkpointer() as checkpointer:
+            await client.connect_servers(load_server_registry())
+
+            model = ChatVertexAI(model="gemini-2.5-flash", temperature=0)
+
+            hitl_middleware = HumanInTheLoopMiddleware(
+                interrupt_on={"write_todos": True},
+                description_prefix="⚠️  REVIEW REQUIRED",
+            )
         
-        system_prompt = SystemMessage(content=(
-            "You are a helpful AI assistant connected to various tools including Math, Weather, Memory, and RAG.\n"
-            "You also have a Todo List manager to help plan complex tasks.\n\n"
-            "PROTOCOL:\n"
-            "1. For complex requests involving multiple steps, you MUST use 'write_todos' FIRST to create a plan.\n"
-            "2. As you complete steps, call 'write_todos' again to update the task status to 'completed'.\n"
-            "3. Once all tasks are done, you MUST generate a final natural language response to the user with the answer."
-        ))
-
-        all_tools = client.tools + [write_todos]
-
-        agent = create_agent(
-            model=model,
-            tools=all_tools, 
-            middleware=[TodoListMiddleware(), hitl_middleware],
-            checkpointer=InMemorySaver(),
-            system_prompt=system_prompt 
-        )
-
-        print("\n" + "="*50)
-        print("🤖 MCP Agent REPL Started")
-        print("Type 'exit' or 'quit' to stop.")
-        print("="*50 + "\n")
-
-        # REPL Loop
-        # We reuse the same thread_id so the bot remembers context across inputs!
-        config = {"configurable": {"thread_id": "repl_session_v1"}}
-
-        while True:
-            try:
-                user_input = input("\nUser: ").strip()
-                if user_input.lower() in ["exit", "quit"]:
-                    print("Goodbye!")
-                    break
+            system_prompt = SystemMessage(content=(
+                "You are a helpful AI assistant connected to various tools including Math, Weather, Memory, and RAG.\n"
+                "You also have a Todo List manager to help plan complex tasks.\n\n"
+                "PROTOCOL:\n"
+                "1. For complex requests involving multiple steps, you MUST use 'write_todos' FIRST to create a plan.\n"
+                "2. As you complete steps, call 'write_todos' again to update the task status to 'completed'.\n"
+                "3. Once all tasks are done, you MUST generate a final natural language response to the user with the answer."
+            ))
+
+            all_tools = client.tools + [write_todos]
+
+            agent = create_agent(
+                model=model,
+                tools=all_tools, 
+                # History trimming/summarization first, so the other middleware sees the bounded history
+                middleware=[*history_middleware(model), ToolStepTimer(), TodoListMiddleware(), hitl_middleware],
+                checkpointer=checkpointer,
+                system_prompt=system_prompt 
+            )
+
+            print("\n" + "="*50)
+            print("🤖 MCP Agent REPL Started")
+            print("Type 'exit' or 'quit' to stop.")
+            print("="*50 + "\n")
+
+            # REPL Loop
+            # We reuse the same thread_id so the bot remembers context across inputs, and across restarts
+            config = {"configurable": {"thread_id": os.environ.get("AGENT_THREAD_ID", "repl_session_v1")}}
+            state = await agent.aget_state(config)
+            history = state.values.get("messages", [])
+            if history:
+                print(f"📜 Resuming thread '{config['configurable']['thread_id']}' with {len(history)} messages from {CHECKPOINTER_URL}")
+            # A plan that was waiting for approval when the REPL exited must be decided before the next turn,
+            # otherwise its write_todos call is left without a result in the thread
+            if state.interrupts:
+                print("⏸️  The last run is still waiting for your decision.")
+                await run_interactive(agent, None, config, pending=state.interrupts)
+
+            while True:
+                try:
+                    user_input = input("\nUser: ").strip()
+                    if user_input.lower() in ["exit", "quit"]:
+                        print("Goodbye!")
+                        break
                 
-                if not user_input:
-                    continue
+                    if not user_input:
+                        continue
 
-                await run_interactive(agent, user_input, config)
+                    await run_interactive(agent, user_input, config)
 
-            except KeyboardInterrupt:
-                print("\nGoodbye!")
-                break
-            except Exception as e:
-                print(f"❌ Error: {e}")
+                except KeyboardInterrupt:
+                    print("\nGoodbye!")
+                    break
+                except Exception as e:
+                    print(f"❌ Error: {e}")
 
     finally:
         print("\nClosing MCP connections...")
         await client.cleanup()
 
-async def run_interactive(agent, query, config):
+def text_of(content) -> str:
+    if isinstance(content, list):
+        return "".join(block.get('text', '') for block in content if isinstance(block, dict))
+    return content or ""
+
+async def stream_agent(agent, payload, config):
+    """
+    Runs the agent like ainvoke, but prints model tokens, tool calls and tool results as they happen.
+    Returns an ainvoke-style response: the thread's messages, plus '__interrupt__' if a HITL interrupt stopped the run.
+    """
+    start = time.perf_counter()
+    first_output = None
+    interrupts = []
+    in_text = False
+
+    def output(line):
+        nonlocal first_output, in_text
+        first_output = first_output or time.perf_counter()
+        if in_text:
+            print()
+            in_text = False
+        print(line, flush=True)
+
+    async for mode, data in agent.astream(payload, config=config, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            chunk, metadata = data
+            # Only the agent's own model call; summarization and other internal calls stay silent
+            if metadata.get("langgraph_node") != "model" or not isinstance(chunk, AIMessage):
+                continue
+            text = text_of(chunk.content)
+            if text:
+                if not in_text:
+                    output("\n🤖 Agent:")
+                    in_text = True
+                print(text, end="", flush=True)
+            continue
+
+        for node, update in data.items():
+            if node == "__interrupt__":
+                interrupts.extend(update)
+                continue
+            for msg in (update or {}).get("messages", []) if isinstance(update, dict) else []:
+                # Middleware (HITL approval) re-emits the model's message; only the model's own update is new
+                if isinstance(msg, AIMessage) and msg.tool_calls and node == "model":
+                    for tc in msg.tool_calls:
+                        output(f"🛠️ Agent called tool: {tc['name']} ({tc['args']})")
+                elif isinstance(msg, ToolMessage):
+                    content = text_of(msg.content)
+                    output(f"✅ {msg.name} returned{format_latency(msg)}: {(content[:150] + '...') if len(content) > 150 else content}")
+    if in_text:
+        print()
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    first_ms = (first_output - start) * 1000 if first_output else elapsed_ms
+    print(f"⏱️  First output after {first_ms:.0f} ms, run took {elapsed_ms:.0f} ms")
+
+    state = await agent.aget_state(config)
+    response = {"messages": state.values.get("messages", [])}
+    if interrupts:
+        response["__interrupt__"] = interrupts
+    return response
+
+async def run_agent(agent, payload, config):
+    if STREAM_OUTPUT:
+        return await stream_agent(agent, payload, config)
+    return await agent.ainvoke(payload, config=config)
+
+async def run_interactive(agent, query, config, pending=None):
+    """Runs one user turn; with `pending` (a restored thread's interrupts) reviews those instead of sending `query`."""
+    cache_before = tool_result_cache.stats()
     try:
-        # Stream/invoke on the SAME config to preserve history
-        response = await agent.ainvoke({"messages": [{"role": "user", "content": query}]}, config=config)
+        if pending:
+            response = {"__interrupt__": list(pending)}
+        else:
+            # Stream/invoke on the SAME config to preserve history
+            response = await run_agent(agent, {"messages": [{"role": "user", "content": query}]}, config)
 
         # HITL Loop
         while "__interrupt__" in response:
@@ -220,7 +202,7 @@ async def run_interactive(agent, query, config):
             if choice == 'y':
                 print("✅ Approved.")
                 resume = Command(resume={"decisions": [{"type": "approve"}]})
-                response = await agent.ainvoke(resume, config=config)
+                response = await run_agent(agent, resume, config)
             
             else: 
                 feedback = input("📝 Enter your feedback/changes: ")
@@ -231,47 +213,53 @@ async def run_interactive(agent, query, config):
                         "message": f"User rejected this plan. Feedback: {feedback}"
                     }]
                 })
-                response = await agent.ainvoke(resume, config=config)
+                response = await run_agent(agent, resume, config)
 
-        # --- VERBOSE LOGGING (Cleaned) ---
-        print("\n--- Execution Trace ---")
-        messages = response['messages']
+        # A streamed run has already shown its trace and answer as they happened
+        if not STREAM_OUTPUT:
+            # --- VERBOSE LOGGING (Cleaned) ---
+            print("\n--- Execution Trace ---")
+            messages = response['messages']
         
-        # 1. Find the index of the LAST user message
-        last_human_idx = -1
-        for i in range(len(messages) - 1, -1, -1):
-            if isinstance(messages[i], HumanMessage):
-                last_human_idx = i
-                break
+            # 1. Find the index of the LAST user message
+            last_human_idx = -1
+            for i in range(len(messages) - 1, -1, -1):
+                if isinstance(messages[i], HumanMessage):
+                    last_human_idx = i
+                    break
         
-        # 2. Slice to show only messages generated *after* that input
-        recent_activity = messages[last_human_idx + 1:] if last_human_idx != -1 else messages
+            # 2. Slice to show only messages generated *after* that input
+            recent_activity = messages[last_human_idx + 1:] if last_human_idx != -1 else messages
 
-        for i, msg in enumerate(recent_activity):
-            if isinstance(msg, AIMessage) and msg.tool_calls:
-                for tc in msg.tool_calls:
-                    print(f"[Step {i+1}] 🛠️ Agent called tool: {tc['name']} ({tc['args']})")
+            for i, msg in enumerate(recent_activity):
+                if isinstance(msg, AIMessage) and msg.tool_calls:
+                    for tc in msg.tool_calls:
+                        print(f"[Step {i+1}] 🛠️ Agent called tool: {tc['name']} ({tc['args']})")
             
-            elif isinstance(msg, ToolMessage):
-                content = msg.content
-                if isinstance(content, list):
-                    content = " ".join([c.get('text', '') for c in content if isinstance(c, dict) and 'text' in c])
+                elif isinstance(msg, ToolMessage):
+                    content = msg.content
+                    if isinstance(content, list):
+                        content = " ".join([c.get('text', '') for c in content if isinstance(c, dict) and 'text' in c])
                 
-                display_content = (content[:150] + '...') if len(content) > 150 else content
-                print(f"[Step {i+1}] ✅ MCP Server returned: {display_content}")
+                    display_content = (content[:150] + '...') if len(content) > 150 else content
+                    print(f"[Step {i+1}] ✅ MCP Server returned{format_latency(msg)}: {display_content}")
 
-        # Final Answer
-        last_msg = response['messages'][-1]
-        content = last_msg.content
+            # Final Answer
+            last_msg = response['messages'][-1]
+            content = last_msg.content
         
-        if not content:
-            print("\nFinal Answer: [Agent completed tasks but returned no text.]")
-        elif isinstance(content, list):
-            text_parts = [block.get('text', '') for block in content if 'text' in block]
-            print(f"\nFinal Answer: {' '.join(text_parts)}")
-        else:
-            print(f"\nFinal Answer: {content}")
-            
+            if not content:
+                print("\nFinal Answer: [Agent completed tasks but returned no text.]")
+            elif isinstance(content, list):
+                text_parts = [block.get('text', '') for block in content if 'text' in block]
+                print(f"\nFinal Answer: {' '.join(text_parts)}")
+            else:
+                print(f"\nFinal Answer: {content}")
+
+        cache_activity = format_cache_activity(cache_before, tool_result_cache.stats())
+        if cache_activity:
+            print(cache_activity)
+
     except Exception as e:
         print(f"❌ Error during execution: {e}")
 
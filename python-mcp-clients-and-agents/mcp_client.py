@@ -1,6 +1,14 @@
 import asyncio
+import functools
+import hashlib
+import inspect
+import json
 import os
-from contextlib import AsyncExitStack
+import time
+import math
+import anyio
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 from pydantic import BaseModel, Field, create_model
 
 from dotenv import load_dotenv
@@ -9,6 +17,7 @@ from langchain_core.tools import tool, StructuredTool
 from langchain.agents import create_agent
 from langchain.agents.middleware import HumanInTheLoopMiddleware
 from langchain.agents.middleware import TodoListMiddleware
+from langchain.agents.middleware import AgentMiddleware
 from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.types import Command
 from langchain_core.messages import SystemMessage, ToolMessage, AIMessage
@@ -17,10 +26,16 @@ from typing import List, Optional, Type, Any # Ensure Any is imported if needed,
 # Import MCP SDK
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.shared.exceptions import McpError
+from mcp.types import (
+    CallToolResult, Tool, CONNECTION_CLOSED, ClientNotification, CancelledNotification, CancelledNotificationParams,
+)
 
 load_dotenv()
 
 # --- 1. Helper: Dynamic Schema Conversion ---
+JSON_SCALAR_TYPES = {"string": str, "integer": int, "number": float, "boolean": bool}
+
 def jsonschema_to_pydantic(schema: dict, model_name: str) -> Type[BaseModel]:
     """Converts MCP JSON Schema to Pydantic for LangChain/Gemini compatibility."""
     fields = {}
@@ -33,7 +48,10 @@ def jsonschema_to_pydantic(schema: dict, model_name: str) -> Type[BaseModel]:
         if t == "integer": field_type = int
         elif t == "number": field_type = float
         elif t == "boolean": field_type = bool
-        elif t == "array": field_type = list
+        elif t == "array":
+            # Keep the item type so Gemini gets a complete array schema (e.g. list[str] for batch queries)
+            item_type = JSON_SCALAR_TYPES.get(field_def.get("items", {}).get("type"))
+            field_type = List[item_type] if item_type else list
         elif t == "object": field_type = dict
         
         # --- FIX START ---
@@ -50,55 +68,816 @@ def jsonschema_to_pydantic(schema: dict, model_name: str) -> Type[BaseModel]:
 
     return create_model(model_name, **fields)
 
-# --- 2. MCP Client Wrapper ---
+# --- 2. Batched Tool Calls ---
+# How long concurrent calls to a batchable tool are collected before being sent together
+BATCH_WINDOW_SECONDS = 0.01
+
+def find_batch_counterpart(tool_def, tools_by_name: dict):
+    """
+    A server advertises batching for tool `X` by also exposing `X_batch`, which takes the list form of
+    exactly one of X's arguments (e.g. `query` -> `queries`) and returns one text block per item.
+    Returns (batch_tool_name, item_arg, list_arg), or None if the tool has no batch counterpart.
+    """
+    batch_def = tools_by_name.get(f"{tool_def.name}_batch")
+    if batch_def is None:
+        return None
+    single_props = tool_def.inputSchema.get("properties", {})
+    batch_props = batch_def.inputSchema.get("properties", {})
+    item_args = [name for name in single_props if name not in batch_props]
+    list_args = [name for name, spec in batch_props.items() if name not in single_props and spec.get("type") == "array"]
+    if len(item_args) != 1 or len(list_args) != 1:
+        return None
+    return batch_def.name, item_args[0], list_args[0]
+
+class BatchedToolCaller:
+    """
+    Coalesces concurrent calls of one MCP tool into a single call of its `_batch` counterpart.
+    When the agent emits several parallel calls to e.g. `search_knowledge_base` in one step, LangChain runs
+    them concurrently; they are collected for BATCH_WINDOW_SECONDS and sent as one `search_knowledge_base_batch`
+    request (calls with different values for the other arguments are batched separately).
+    """
+    def __init__(self, pool: "ServerPool", tool_name: str, batch_tool_name: str, item_arg: str, list_arg: str):
+        self.pool = pool
+        self.tool_name = tool_name
+        self.batch_tool_name = batch_tool_name
+        self.item_arg = item_arg
+        self.list_arg = list_arg
+        self.pending = []  # (arguments, future)
+        self.flush_task = None
+
+    async def call(self, arguments: dict) -> CallToolResult:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((arguments, future))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(BATCH_WINDOW_SECONDS)
+        pending, self.pending, self.flush_task = self.pending, [], None
+
+        groups = {}
+        for arguments, future in pending:
+            shared = {k: v for k, v in arguments.items() if k != self.item_arg}
+            key = json.dumps(shared, sort_keys=True, default=str)
+            groups.setdefault(key, (shared, []))[1].append((arguments, future))
+        await asyncio.gather(*(self._dispatch(shared, calls) for shared, calls in groups.values()))
+
+    async def _dispatch(self, shared: dict, calls: list):
+        # A caller that was cancelled while waiting already has a done future: nothing to call or deliver for it
+        calls = [(arguments, future) for arguments, future in calls if not future.done()]
+        if not calls:
+            return
+        try:
+            if len(calls) > 1:
+                items = [arguments.get(self.item_arg) for arguments, _ in calls]
+                result = await self.pool.call_tool(self.batch_tool_name, arguments={**shared, self.list_arg: items})
+                if not result.isError and len(result.content) == len(calls):
+                    for (_, future), content in zip(calls, result.content):
+                        if not future.done():
+                            future.set_result(CallToolResult(content=[content], isError=False))
+                    return
+            # Single call, or the batch tool answered with something we can't split: call them individually,
+            # concurrently, so the fallback costs one round trip rather than one per call
+            results = await asyncio.gather(*(self.pool.call_tool(self.tool_name, arguments=arguments)
+                                             for arguments, _ in calls), return_exceptions=True)
+            for (_, future), result in zip(calls, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in calls:
+                if not future.done():
+                    future.set_exception(e)
+
+# --- 3. Tool Schema Cache ---
+# Tool definitions of every server from its last successful connect, so a restart can register tools before the
+# server is up. Set MCP_TOOL_CACHE_PATH to an empty string to disable.
+TOOL_CACHE_PATH = os.environ.get("MCP_TOOL_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mcp_tool_cache.json"))
+
+def server_cache_key(server_params: StdioServerParameters) -> str:
+    """
+    Identifies a server build: its command line and working directory, plus the size and mtime of every
+    argument that is a file (the server script), so editing or rebuilding the server invalidates its entry.
+    """
+    parts = [server_params.command, *server_params.args, server_params.cwd or ""]
+    for path in [server_params.command, *server_params.args]:
+        full_path = os.path.join(server_params.cwd or "", path)
+        if os.path.isfile(full_path):
+            stat = os.stat(full_path)
+            parts.append(f"{full_path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+class ToolSchemaCache:
+    """On-disk map of server name -> {key, server_version, tools} where tools are MCP tool definitions as JSON."""
+    def __init__(self, path: str = TOOL_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                # A corrupt cache only costs a cold start
+                self.entries = {}
+
+    def get(self, name: str, key: str) -> Optional[List[Tool]]:
+        entry = self.entries.get(name)
+        if entry is None or entry["key"] != key:
+            return None
+        return [Tool.model_validate(tool_json) for tool_json in entry["tools"]]
+
+    def put(self, name: str, key: str, server_version: Optional[str], tool_defs: List[Tool]):
+        if not self.path:
+            return
+        self.entries[name] = {
+            "key": key,
+            "server_version": server_version,
+            "tools": [tool_def.model_dump(mode="json", exclude_none=True) for tool_def in tool_defs],
+        }
+        # Write-then-rename so concurrent clients never read a half-written file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+@functools.lru_cache(maxsize=None)
+def args_schema_for(model_name: str, schema_json: str) -> Type[BaseModel]:
+    """jsonschema_to_pydantic memoized on the schema, so revalidating an unchanged tool reuses its model."""
+    return jsonschema_to_pydantic(json.loads(schema_json), model_name)
+
+# --- 4. Tool Result Cache ---
+# Bounds for the memoized results of all servers together
+TOOL_RESULT_CACHE_MAX_ENTRIES = 1024
+TOOL_RESULT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+def cache_ttl(policy) -> Optional[float]:
+    """Seconds a result stays valid under a cache policy: "never" (or None) -> None, "forever" -> inf, a number -> that many seconds."""
+    if policy is None or policy == "never":
+        return None
+    if policy == "forever":
+        return math.inf
+    return float(policy)
+
+def canonical_arguments(arguments: dict) -> str:
+    # None means "use the tool's default", so {"k": None} and {} are the same call
+    return json.dumps({k: v for k, v in arguments.items() if v is not None}, sort_keys=True, separators=(",", ":"), default=str)
+
+class ToolResultCache:
+    """
+    LRU cache of tool result texts keyed on (server, tool, canonical arguments), each entry with its own TTL.
+    Bounded by entry count and by the total size of the cached texts.
+    """
+    def __init__(self, max_entries: int = TOOL_RESULT_CACHE_MAX_ENTRIES, max_bytes: int = TOOL_RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, text, size in bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, text: str, ttl: float):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl, text, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: tuple):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# Shared by every client in the process, so run_interactive can report it in the execution trace
+tool_result_cache = ToolResultCache()
+
+def format_cache_activity(before: dict, after: dict) -> Optional[str]:
+    """One trace line for the cache lookups between two stats() snapshots, or None if there were none."""
+    hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+    if not hits + misses:
+        return None
+    return (f"🧠 Tool result cache: {hits}/{hits + misses} hits this turn "
+            f"(overall hit rate {after['hit_rate']:.0%}, {after['entries']} entries, {after['bytes'] / 1024:.1f} KB)")
+
+# --- 5. Session Pool ---
+# Tool calls (queueing included) that take longer than this are cancelled, unless the server or tool sets its own
+DEFAULT_CALL_TIMEOUT_SECONDS = 60.0
+# A server that stops answering pings (while idle) is respawned; respawns back off exponentially up to the maximum
+HEALTH_CHECK_INTERVAL_SECONDS = 10.0
+PING_TIMEOUT_SECONDS = 5.0
+RESPAWN_BACKOFF_SECONDS = 0.5
+MAX_RESPAWN_BACKOFF_SECONDS = 10.0
+
+def describe_error(error: BaseException) -> str:
+    """The innermost error's message: the SDK wraps transport failures in (nested) anyio task group exception groups."""
+    while isinstance(error, BaseExceptionGroup) and error.exceptions:
+        error = error.exceptions[0]
+    return str(error) or type(error).__name__
+
+def is_connection_lost(error: BaseException) -> bool:
+    """True for the errors a ClientSession raises once its server process has exited."""
+    if isinstance(error, McpError):
+        return error.error.code == CONNECTION_CLOSED
+    return isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream))
+
+def request_not_sent(error: BaseException) -> bool:
+    """
+    True for the connection errors ClientSession raises while handing a request to a closed transport: the server
+    never received it. Losing the connection while waiting for the response (McpError CONNECTION_CLOSED, EndOfStream)
+    leaves open whether the server ran it.
+    """
+    while isinstance(error, BaseExceptionGroup) and error.exceptions:
+        error = error.exceptions[0]
+    return isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError))
+
+class ToolCallLimits:
+    """
+    Timeouts and in-flight caps for one server's tool calls, with per-tool queue metrics.
+    `tools` maps a tool name to {"timeout": seconds, "max_concurrency": n, "retry": bool}; a `X_batch` tool uses
+    the settings of `X` unless it has its own. `max_concurrency` caps all of the server's calls together.
+    """
+    def __init__(self, timeout: float = DEFAULT_CALL_TIMEOUT_SECONDS, max_concurrency: Optional[int] = None,
+                 tools: Optional[dict] = None):
+        self.timeout = timeout
+        self.tool_settings = tools or {}
+        self.server_semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.tool_semaphores = {name: asyncio.Semaphore(settings["max_concurrency"])
+                                for name, settings in self.tool_settings.items() if settings.get("max_concurrency")}
+        self.metrics = {}  # tool name -> counters, see metrics_for
+
+    def settings_key(self, tool_name: str) -> str:
+        if tool_name not in self.tool_settings and tool_name.endswith("_batch"):
+            return tool_name[:-len("_batch")]
+        return tool_name
+
+    def timeout_for(self, tool_name: str) -> float:
+        return self.tool_settings.get(self.settings_key(tool_name), {}).get("timeout", self.timeout)
+
+    def retry_for(self, tool_name: str) -> bool:
+        """Whether a call may be sent again after its session died mid-call (only for tools that are safe to repeat)."""
+        return bool(self.tool_settings.get(self.settings_key(tool_name), {}).get("retry", False))
+
+    def metrics_for(self, tool_name: str) -> dict:
+        return self.metrics.setdefault(tool_name, {
+            "queued": 0, "max_queued": 0, "in_flight": 0, "calls": 0, "errors": 0, "timeouts": 0, "cancelled": 0,
+            "queue_wait_ms": 0.0,
+        })
+
+    @asynccontextmanager
+    async def limit(self, tool_name: str):
+        """Holds the tool's and the server's concurrency slots for the duration of one call, queueing for them if needed."""
+        metrics = self.metrics_for(tool_name)
+        # Always tool before server, so two calls can never each hold the semaphore the other waits for
+        semaphores = [s for s in (self.tool_semaphores.get(self.settings_key(tool_name)), self.server_semaphore) if s]
+        metrics["queued"] += 1
+        metrics["max_queued"] = max(metrics["max_queued"], metrics["queued"])
+        start = time.perf_counter()
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                await semaphore.acquire()
+                acquired.append(semaphore)
+        except BaseException:
+            for semaphore in acquired:
+                semaphore.release()
+            raise
+        finally:
+            metrics["queued"] -= 1
+        metrics["queue_wait_ms"] += (time.perf_counter() - start) * 1000
+        metrics["in_flight"] += 1
+        try:
+            yield
+        finally:
+            metrics["in_flight"] -= 1
+            for semaphore in acquired:
+                semaphore.release()
+
+class PooledSession:
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.in_flight = 0
+        self.respawns = 0
+        self.wake = asyncio.Event()  # set to make the owner task drop the session (dead, or pool closing)
+
+class ServerPool:
+    """
+    N stdio sessions to one server, each with its own server process, so CPU-bound servers (like the RAG server)
+    can answer several tool calls in parallel instead of queueing on one process. Nothing is spawned until
+    start(), or until the first tool call for pools that are never started explicitly (lazy servers).
+    Calls go to the least busy live session (round-robin between equally busy ones). A session whose process
+    exits, or that stops answering health-check pings, is respawned in the background; a call that hit a
+    dead session is retried once on another one.
+    """
+    def __init__(self, name: str, server_params: StdioServerParameters, size: int = 1, limits: Optional[ToolCallLimits] = None):
+        self.name = name
+        self.server_params = server_params
+        self.limits = limits or ToolCallLimits()
+        self.background_tasks = set()
+        self.slots = [PooledSession(i) for i in range(max(1, size))]
+        self.first_ready = asyncio.get_running_loop().create_future()  # (InitializeResult, ListToolsResult)
+        self.first_ready.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.available = asyncio.Event()  # set while at least one session is live
+        self.started = asyncio.Event()  # set once the server processes have been launched
+        self.closing = False
+        self.error = None
+        self.failed_slots = set()  # slots that failed before any session came up
+        self.next_slot = 0
+        self.tasks = []
+
+    def start(self):
+        if self.started.is_set():
+            return
+        self.started.set()
+        self.tasks = [asyncio.create_task(self._run_slot(slot), name=f"mcp-{self.name}-{slot.index}") for slot in self.slots]
+
+    async def _run_slot(self, slot: PooledSession):
+        """
+        Owns one session's stdio transport and ClientSession, respawning them until the pool closes. The MCP SDK's
+        contexts must be exited by the task that entered them, so every session gets its own long-lived task.
+        """
+        task = asyncio.current_task()
+        backoff = RESPAWN_BACKOFF_SECONDS
+        while not self.closing:
+            reason = None
+            slot.wake.clear()
+            try:
+                async with stdio_client(self.server_params) as (read, write):
+                    async with ClientSession(read, write) as session:
+                        init_result = await session.initialize()
+                        if not self.first_ready.done():
+                            mcp_tools = await session.list_tools()
+                            # Another session of the pool may have come up in the meantime
+                            if not self.first_ready.done():
+                                self.first_ready.set_result((init_result, mcp_tools))
+                        slot.session = session
+                        self._update_available()
+                        backoff = RESPAWN_BACKOFF_SECONDS
+                        reason = await self._supervise(slot)
+            except Exception as e:
+                reason = describe_error(e)
+                if not self.first_ready.done():
+                    # Every session failing before any came up means the server can't start at all; a single
+                    # slot failing repeatedly doesn't
+                    self.failed_slots.add(slot.index)
+                    if len(self.failed_slots) == len(self.slots):
+                        self.fail(e)
+            finally:
+                slot.session = None
+                self._update_available()
+            if task.cancelling():
+                # stdio_client's cancel scope can swallow the cancellation of this task; it is not a dead server
+                raise asyncio.CancelledError
+            if self.closing or self.error:
+                return
+            slot.respawns += 1
+            if self.first_ready.done():
+                print(f"   ♻️  Respawning {self.name} session {slot.index} in {backoff:.1f}s ({reason}).")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_RESPAWN_BACKOFF_SECONDS)
+
+    async def _supervise(self, slot: PooledSession) -> Optional[str]:
+        """Waits until the session is marked dead or the pool closes, pinging it while idle. Returns why it ended."""
+        while True:
+            try:
+                await asyncio.wait_for(slot.wake.wait(), HEALTH_CHECK_INTERVAL_SECONDS)
+                return None if self.closing else "connection lost"
+            except asyncio.TimeoutError:
+                pass
+            # A busy server may not answer pings until its current call is done; failed calls catch those
+            if slot.in_flight:
+                continue
+            try:
+                await asyncio.wait_for(slot.session.send_ping(), PING_TIMEOUT_SECONDS)
+            except Exception as e:
+                return f"health check failed: {describe_error(e)}"
+
+    def _update_available(self):
+        if any(slot.session is not None for slot in self.slots):
+            self.available.set()
+        else:
+            self.available.clear()
+
+    async def _acquire(self) -> PooledSession:
+        while True:
+            if self.error:
+                raise ConnectionError(f"{self.name} server is unavailable: {self.error}")
+            live = [slot for slot in self.slots if slot.session is not None]
+            if live:
+                # Least busy first; rotating the starting point spreads ties round-robin
+                self.next_slot = (self.next_slot + 1) % len(self.slots)
+                return min(live, key=lambda slot: (slot.in_flight, (slot.index - self.next_slot) % len(self.slots)))
+            # Startup or respawn in progress
+            await self.available.wait()
+
+    async def call_tool(self, tool_name: str, arguments: dict) -> CallToolResult:
+        """
+        Calls the tool within its concurrency limits and timeout. On timeout or cancellation the server is sent
+        a cancellation notification for the request, so it can stop working on it.
+        """
+        if not self.started.is_set() and not self.error:
+            # Lazy server: its processes are launched by the first call to one of its tools
+            print(f"   🚀 Starting {self.name} server for its first tool call ({tool_name}).")
+            self.start()
+        metrics = self.limits.metrics_for(tool_name)
+        timeout = self.limits.timeout_for(tool_name)
+        try:
+            async with asyncio.timeout(timeout):
+                async with self.limits.limit(tool_name):
+                    result = await self._call_with_retry(tool_name, arguments)
+        except TimeoutError:
+            metrics["timeouts"] += 1
+            raise TimeoutError(f"{tool_name} on {self.name} did not finish within {timeout:g}s") from None
+        except asyncio.CancelledError:
+            metrics["cancelled"] += 1
+            raise
+        except Exception:
+            metrics["errors"] += 1
+            raise
+        metrics["calls"] += 1
+        return result
+
+    async def _call_with_retry(self, tool_name: str, arguments: dict) -> CallToolResult:
+        for attempt in range(2):
+            slot = await self._acquire()
+            session = slot.session
+            slot.in_flight += 1
+            # The id call_tool is about to use: nothing is awaited between here and the request being numbered
+            request_id = session._request_id
+            try:
+                return await session.call_tool(tool_name, arguments=arguments)
+            except asyncio.CancelledError:
+                # The SDK stops waiting for the response but does not tell the server; fire and forget,
+                # since this task is being cancelled
+                task = asyncio.create_task(self._send_cancelled(session, request_id))
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
+                raise
+            except Exception as e:
+                if not is_connection_lost(e) or attempt:
+                    raise
+                if slot.session is session:
+                    # Out of rotation right away, so the retry waits for a live session (with a single-session
+                    # pool: the respawn) instead of being handed the dead one again
+                    slot.session = None
+                    self._update_available()
+                    slot.wake.set()
+                # The server may already have run a request it received; only tools marked safe to repeat resend it
+                if not (request_not_sent(e) or self.limits.retry_for(tool_name)):
+                    raise
+            finally:
+                slot.in_flight -= 1
+
+    @staticmethod
+    async def _send_cancelled(session: ClientSession, request_id: int):
+        try:
+            await session.send_notification(ClientNotification(CancelledNotification(
+                params=CancelledNotificationParams(requestId=request_id, reason="Cancelled by the client (timeout or aborted step)"))))
+        except Exception:
+            # The session is gone; so is the request
+            pass
+
+    def fail(self, error: BaseException):
+        """Gives up on the server: pending and future calls raise instead of waiting for a session."""
+        self.error = describe_error(error)
+        if not self.first_ready.done():
+            self.first_ready.set_exception(error)
+        for task in self.tasks:
+            task.cancel()
+        # Wake callers blocked in _acquire so they see the error
+        self.available.set()
+
+    def stats(self) -> List[dict]:
+        return [{"live": slot.session is not None, "in_flight": slot.in_flight, "respawns": slot.respawns} for slot in self.slots]
+
+    async def close(self):
+        self.closing = True
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        for slot in self.slots:
+            slot.wake.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+# --- 6. MCP Client Wrapper ---
+# How long one server may take to start, initialize and list its tools before it is skipped
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 30.0
+
 class MultiServerMCPClient:
-    def __init__(self):
-        self.exit_stack = AsyncExitStack()
-        self.sessions = []
+    def __init__(self, tool_cache: Optional[ToolSchemaCache] = None, result_cache: Optional[ToolResultCache] = None):
+        self.pools = {}  # server name -> ServerPool
+        self.cache_policies = {}  # server name -> default result cache policy of its tools
         self.tools = []
+        self.server_tools = {}  # server name -> {tool name: StructuredTool}
+        self.connect_latency = {}  # server name -> seconds until its tools were registered
+        self.revalidation_tasks = []
+        self.tool_cache = tool_cache if tool_cache is not None else ToolSchemaCache()
+        self.result_cache = result_cache if result_cache is not None else tool_result_cache
+
+    async def connect_servers(self, servers: List[dict]):
+        """
+        Connects all servers concurrently, each entry holding connect_server's keyword arguments.
+        Startup takes as long as the slowest server (or its timeout) instead of the sum of all of them.
+        Returns the names of the servers whose tools were registered.
+        """
+        start = time.perf_counter()
+        connected = await asyncio.gather(*(self.connect_server(**server) for server in servers))
+        names = [server["name"] for server, ok in zip(servers, connected) if ok]
+        print(f"🔌 Connected {len(names)}/{len(servers)} servers in {(time.perf_counter() - start) * 1000:.0f} ms "
+              f"({len(self.tools)} tools).")
+        return names
 
-    async def connect_server(self, name: str, command: str, args: List[str], cwd: Optional[str] = None, env: Optional[dict] = None):
-        print(f"🔌 Connecting to {name} server...")
+    async def connect_server(self, name: str, command: str, args: List[str], cwd: Optional[str] = None, env: Optional[dict] = None,
+                             timeout: float = DEFAULT_CONNECT_TIMEOUT_SECONDS, pool_size: int = 1,
+                             call_timeout: float = DEFAULT_CALL_TIMEOUT_SECONDS, max_concurrency: Optional[int] = None,
+                             tools: Optional[dict] = None, cache="never", startup: str = "eager") -> bool:
+        """
+        Starts a pool of `pool_size` server processes and registers their tools. Returns False if the server failed
+        to start or timed out.
+        `call_timeout` and `max_concurrency` bound every tool call of the server; `tools` overrides them per tool
+        (see ToolCallLimits).
+        `cache` is the result cache policy of the server's tools ("never", "forever" or a TTL in seconds), also
+        overridable per tool under `tools`.
+        With a tool cache entry for this exact server build, the cached tools are registered right away and the
+        server's own list_tools() answer is checked against them in the background; tool calls made before the
+        server is up wait for it.
+        A "lazy" `startup` registers the cached tools without spawning anything: the server is started by the first
+        call to one of its tools (and revalidated then). Without a cache entry its tools are unknown, so a lazy
+        server is started right away once, like an eager one, to list them.
+        """
+        if startup not in STARTUP_POLICIES:
+            raise ValueError(f"{name}: startup must be one of {', '.join(STARTUP_POLICIES)}, got {startup!r}")
+        print(f"🔌 Connecting to {name} server..." + (f" (pool of {pool_size})" if pool_size > 1 else ""))
         server_params = StdioServerParameters(command=command, args=args, cwd=cwd, env={**os.environ, **(env or {})})
 
+        start = time.perf_counter()
+        pool = ServerPool(name, server_params, pool_size, ToolCallLimits(call_timeout, max_concurrency, tools))
+        self.pools[name] = pool
+        self.cache_policies[name] = cache
+
+        cache_key = server_cache_key(server_params)
+        cached_tools = self.tool_cache.get(name, cache_key)
+        if cached_tools is not None:
+            self.register_tools(name, pool, cached_tools)
+            self.connect_latency[name] = time.perf_counter() - start
+            if startup == "lazy":
+                print(f"   💤 Registered {len(cached_tools)} cached tools for {name}; it starts on the first call to one of them.")
+            else:
+                pool.start()
+                print(f"   ⚡ Registered {len(cached_tools)} cached tools for {name} in {self.connect_latency[name] * 1000:.0f} ms, "
+                      f"revalidating in the background.")
+            self.revalidation_tasks.append(asyncio.create_task(
+                self._wait_for_server(name, pool, cache_key, timeout, start, cached_tools)))
+            return True
+        if startup == "lazy":
+            print(f"   ℹ️  No cached tool list for lazy server {name} yet; starting it once to discover its tools.")
+        pool.start()
+        return await self._wait_for_server(name, pool, cache_key, timeout, start)
+
+    async def _wait_for_server(self, name: str, pool: ServerPool, cache_key: str, timeout: float, start: float,
+                               cached_tools: Optional[List[Tool]] = None) -> bool:
+        if not pool.started.is_set():
+            # Lazy server: the connect timeout and latency count from its first tool call
+            await pool.started.wait()
+            start = time.perf_counter()
         try:
-            read, write = await self.exit_stack.enter_async_context(stdio_client(server_params))
-            session = await self.exit_stack.enter_async_context(ClientSession(read, write))
-            await session.initialize()
-            mcp_tools = await session.list_tools()
-            self.sessions.append(session)
-
-            for tool_def in mcp_tools.tools:
-                args_schema = jsonschema_to_pydantic(tool_def.inputSchema, f"{tool_def.name}Schema")
-
-                async def make_tool_func(tool_name=tool_def.name, **kwargs):
-                    try:
-                        result = await session.call_tool(tool_name, arguments=kwargs)
-                        if result.isError: return f"Tool Error: {result.content}"
-                        
-                        texts = [c.text for c in result.content if c.type == "text"]
-                        final_text = "\n".join(texts)
-                        return final_text if final_text.strip() else "Task completed."
-                    except Exception as e:
-                        return f"Execution Error: {str(e)}"
-
-                lc_tool = StructuredTool.from_function(
-                    func=None,
-                    coroutine=make_tool_func,
-                    name=tool_def.name,
-                    description=tool_def.description or f"MCP Tool: {tool_def.name}",
-                    args_schema=args_schema 
-                )
-                self.tools.append(lc_tool)
-                
-            print(f"   ✅ Connected to {name}. Found {len(mcp_tools.tools)} tools.")
+            init_result, mcp_tools = await asyncio.wait_for(asyncio.shield(pool.first_ready), timeout)
+        except asyncio.TimeoutError:
+            pool.fail(ConnectionError(f"no response within {timeout:.0f}s"))
+            print(f"   ❌ Failed to connect to {name}: no response within {timeout:.0f}s")
+            return False
         except Exception as e:
-            print(f"   ❌ Failed to connect to {name}: {e}")
+            print(f"   ❌ Failed to connect to {name}: {describe_error(e)}")
+            return False
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if cached_tools is None:
+            self.register_tools(name, pool, mcp_tools.tools)
+            self.connect_latency[name] = time.perf_counter() - start
+            print(f"   ✅ Connected to {name} in {elapsed_ms:.0f} ms. Found {len(mcp_tools.tools)} tools.")
+        elif [t.model_dump(mode="json") for t in cached_tools] == [t.model_dump(mode="json") for t in mcp_tools.tools]:
+            print(f"   ✅ {name} ready in {elapsed_ms:.0f} ms, cached tools are up to date.")
+        else:
+            self.register_tools(name, pool, mcp_tools.tools)
+            print(f"   🔄 {name} ready in {elapsed_ms:.0f} ms, tool definitions changed; registered tools were updated.")
+        self.tool_cache.put(name, cache_key, init_result.serverInfo.version, mcp_tools.tools)
+        return True
+
+    def register_tools(self, server_name: str, pool: ServerPool, tool_defs: List[Tool]):
+        """
+        Wraps the server's tools as LangChain StructuredTools. Registering a server again (after revalidation)
+        updates its existing tool objects in place, so agents that were already built with them see the change.
+        """
+        tools_by_name = {t.name: t for t in tool_defs}
+        registered = self.server_tools.setdefault(server_name, {})
+
+        for tool_def in tool_defs:
+            args_schema = args_schema_for(f"{tool_def.name}Schema", json.dumps(tool_def.inputSchema, sort_keys=True))
+
+            batch_info = find_batch_counterpart(tool_def, tools_by_name)
+            batcher = BatchedToolCaller(pool, tool_def.name, *batch_info) if batch_info else None
+
+            tool_settings = pool.limits.tool_settings.get(tool_def.name, {})
+            ttl = cache_ttl(tool_settings.get("cache", self.cache_policies.get(server_name)))
+
+            async def make_tool_func(tool_name=tool_def.name, batcher=batcher, cache_ttl_seconds=ttl, **kwargs):
+                cache_key = (server_name, tool_name, canonical_arguments(kwargs)) if cache_ttl_seconds else None
+                if cache_key:
+                    cached = self.result_cache.get(cache_key)
+                    if cached is not None:
+                        return cached
+                try:
+                    if batcher:
+                        result = await batcher.call(kwargs)
+                    else:
+                        # Waits for a live session while the server is starting or being respawned
+                        result = await pool.call_tool(tool_name, arguments=kwargs)
+                    if result.isError: return f"Tool Error: {result.content}"
+                    
+                    texts = [c.text for c in result.content if c.type == "text"]
+                    final_text = "\n".join(texts)
+                    final_text = final_text if final_text.strip() else "Task completed."
+                    # Only successful results are memoized; errors and timeouts are retried on the next call
+                    if cache_key:
+                        self.result_cache.put(cache_key, final_text, cache_ttl_seconds)
+                    return final_text
+                except Exception as e:
+                    return f"Execution Error: {describe_error(e)}"
+
+            description = tool_def.description or f"MCP Tool: {tool_def.name}"
+            lc_tool = registered.get(tool_def.name)
+            if lc_tool is not None:
+                lc_tool.description = description
+                lc_tool.args_schema = args_schema
+                lc_tool.coroutine = make_tool_func
+                continue
+            lc_tool = StructuredTool.from_function(
+                func=None,
+                coroutine=make_tool_func,
+                name=tool_def.name,
+                description=description,
+                args_schema=args_schema 
+            )
+            registered[tool_def.name] = lc_tool
+            self.tools.append(lc_tool)
+
+        for tool_name in [n for n in registered if n not in tools_by_name]:
+            print(f"   ⚠️  {server_name} no longer provides '{tool_name}'.")
+            self.tools.remove(registered.pop(tool_name))
+
+    async def call_tools(self, tool_calls: List[dict]) -> List[dict]:
+        """
+        Runs independent tool calls concurrently, each on its own server's pool, so the step takes as long as the
+        slowest call instead of the sum of all of them. `tool_calls` use the AIMessage.tool_calls format
+        ({"name", "args", "id"}). Returns one {"id", "name", "result", "elapsed_ms"} per call, in order.
+        """
+        tools_by_name = {t.name: t for t in self.tools}
+        timer = ToolStepTimer()
+
+        async def run(call):
+            lc_tool = tools_by_name.get(call["name"])
+            with timer.measure(call["name"]) as timing:
+                result = await lc_tool.ainvoke(call.get("args", {})) if lc_tool else f"Execution Error: unknown tool {call['name']}"
+            return {"id": call.get("id"), "name": call["name"], "result": result, "elapsed_ms": timing["elapsed_ms"]}
+
+        results = await asyncio.gather(*(run(call) for call in tool_calls))
+        timer.log_step()
+        return results
+
+    def call_stats(self) -> dict:
+        """Per-server, per-tool call counters: queue depth (current and max), in-flight calls, outcomes and total queue wait."""
+        return {name: pool.limits.metrics for name, pool in self.pools.items()}
 
     async def cleanup(self):
-        await self.exit_stack.aclose()
+        for task in self.revalidation_tasks:
+            task.cancel()
+        await asyncio.gather(*self.revalidation_tasks, *(pool.close() for pool in self.pools.values()), return_exceptions=True)
+
+# --- 7. Tool Step Timing ---
+class ToolStepTimer(AgentMiddleware):
+    """
+    Times the tool calls of every agent step. The tool calls of one AIMessage already run concurrently (the agent's
+    tool node starts them together and each goes to its server's pool); this makes the overlap visible. Each
+    ToolMessage gets its latency in response_metadata["latency_ms"] (not sent to the model), and before the next
+    model call the step is logged with its wall time next to the sum of its calls' latencies.
+    """
+    def __init__(self, log=print):
+        super().__init__()
+        self.log = log
+        self.step = []  # (tool name, start, end) of the calls since the last model call
+
+    @contextmanager
+    def measure(self, tool_name: str):
+        timing = {}
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            end = time.perf_counter()
+            timing["elapsed_ms"] = (end - start) * 1000
+            self.step.append((tool_name, start, end))
 
-# --- 3. Robust Todo Tool Definition ---
+    def log_step(self):
+        if not self.step:
+            return
+        wall_ms = (max(end for _, _, end in self.step) - min(start for _, start, _ in self.step)) * 1000
+        sum_ms = sum(end - start for _, start, end in self.step) * 1000
+        slowest = max(self.step, key=lambda call: call[2] - call[1])[0]
+        self.log(f"   ⏱️  Tool step: {len(self.step)} call(s) in {wall_ms:.0f} ms (sum {sum_ms:.0f} ms, "
+                 f"{sum_ms / max(wall_ms, 1e-3):.1f}x overlap, slowest {slowest})")
+        self.step = []
+
+    async def awrap_tool_call(self, request, handler):
+        with self.measure(request.tool_call["name"]) as timing:
+            result = await handler(request)
+        if isinstance(result, ToolMessage):
+            result.response_metadata["latency_ms"] = round(timing["elapsed_ms"], 1)
+        return result
+
+    async def abefore_model(self, state, runtime):
+        self.log_step()
+
+    async def aafter_agent(self, state, runtime):
+        self.log_step()
+
+def format_latency(msg: ToolMessage) -> str:
+    latency = msg.response_metadata.get("latency_ms")
+    return f" ({latency:.0f} ms)" if latency is not None else ""
+
+# --- 8. Server Registry ---
+# The servers to connect, as a JSON file: {"servers": [{"name": ..., "command": ..., "args": [...], ...}]}.
+# Set MCP_SERVERS_CONFIG to use another file.
+SERVER_REGISTRY_PATH = os.environ.get("MCP_SERVERS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_servers.json"))
+STARTUP_POLICIES = ("eager", "lazy")
+
+def load_server_registry(path: str = SERVER_REGISTRY_PATH) -> List[dict]:
+    """
+    Reads the server registry into connect_servers() entries. Every entry holds connect_server's keyword arguments
+    (name, command, args, cwd, env, startup, pool_size, ...) plus an optional "description" that is ignored.
+    Entries with "enabled": false are skipped (e.g. an alternative backend that serves the same tools).
+    Environment variables and ~ are expanded in command, args, cwd and env values. A relative `cwd` is relative
+    to the registry file; command and args starting with ./ or ../ are relative to the server's cwd, or to the
+    registry file when the server has none (it then runs in the client's working directory).
+    """
+    registry_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)["servers"]
+
+    allowed = set(inspect.signature(MultiServerMCPClient.connect_server).parameters) - {"self"}
+    expand = lambda value: os.path.expanduser(os.path.expandvars(value))
+    servers = []
+    for entry in entries:
+        if not entry.get("enabled", True):
+            continue
+        server = {key: value for key, value in entry.items() if key not in ("description", "enabled")}
+        name = server.get("name", "<unnamed>")
+        missing = [key for key in ("name", "command") if key not in server]
+        unknown = sorted(set(server) - allowed)
+        if missing or unknown:
+            raise ValueError(f"{path}: server {name}: " + "; ".join(
+                ([f"missing {', '.join(missing)}"] if missing else []) + ([f"unknown keys {', '.join(unknown)}"] if unknown else [])))
+        if server.get("startup", "eager") not in STARTUP_POLICIES:
+            raise ValueError(f"{path}: server {name}: startup must be one of {', '.join(STARTUP_POLICIES)}")
+
+        if server.get("cwd"):
+            server["cwd"] = os.path.normpath(os.path.join(registry_dir, expand(server["cwd"])))
+        base = server.get("cwd") or registry_dir
+        resolve = lambda value: os.path.normpath(os.path.join(base, value)) if value.startswith(("./", "../")) else value
+        server["command"] = resolve(expand(server["command"]))
+        server["args"] = [resolve(expand(arg)) for arg in server.get("args", [])]
+        if server.get("env"):
+            server["env"] = {key: expand(str(value)) for key, value in server["env"].items()}
+        servers.append(server)
+    return servers
+
+# --- 9. Robust Todo Tool Definition ---
 class TodoItem(BaseModel):
     task: str = Field(..., description="The task description")
     status: str = Field(..., description="Status: 'pending', 'in_progress', or 'completed'")
@@ -116,22 +895,12 @@ def write_todos(todos: List[TodoItem]):
     formatted = "\n".join([f"{i+1}. [{t.status.upper()}] {t.task}" for i, t in enumerate(todos)])
     return f"Current Plan:\n{formatted}"
 
-# --- 4. Main ---
+# --- 10. Main ---
 async def main():
-    base_dir = os.getcwd() 
-    math_server = os.path.join(base_dir, "../javascript-mcp-and-agents/math_server.js")
-    memory_server = os.path.join(base_dir, "../javascript-mcp-and-agents/memory_server.js")
-    weather_server = os.path.join(base_dir, "../typescript-weather-mcp-server", "build", "index.js")
-    rag_server = os.path.join(base_dir, "../python-rag-mcp-server/rag_server.py")
-    venv_python = os.path.join(base_dir, "../python-rag-mcp-server/mcp-rag-env", "bin", "python")
-
     client = MultiServerMCPClient()
     try:
-        await client.connect_server("math", "node", [math_server])
-        await client.connect_server("weather", "node", [weather_server])
-        await client.connect_server("memory", "node", [memory_server])
-        rag_server_dir = os.path.join(base_dir, "../python-rag-mcp-server")
-        await client.connect_server("rag", venv_python, [rag_server], cwd=rag_server_dir)
+        # Eager servers start in parallel, lazy ones on the first call to one of their tools (see mcp_servers.json)
+        await client.connect_servers(load_server_registry())
 
         model = ChatVertexAI(model="gemini-2.5-flash", temperature=0)
 
@@ -155,7 +924,7 @@ async def main():
         agent = create_agent(
             model=model,
             tools=all_tools, 
-            middleware=[TodoListMiddleware(), hitl_middleware],
+            middleware=[ToolStepTimer(), TodoListMiddleware(), hitl_middleware],
             checkpointer=InMemorySaver(),
             system_prompt=system_prompt 
         )
@@ -185,11 +954,13 @@ async def main():
         await run_interactive(agent, "Check the weather in Plano, TX and then multiply the temperature by 2.", {"configurable": {"thread_id": "test_todo"}})
 
     finally:
+        print(f"\n📊 Tool call stats: {json.dumps(client.call_stats())}")
         print("\nClosing MCP connections...")
         await client.cleanup()
 
 async def run_interactive(agent, query, config):
     print(f"User: '{query}'")
+    cache_before = tool_result_cache.stats()
     try:
         response = await agent.ainvoke({"messages": [{"role": "user", "content": query}]}, config=config)
 
@@ -251,7 +1022,11 @@ async def run_interactive(agent, query, config):
                     content = " ".join([c.get('text', '') for c in content if isinstance(c, dict) and 'text' in c])
                 
                 display_content = (content[:150] + '...') if len(content) > 150 else content
-                print(f"[Step {i}] ✅ MCP Server returned: {display_content}")
+                print(f"[Step {i}] ✅ MCP Server returned{format_latency(msg)}: {display_content}")
+
+        cache_activity = format_cache_activity(cache_before, tool_result_cache.stats())
+        if cache_activity:
+            print(cache_activity)
 
         # Final Answer
         last_msg = response['messages'][-1]
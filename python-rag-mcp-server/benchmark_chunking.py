@@ -0,0 +1,106 @@
+import time
+import argparse
+import numpy as np
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+from benchmark_rag import format_bytes
+from create_faiss_index import list_documents, read_document
+from sentence_chunker import DEFAULT_MIN_CHARS, DEFAULT_MAX_CHARS, iter_chunks
+
+# Chunking throughput on the documents in knowledge_base/: the regular-expression chunker of
+# sentence_chunker.py against the NLTK chunker it replaced (Punkt sentence splitting, then two
+# grouping passes), with the number of chunks on which both agree.
+# The reference uses NLTK's pretrained English Punkt model when its data is installed
+# (nltk.download('punkt_tab')), and otherwise an untrained Punkt tokenizer, which knows no
+# abbreviations and so also splits after "vs." or "U.S.".
+# `--replicate N` joins N copies of every document, to time larger inputs.
+
+def punkt_tokenizer():
+    """NLTK's pretrained English tokenizer if installed, else an untrained one. Returns (tokenize, name)."""
+    try:
+        from nltk.tokenize import sent_tokenize
+        sent_tokenize("Probe.")
+        return sent_tokenize, "punkt (pretrained)"
+    except LookupError:
+        return PunktSentenceTokenizer().tokenize, "punkt (untrained)"
+
+def nltk_splitter(tokenize, text, min_chars=DEFAULT_MIN_CHARS, max_chars=DEFAULT_MAX_CHARS):
+    """The original sentence_splitter() of create_faiss_index.py, with the sentence tokenizer passed in."""
+    sentences = tokenize(text)
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    for sentence in sentences:
+        sentence_length = len(sentence)
+        if current_length + sentence_length + len(current_chunk) > max_chars and current_chunk:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [sentence]
+            current_length = sentence_length
+        else:
+            current_chunk.append(sentence)
+            current_length += sentence_length
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+
+    final_chunks = []
+    buffer_chunk = ""
+    for chunk in chunks:
+        if len(buffer_chunk) + len(chunk) < min_chars:
+            buffer_chunk += (" " if buffer_chunk else "") + chunk
+        else:
+            if buffer_chunk:
+                final_chunks.append(buffer_chunk)
+            buffer_chunk = chunk
+    if buffer_chunk:
+        final_chunks.append(buffer_chunk)
+    if not final_chunks and text.strip():
+        final_chunks.append(text.strip())
+    return final_chunks
+
+def time_chunker(chunk_fn, texts, repeat):
+    """Chunks every text `repeat` times. Returns the seconds of each round and the chunks of the last one."""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = [chunk_fn(text) for text in texts]
+        rounds.append(time.perf_counter() - start)
+    return np.array(rounds), chunks
+
+def run_benchmark(repeat=20, times=1, overlap=0):
+    texts = ["\n\n".join([read_document(filename)] * times) for filename in list_documents()]
+    nbytes = sum(len(text.encode("utf-8")) for text in texts)
+    print(f"Corpus: {len(texts)} documents, {format_bytes(nbytes)}, {repeat} rounds")
+
+    tokenize, reference = punkt_tokenizer()
+    chunkers = [
+        (reference, lambda text: nltk_splitter(tokenize, text)),
+        ("regex", lambda text: [chunk for chunk, _, _ in iter_chunks(text)]),
+    ]
+    if overlap:
+        chunkers.append((f"regex +{overlap}", lambda text: [chunk for chunk, _, _ in iter_chunks(text, overlap=overlap)]))
+
+    rows = []
+    reference_chunks = None
+    for name, chunk_fn in chunkers:
+        rounds, chunks = time_chunker(chunk_fn, texts, repeat)
+        if reference_chunks is None:
+            reference_chunks = chunks
+        num_chunks = sum(len(document) for document in chunks)
+        same = sum(a == b for document, ref in zip(chunks, reference_chunks) for a, b in zip(document, ref))
+        rows.append((name, num_chunks, same, rounds))
+
+    print(f"\n{'chunker':<22}{'chunks':>8}{'same':>8}{'p50 ms':>10}{'MB/s':>10}{'chunks/s':>12}{'speedup':>9}")
+    baseline = np.median(rows[0][3])
+    for name, num_chunks, same, rounds in rows:
+        seconds = np.median(rounds)
+        print(f"{name:<22}{num_chunks:>8}{same:>8}{seconds * 1000:>10.2f}{nbytes / 1e6 / seconds:>10.1f}"
+              f"{num_chunks / seconds:>12.0f}{baseline / seconds:>8.1f}x")
+    print(f"\n'same': chunks identical to the {reference} reference at the same position.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sentence chunking throughput against the NLTK chunker.")
+    parser.add_argument("--repeat", type=int, default=20, help="Rounds over the documents (default: 20)")
+    parser.add_argument("--replicate", type=int, default=1, help="Join this many copies of every document (default: 1)")
+    parser.add_argument("--overlap", type=int, default=0, help="Also time chunks with this much sentence overlap (default: 0)")
+    cli_args = parser.parse_args()
+    run_benchmark(cli_args.repeat, cli_args.replicate, cli_args.overlap)
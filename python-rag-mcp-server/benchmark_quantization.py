@@ -0,0 +1,131 @@
+import os
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import faiss
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from benchmark_rag import SAMPLE_QUERIES, format_bytes, time_queries
+from create_faiss_index import load_chunks
+from quantization import DEFAULT_RERANK, DEFAULT_PQ_M, quantize, rerank
+
+# Index size, resident memory after loading, per-query latency and recall@k (against the exact
+# float32 index) of the storage settings in quantization.py, on either
+#   * tfidf:      the flat backend's dense TF-IDF vectors of knowledge_base/, queried with the
+#                 sample queries,
+#   * embeddings: the MiniLM vectors of the vector store in faiss_index/ built by
+#                 rag_pipeline_usage_example.py, queried with a sample of the stored vectors
+#                 plus noise (so the embedding model isn't needed).
+# Re-ranked settings read the float32 vectors of their candidates from a memory-mapped copy, like
+# the embedding store does (rag_server.py recomputes them from the chunk text instead).
+# `--replicate N` tiles the corpus N times with small noise, to see the settings at a larger scale;
+# recall then counts a hit on any copy of the right chunk, since the copies stand for the same text.
+
+EMBEDDING_INDEX_PATH = "faiss_index/index.faiss"
+ORIGINAL_VECTORS_PATH = "faiss_index/index_vectors.npy"
+
+SETTINGS = [("none", 0), ("fp16", 0), ("sq8", 0), ("sq8", DEFAULT_RERANK), ("pq", 0), ("pq", DEFAULT_RERANK)]
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def load_rss(path):
+    """Runs in a fresh process: resident memory added by reading the index at `path`."""
+    before = rss_bytes()
+    index = faiss.read_index(path)
+    loaded = rss_bytes() - before
+    del index
+    return loaded
+
+def tfidf_dataset():
+    chunks = load_chunks()
+    vectorizer = TfidfVectorizer()
+    vectors = vectorizer.fit_transform(chunks).toarray().astype('float32')
+    queries = vectorizer.transform(SAMPLE_QUERIES).toarray().astype('float32')
+    return vectors, queries
+
+def embedding_dataset(num_queries=50, seed=0):
+    index = faiss.read_index(EMBEDDING_INDEX_PATH)
+    if isinstance(index, faiss.IndexFlat):
+        vectors = index.reconstruct_n(0, index.ntotal)
+    elif os.path.exists(ORIGINAL_VECTORS_PATH):
+        vectors = np.load(ORIGINAL_VECTORS_PATH)
+    else:
+        raise SystemExit(f"{EMBEDDING_INDEX_PATH} is quantized and {ORIGINAL_VECTORS_PATH} is missing; "
+                         "rebuild the store with --quantization none or with re-ranking")
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+    noise = rng.normal(scale=vectors.std() * 0.5, size=sample.shape)
+    return vectors.astype('float32'), (sample + noise).astype('float32')
+
+def replicate(vectors, times, seed=0):
+    """The corpus tiled `times` times, every copy but the first jittered so neighbours stay distinct."""
+    if times <= 1:
+        return vectors
+    rng = np.random.default_rng(seed)
+    copies = [vectors] + [vectors + rng.normal(scale=vectors.std() * 0.05, size=vectors.shape).astype('float32')
+                          for _ in range(times - 1)]
+    return np.concatenate(copies)
+
+def chunk_recall(results, ground_truth, num_chunks):
+    """Fraction of the distinct chunks in the exact top-k that a setting also returned (any copy), averaged over queries."""
+    chunks = lambda ids: {int(i) % num_chunks for i in ids if i >= 0}
+    return float(np.mean([len(chunks(r) & chunks(g)) / max(1, len(chunks(g))) for r, g in zip(results, ground_truth)]))
+
+def run_benchmark(dataset="tfidf", k=3, repeat=20, times=1, pq_m=DEFAULT_PQ_M):
+    vectors, queries = tfidf_dataset() if dataset == "tfidf" else embedding_dataset()
+    num_chunks = len(vectors)
+    vectors = replicate(vectors, times)
+    print(f"Corpus: {len(vectors)} {dataset} vectors of {vectors.shape[1]} dimensions "
+          f"({format_bytes(vectors.nbytes)} as float32), k={k}, {repeat} rounds of {len(queries)} queries")
+
+    workdir = tempfile.mkdtemp(prefix="rag-quantization-")
+    originals_path = os.path.join(workdir, "vectors.npy")
+    np.save(originals_path, vectors)
+    originals = np.load(originals_path, mmap_mode="r")
+    query_rows = [query[None] for query in queries]
+
+    rows = []
+    ground_truth = None
+    # A fresh process per load, so RSS isn't shared with earlier settings or this process's own heap
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1) as pool:
+        for quantization, depth in SETTINGS:
+            index = quantize(vectors, quantization, pq_m)
+            path = os.path.join(workdir, f"{quantization}.faiss")
+            faiss.write_index(index, path)
+            if depth:
+                search_fn = lambda query, index=index, depth=depth: rerank(
+                    query, index.search(query, k * depth)[1], lambda ids: originals[ids], k)
+            else:
+                search_fn = lambda query, index=index: index.search(query, k)
+            latencies, results = time_queries(search_fn, query_rows, repeat)
+            if ground_truth is None:
+                ground_truth = results
+            rows.append((quantization, f"x{depth}" if depth else "-", os.path.getsize(path),
+                         vectors.nbytes if depth else 0, pool.submit(load_rss, path).result(),
+                         latencies, chunk_recall(results, ground_truth, num_chunks)))
+
+    print(f"\n{'storage':<8}{'rerank':<8}{'index size':>12}{'+ on disk':>12}{'RSS load':>12}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{f'recall@{k}':>11}")
+    for quantization, depth, size, extra, rss, latencies, recall in rows:
+        print(f"{quantization:<8}{depth:<8}{format_bytes(size):>12}{format_bytes(extra) if extra else '-':>12}"
+              f"{format_bytes(rss):>12}{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 95):>10.3f}"
+              f"{recall:>11.3f}")
+    print("\n'+ on disk': float32 vectors kept for re-ranking (memory-mapped, only candidates are read).")
+    del originals
+    shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark size, memory, latency and recall of quantized vector storage.")
+    parser.add_argument("--dataset", choices=["tfidf", "embeddings"], default="tfidf",
+                        help="tfidf: the flat backend's vectors; embeddings: the MiniLM vector store (default: tfidf)")
+    parser.add_argument("-k", type=int, default=3, help="Results per query (default: 3)")
+    parser.add_argument("--repeat", type=int, default=20, help="Rounds over the queries (default: 20)")
+    parser.add_argument("--replicate", type=int, default=1, help="Tile the corpus this many times (default: 1)")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M, help=f"PQ sub-quantizers (default: {DEFAULT_PQ_M})")
+    cli_args = parser.parse_args()
+    run_benchmark(cli_args.dataset, cli_args.k, cli_args.repeat, cli_args.replicate, cli_args.pq_m)
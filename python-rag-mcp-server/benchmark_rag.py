@@ -0,0 +1,113 @@
+import time
+import argparse
+import numpy as np
+import faiss
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from create_faiss_index import load_chunks
+from sparse_index import build_sparse_index, search_sparse_index, sparse_index_nbytes
+from lsa_index import DEFAULT_LSA_DIM, fit_lsa_projection, project, build_lsa_index, set_search_params
+
+# Compares the retrieval backends built by create_faiss_index.py on the documents in
+# knowledge_base/: index memory footprint, per-query search latency and recall@k
+# against the exact flat index.
+
+NPROBE_SWEEP = [1, 2, 4, 8, 16, 32]
+EF_SEARCH_SWEEP = [16, 32, 64, 128, 256]
+
+SAMPLE_QUERIES = [
+    "What are the key concepts of Object-Oriented Programming?",
+    "Explain variables in Python.",
+    "Who invented the World Wide Web?",
+    "What is supervised learning?",
+    "What does the Constitution say about Congress?",
+    "How does a neural network learn from data?",
+    "What was ARPANET?",
+    "What is polymorphism?",
+]
+
+def format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+def time_queries(search_fn, queries, repeat):
+    """
+    Runs every query `repeat` times, one at a time.
+    Returns per-query latencies in milliseconds and the result ids of the last round (one row per query).
+    """
+    latencies = []
+    for _ in range(repeat):
+        results = []
+        for query in queries:
+            start = time.perf_counter()
+            _, indices = search_fn(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append(indices[0])
+    return np.array(latencies), results
+
+def recall_at_k(results, ground_truth):
+    """Fraction of the exact top-k ids that a backend also returned, averaged over queries."""
+    hits = [len(set(r[r >= 0]) & set(g[g >= 0])) / max(1, np.count_nonzero(g >= 0)) for r, g in zip(results, ground_truth)]
+    return float(np.mean(hits))
+
+def print_report(rows, k):
+    print(f"\n{'backend':<12}{'params':<14}{'index size':>12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{f'recall@{k}':>11}")
+    for name, params, nbytes, latencies, recall in rows:
+        print(f"{name:<12}{params:<14}{format_bytes(nbytes):>12}"
+              f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 95):>10.3f}{latencies.mean():>10.3f}"
+              f"{recall:>11.3f}")
+
+def run_benchmark(k=3, repeat=50, lsa_dim=DEFAULT_LSA_DIM):
+    chunks = load_chunks()
+    vectorizer = TfidfVectorizer()
+    embeddings = vectorizer.fit_transform(chunks)
+    print(f"Corpus: {len(chunks)} chunks, vocabulary size {embeddings.shape[1]}, k={k}, {repeat} rounds of {len(SAMPLE_QUERIES)} queries")
+
+    rows = []
+
+    # Current path: dense vocabulary-width vectors in an exact L2 index; its results are the recall ground truth
+    flat_index = faiss.IndexFlatL2(embeddings.shape[1])
+    flat_index.add(embeddings.toarray().astype('float32'))
+    flat_search = lambda q: flat_index.search(vectorizer.transform([q]).toarray().astype('float32'), k)
+    latencies, ground_truth = time_queries(flat_search, SAMPLE_QUERIES, repeat)
+    rows.append(("flat", "-", faiss.serialize_index(flat_index).nbytes, latencies, 1.0))
+
+    def add_row(name, params, nbytes, search_fn):
+        latencies, results = time_queries(search_fn, SAMPLE_QUERIES, repeat)
+        rows.append((name, params, nbytes, latencies, recall_at_k(results, ground_truth)))
+
+    sparse_index = build_sparse_index(embeddings)
+    add_row("sparse", "-", sparse_index_nbytes(sparse_index),
+            lambda q: search_sparse_index(sparse_index, vectorizer.transform([q]), k))
+
+    # Approximate indexes over LSA-projected vectors, swept over their query-time knob
+    svd = fit_lsa_projection(embeddings, lsa_dim)
+    lsa_vectors = project(svd, embeddings)
+    lsa_search = lambda index: (lambda q: index.search(project(svd, vectorizer.transform([q])), k))
+    print(f"LSA projection: {lsa_vectors.shape[1]} dimensions")
+
+    ivfpq_index = build_lsa_index(lsa_vectors, "lsa-ivfpq")
+    for nprobe in NPROBE_SWEEP:
+        if nprobe > ivfpq_index.nlist:
+            break
+        set_search_params(ivfpq_index, nprobe=nprobe)
+        add_row("lsa-ivfpq", f"nprobe={nprobe}", faiss.serialize_index(ivfpq_index).nbytes, lsa_search(ivfpq_index))
+
+    hnsw_index = build_lsa_index(lsa_vectors, "lsa-hnsw")
+    for ef_search in EF_SEARCH_SWEEP:
+        set_search_params(hnsw_index, ef_search=ef_search)
+        add_row("lsa-hnsw", f"ef={ef_search}", faiss.serialize_index(hnsw_index).nbytes, lsa_search(hnsw_index))
+
+    print_report(rows, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark memory and latency of the RAG index backends.")
+    parser.add_argument("-k", type=int, default=3, help="Results per query (default: 3)")
+    parser.add_argument("--repeat", type=int, default=50, help="Rounds over the sample queries (default: 50)")
+    parser.add_argument("--lsa-dim", type=int, default=DEFAULT_LSA_DIM,
+                        help=f"TruncatedSVD output dimension for the lsa-* backends (default: {DEFAULT_LSA_DIM})")
+    cli_args = parser.parse_args()
+    run_benchmark(k=cli_args.k, repeat=cli_args.repeat, lsa_dim=cli_args.lsa_dim)
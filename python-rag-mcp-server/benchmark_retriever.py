@@ -0,0 +1,71 @@
+import time
+import argparse
+import numpy as np
+
+from benchmark_rag import SAMPLE_QUERIES
+from rag_pipeline_usage_example import Retriever, load_vector_store
+
+# Per-query latency of the sentence-transformers retriever in rag_pipeline_usage_example.py:
+#   * reload:   what retrieve_chunks() used to do, constructing the embedding model and
+#               deserializing the vector store for every query,
+#   * resident: one Retriever serving every query,
+#   * batch:    the resident Retriever embedding a whole batch of queries in one model call
+#               (what search_knowledge_base_batch does), reported per query.
+
+def summarize(latencies):
+    latencies = np.asarray(latencies)
+    return f"{np.percentile(latencies, 50):>10.1f}{np.percentile(latencies, 95):>10.1f}{latencies.mean():>10.1f}"
+
+def time_reload(queries, k):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        vector_store, _ = load_vector_store(log=lambda message: None)
+        vector_store.similarity_search(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def time_resident(retriever, queries, k, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            retriever.retrieve(query, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def time_batch(retriever, queries, k, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        retriever.retrieve_with_scores(queries, k)
+        latencies.append((time.perf_counter() - start) * 1000 / len(queries))
+    return latencies
+
+def run_benchmark(k=4, repeat=20, reload_queries=3):
+    start = time.perf_counter()
+    retriever = Retriever(log=lambda message: None)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"Retriever loaded in {load_ms:.0f} ms (model {retriever.load_timings['model']:.0f} ms, "
+          f"vector store {retriever.load_timings['vector_store']:.0f} ms), {len(retriever)} chunks, k={k}")
+    # Warm the model's first-call overheads before timing
+    retriever.retrieve(SAMPLE_QUERIES[0], k)
+
+    rows = [
+        ("reload", time_reload(SAMPLE_QUERIES[:reload_queries], k)),
+        ("resident", time_resident(retriever, SAMPLE_QUERIES, k, repeat)),
+        ("batch", time_batch(retriever, SAMPLE_QUERIES, k, repeat)),
+    ]
+    print(f"\n{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, latencies in rows:
+        print(f"{name:<10}{summarize(latencies)}")
+    reload_mean, resident_mean = np.mean(rows[0][1]), np.mean(rows[1][1])
+    print(f"\nResident retriever: {reload_mean / resident_mean:.0f}x faster per query than reloading.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-query latency of the embedding retriever, reloaded vs resident.")
+    parser.add_argument("--k", type=int, default=4, help="Chunks per query")
+    parser.add_argument("--repeat", type=int, default=20, help="Rounds over the sample queries for the resident modes")
+    parser.add_argument("--reload-queries", type=int, default=3, help="Queries timed in reload mode (each reloads everything)")
+    args = parser.parse_args()
+    run_benchmark(args.k, args.repeat, args.reload_queries)
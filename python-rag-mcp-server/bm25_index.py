@@ -0,0 +1,134 @@
+import numpy as np
+import scipy.sparse as sp
+from sparse_index import build_sparse_index
+
+# Okapi BM25 keyword retrieval over precomputed postings, and reciprocal rank fusion
+# of its results with the vector index (hybrid search).
+#
+# The BM25 weight of every (chunk, term) pair only depends on the corpus, so it is
+# computed at build time and stored as a CSC chunk x vocabulary matrix, the same
+# inverted-index layout as the sparse backend. Scoring a query then only reads and
+# sums the postings lists of the query's terms. Raw term counts are
+# kept next to the weights so incremental builds can recompute IDF and the average
+# chunk length without re-tokenizing the corpus.
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+DEFAULT_RRF_K = 60
+
+
+def term_counts(analyzer, vocabulary, texts):
+    """
+    Chunk x vocabulary term count matrix (CSR) for `texts`.
+    Tokens are produced by the TF-IDF vectorizer's analyzer and terms outside its vocabulary are dropped,
+    so BM25 and the vector index agree on what a term is.
+    """
+    indices = []
+    indptr = [0]
+    for text in texts:
+        indices.extend(vocabulary[token] for token in analyzer(text) if token in vocabulary)
+        indptr.append(len(indices))
+    counts = sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(texts), len(vocabulary)),
+    )
+    counts.sum_duplicates()
+    return counts
+
+
+def bm25_weights(counts, k1=DEFAULT_K1, b=DEFAULT_B):
+    """
+    BM25 weight matrix (CSC, chunk x vocabulary) from raw term counts.
+    Empty rows (removed chunks) don't count towards the number of chunks or the average chunk length.
+    """
+    tf = sp.csr_matrix(counts, dtype=np.float32)
+    doc_len = np.asarray(tf.sum(axis=1)).ravel()
+    live = doc_len > 0
+    n_docs = max(1, int(live.sum()))
+    avg_len = float(doc_len[live].mean()) if live.any() else 1.0
+    # Counts are summed per (chunk, term), so the non-zeros of a column are its document frequency
+    df = np.bincount(tf.indices, minlength=tf.shape[1])
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+    row_len = np.repeat(doc_len, np.diff(tf.indptr))
+    data = idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + k1 * (1 - b + b * row_len / avg_len))
+    weights = sp.csr_matrix((data.astype(np.float32), tf.indices, tf.indptr), shape=tf.shape)
+    return build_sparse_index(weights)
+
+
+def search_bm25(weights, query_counts, k, allowed_ids=None):
+    """
+    BM25 top-k search. The score of a chunk is the sum of its weights for the query terms (counted with multiplicity).
+    Only the postings of the query's terms are read: they are sliced straight out of the CSC arrays, concatenated,
+    and summed per chunk, so the cost grows with the postings length rather than the number of chunks.
+    Args:
+        weights: CSC chunk x vocabulary matrix from bm25_weights.
+        query_counts: Query x vocabulary term count matrix from term_counts.
+        k (int): Number of results per query.
+        allowed_ids: Optional array of chunk ids; other chunks are dropped before the top-k selection.
+    Returns:
+        (scores, indices): Arrays of shape (n_queries, k), best first, laid out like faiss Index.search.
+        Slots without a match have index -1 and score 0.
+    """
+    query_counts = sp.csr_matrix(query_counts, dtype=np.float32)
+    allowed = None
+    if allowed_ids is not None:
+        allowed = np.zeros(weights.shape[0], dtype=bool)
+        allowed[np.asarray(allowed_ids, dtype=np.int64)] = True
+
+    n_queries = query_counts.shape[0]
+    out_scores = np.zeros((n_queries, k), dtype=np.float32)
+    out_indices = np.full((n_queries, k), -1, dtype=np.int64)
+
+    for row in range(n_queries):
+        start, end = query_counts.indptr[row], query_counts.indptr[row + 1]
+        terms, multiplicity = query_counts.indices[start:end], query_counts.data[start:end]
+        postings = [(weights.indptr[term], weights.indptr[term + 1]) for term in terms]
+        if not postings:
+            continue
+        row_ids = np.concatenate([weights.indices[lo:hi] for lo, hi in postings])
+        row_scores = np.concatenate([weights.data[lo:hi] * m for (lo, hi), m in zip(postings, multiplicity)])
+        if len(postings) > 1:
+            # A chunk appears once per matching query term: sum its contributions
+            row_ids, slot = np.unique(row_ids, return_inverse=True)
+            row_scores = np.bincount(slot, weights=row_scores, minlength=len(row_ids))
+        if allowed is not None:
+            keep = allowed[row_ids]
+            row_scores, row_ids = row_scores[keep], row_ids[keep]
+        if len(row_scores) > k:
+            # Partial sort: only the k best candidates get fully ordered
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            row_scores, row_ids = row_scores[top], row_ids[top]
+        order = np.argsort(-row_scores, kind="stable")
+        n = len(order)
+        out_scores[row, :n] = row_scores[order]
+        out_indices[row, :n] = row_ids[order]
+
+    return out_scores, out_indices
+
+
+def reciprocal_rank_fusion(ranked_ids, k, rrf_k=DEFAULT_RRF_K):
+    """
+    Fuses several ranked result lists with RRF: a chunk scores sum(1 / (rrf_k + rank)) over the lists it appears in.
+    Only ranks are used, so retrievers with incomparable scores (L2 distance, cosine, BM25) can be combined.
+    Args:
+        ranked_ids: One (n_queries, depth) id array per retriever, best first, padded with -1.
+        k (int): Number of fused results per query.
+        rrf_k (int): Rank offset; larger values flatten the advantage of the top ranks.
+    Returns:
+        (scores, indices): Arrays of shape (n_queries, k), best first, -1 padded.
+    """
+    n_queries = ranked_ids[0].shape[0]
+    out_scores = np.zeros((n_queries, k), dtype=np.float32)
+    out_indices = np.full((n_queries, k), -1, dtype=np.int64)
+    ranks = np.concatenate([np.arange(1, ids.shape[1] + 1) for ids in ranked_ids])
+
+    for row in range(n_queries):
+        ids = np.concatenate([ids[row] for ids in ranked_ids])
+        valid = ids >= 0
+        unique_ids, slot = np.unique(ids[valid], return_inverse=True)
+        fused = np.bincount(slot, weights=1.0 / (rrf_k + ranks[valid]), minlength=len(unique_ids))
+        order = np.argsort(-fused, kind="stable")[:k]
+        out_scores[row, :len(order)] = fused[order]
+        out_indices[row, :len(order)] = unique_ids[order]
+
+    return out_scores, out_indices
@@ -0,0 +1,114 @@
+import os
+import mmap
+import shutil
+import struct
+from array import array
+import numpy as np
+
+# Memory-mapped store for the chunk texts.
+#
+# File layout (little endian):
+#   magic   8 bytes   b"RAGCHNK1"
+#   count   uint64    number of chunks (n)
+#   offsets uint64    n + 1 byte offsets into the blob, chunk i is blob[offsets[i]:offsets[i + 1]]
+#   blob    bytes     UTF-8 chunk texts, back to back
+#
+# The server maps the file read-only instead of parsing the whole chunk list into its
+# own heap, so every rag_server.py process shares the same page cache pages and only
+# the k hits of a query are ever decoded.
+
+MAGIC = b"RAGCHNK1"
+HEADER = struct.Struct("<8sQ")
+
+# Where each chunk came from, one row per chunk id (doc_id -1 marks a removed chunk).
+# Byte offsets are into the UTF-8 encoded source file.
+SOURCE_DTYPE = np.dtype([("doc_id", "<i4"), ("ordinal", "<i4"), ("byte_start", "<i8"), ("byte_end", "<i8")])
+
+
+def sources_from_rows(rows):
+    """Converts a flat array('q') of (doc_id, ordinal, byte_start, byte_end) quadruples to a SOURCE_DTYPE array."""
+    flat = np.frombuffer(rows, dtype=np.int64).reshape(-1, 4) if len(rows) else np.zeros((0, 4), dtype=np.int64)
+    sources = np.zeros(len(flat), dtype=SOURCE_DTYPE)
+    for column, name in enumerate(SOURCE_DTYPE.names):
+        sources[name] = flat[:, column]
+    return sources
+
+
+def save_sources(sources, path):
+    with open(path, "wb") as f:
+        np.save(f, sources)
+
+
+def load_sources(path, mmap=True):
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+class ChunkStoreWriter:
+    """
+    Streams chunks into a chunk store file without holding them in memory: texts are spooled to a
+    side file as they arrive, and the header and offsets table are written in front of them on close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._blob_path = f"{path}.blob"
+        self._blob = open(self._blob_path, "wb")
+        self._offsets = array("Q", [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def add(self, chunk):
+        data = chunk.encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._blob.close()
+        with open(self.path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self)))
+            f.write(np.frombuffer(self._offsets, dtype=np.uint64).astype("<u8").tobytes())
+            with open(self._blob_path, "rb") as blob:
+                shutil.copyfileobj(blob, f)
+        os.remove(self._blob_path)
+
+
+def write_chunk_store(chunks, path):
+    writer = ChunkStoreWriter(path)
+    for chunk in chunks:
+        writer.add(chunk)
+    writer.close()
+
+
+class ChunkStore:
+    """Read-only, list-like view of a chunk store file: supports len() and indexing by chunk id."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chunk store file")
+        self._count = count
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=HEADER.size)
+        self._blob_start = HEADER.size + self._offsets.nbytes
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        if idx < 0 or idx >= self._count:
+            raise IndexError(f"chunk id {idx} out of range (store has {self._count} chunks)")
+        start = self._blob_start + int(self._offsets[idx])
+        end = self._blob_start + int(self._offsets[idx + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(self._count):
+            yield self[idx]
+
+    def close(self):
+        # The offsets array borrows the mapping's buffer and must be released first
+        self._offsets = None
+        self._mm.close()
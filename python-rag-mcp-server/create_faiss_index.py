@@ -4,103 +4,533 @@ import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 import json
 import joblib # To save/load the TfidfVectorizer
+import argparse
+from array import array
+import hashlib
+import multiprocessing
+import time
+import scipy.sparse as sp
+from contextlib import contextmanager
+from functools import partial
+from sparse_index import build_sparse_index, save_sparse_index, load_sparse_index, remove_rows, append_rows
+from chunk_store import ChunkStore, ChunkStoreWriter, write_chunk_store, sources_from_rows, save_sources, load_sources
+from bm25_index import DEFAULT_K1, DEFAULT_B, term_counts, bm25_weights
+from sentence_chunker import DEFAULT_MIN_CHARS, DEFAULT_MAX_CHARS, iter_chunks
+from embedding_cache import EmbeddingCache, remove_models
+from quantization import QUANTIZATIONS, DEFAULT_RERANK, build_quantized_index, train_sample_ids
+from lsa_index import (
+    LSA_INDEX_KINDS, DEFAULT_LSA_DIM, DEFAULT_NLIST, DEFAULT_PQ_M, DEFAULT_HNSW_M, DEFAULT_NPROBE, DEFAULT_EF_SEARCH,
+    fit_lsa_projection, project, build_lsa_index,
+)
 
 # Configuration
 KB_DIR = "knowledge_base"
 FAISS_INDEX_PATH = "faiss_index/knowledge_base.faiss"
 FAISS_METADATA_PATH = "faiss_index/knowledge_base_metadata.json"
 TFIDF_VECTORIZER_PATH = "faiss_index/tfidf_vectorizer.joblib"
+SPARSE_INDEX_PATH = "faiss_index/knowledge_base_sparse.npz"
+INDEX_INFO_PATH = "faiss_index/index_info.json"
+LSA_PROJECTION_PATH = "faiss_index/lsa_projection.joblib"
+CHUNK_STORE_PATH = "faiss_index/knowledge_base_chunks.bin"
+MANIFEST_PATH = "faiss_index/manifest.json"
+CHUNK_SPOOL_PATH = "faiss_index/knowledge_base_chunks.spool.bin"
+SOURCES_PATH = "faiss_index/chunk_sources.npy"
+DOCUMENTS_PATH = "faiss_index/documents.json"
+BM25_INDEX_PATH = "faiss_index/knowledge_base_bm25.npz"
+BM25_COUNTS_PATH = "faiss_index/knowledge_base_bm25_counts.npz"
+EMBEDDING_CACHE_DIR = "faiss_index/embedding_cache"
 
-import nltk
-from nltk.tokenize import sent_tokenize
+# Retrieval backends the server knows how to load (recorded in INDEX_INFO_PATH)
+#   flat:      dense vocabulary-width vectors in faiss.IndexFlatL2 (exact L2 distance)
+#   sparse:    CSC TF-IDF matrix used as an inverted index (exact cosine similarity)
+#   lsa-ivfpq: TruncatedSVD-projected vectors in an approximate IVF-PQ index (FAISS_INDEX_PATH)
+#   lsa-hnsw:  TruncatedSVD-projected vectors in an approximate HNSW graph (FAISS_INDEX_PATH)
+INDEX_BACKENDS = ["flat", "sparse"] + LSA_INDEX_KINDS
 
-def sentence_splitter(text, min_chars=100, max_chars=500):
+# Backends whose index can remove vectors by id; HNSW graphs cannot, so --incremental rebuilds them in full
+INCREMENTAL_BACKENDS = ["flat", "sparse", "lsa-ivfpq"]
+DEFAULT_DRIFT_THRESHOLD = 0.1
+
+# Ingestion: documents are chunked in a process pool and vectorized/indexed this many chunks at a time
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_BATCH_SIZE = 1024
+
+def sentence_splitter(text, min_chars=DEFAULT_MIN_CHARS, max_chars=DEFAULT_MAX_CHARS, overlap=0):
     """
     Splits text into sentences and then groups sentences into chunks.
-    Ensures each chunk has a minimum character count.
+    Ensures each chunk has a minimum character count. See sentence_chunker.py.
     """
-    sentences = sent_tokenize(text)
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for sentence in sentences:
-        sentence_length = len(sentence)
-        if current_length + sentence_length + (len(current_chunk) * 1) > max_chars and current_chunk: # +1 for space
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [sentence]
-            current_length = sentence_length
-        else:
-            current_chunk.append(sentence)
-            current_length += sentence_length
-
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-    # Further refine to ensure minimum character count
-    final_chunks = []
-    buffer_chunk = ""
-    for chunk in chunks:
-        if len(buffer_chunk) + len(chunk) < min_chars:
-            buffer_chunk += (" " if buffer_chunk else "") + chunk
-        else:
-            if buffer_chunk:
-                final_chunks.append(buffer_chunk)
-            buffer_chunk = chunk
-
-    if buffer_chunk: # Add any remaining buffer
-        final_chunks.append(buffer_chunk)
-
-    # If all chunks are too small, combine them into one
-    if not final_chunks and text.strip():
-        final_chunks.append(text.strip())
-
-    return final_chunks
-
-def create_faiss_index():
-    print("Step 1: Loading documents...")
-    all_text = ""
-    for filename in os.listdir(KB_DIR):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(KB_DIR, filename)
-            with open(file_path, 'r') as f:
-                all_text += f.read() + "\n\n" # Add some separation between documents
-    print("Step 1 Complete: Documents loaded.")
-
-    print("Step 2: Splitting documents into chunks...")
-    chunks = sentence_splitter(all_text)
-    print(f"Step 2 Complete: Split into {len(chunks)} chunks.")
-
-    print("Step 3: Initializing and fitting TF-IDF Vectorizer...")
-    vectorizer = TfidfVectorizer()
-    # Fit the vectorizer on the chunks and transform them into embeddings
-    embeddings = vectorizer.fit_transform(chunks).toarray()
-    print(f"Step 3 Complete: Embeddings generated. Shape: {embeddings.shape}")
+    return [chunk for chunk, _, _ in iter_chunks(text, min_chars, max_chars, overlap)]
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yields a temporary path next to `path` and renames it over `path` once written.
+    A running rag_server.py that memory-maps the old file keeps reading the old inode instead of a truncated file,
+    and only sees the new artifact once it is complete.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    yield tmp_path
+    os.replace(tmp_path, path)
+
+def list_documents():
+    """Names of the .txt files in the knowledge base, in a stable order."""
+    return sorted(filename for filename in os.listdir(KB_DIR) if filename.endswith(".txt"))
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def read_document(filename):
+    with open(os.path.join(KB_DIR, filename), 'r') as f:
+        return f.read()
+
+def byte_spans(text, char_spans):
+    """(start, end) UTF-8 byte offsets of (start, end) character offsets into `text`."""
+    if text.isascii():
+        return char_spans
+    offsets = {}
+    char_pos = byte_pos = 0
+    for position in sorted({position for span in char_spans for position in span}):
+        byte_pos += len(text[char_pos:position].encode("utf-8"))
+        char_pos = position
+        offsets[position] = byte_pos
+    return [(offsets[start], offsets[end]) for start, end in char_spans]
+
+def chunk_file(filename, overlap=0):
+    """Pool worker: reads and chunks one knowledge base file. Returns (filename, content hash, chunks, byte spans)."""
+    text = read_document(filename)
+    chunks, spans = [], []
+    for chunk, start, end in iter_chunks(text, overlap=overlap):
+        chunks.append(chunk)
+        spans.append((start, end))
+    return filename, content_hash(text), chunks, byte_spans(text, spans)
+
+def iter_chunked_documents(filenames, workers=DEFAULT_WORKERS, overlap=0):
+    """
+    Chunks files in a process pool and yields chunk_file() results in file order.
+    Workers read their own files, so only the documents currently being chunked are held in memory.
+    """
+    chunk_fn = partial(chunk_file, overlap=overlap)
+    if workers <= 1:
+        yield from map(chunk_fn, filenames)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(chunk_fn, filenames)
+
+def spool_chunks(chunked_documents, add_chunk, doc_ids, first_id=0):
+    """
+    Streams chunked documents to `add_chunk` one chunk at a time, numbering chunks from `first_id`.
+    Every document is chunked on its own, so a chunk never straddles two files and a file's chunks get a
+    contiguous id range.
+    Returns the manifest entries (filename -> {"sha256", "doc_id", "id_range": [start, end)}) and the source rows:
+    a flat array('q') of (doc_id, ordinal, byte_start, byte_end) per chunk id.
+    """
+    files = {}
+    sources = array("q")
+    next_id = first_id
+    for filename, sha256, chunks, spans in chunked_documents:
+        doc_id = doc_ids[filename]
+        for ordinal, (chunk, (byte_start, byte_end)) in enumerate(zip(chunks, spans)):
+            add_chunk(chunk)
+            sources.extend((doc_id, ordinal, byte_start, byte_end))
+        files[filename] = {"sha256": sha256, "doc_id": doc_id, "id_range": [next_id, next_id + len(chunks)]}
+        next_id += len(chunks)
+    return files, sources
+
+def load_chunks(workers=DEFAULT_WORKERS):
+    """All chunks of the knowledge base as a list (for benchmarks; builds stream them instead)."""
+    return [chunk for _, _, chunks, _ in iter_chunked_documents(list_documents(), workers) for chunk in chunks]
+
+def iter_batches(chunks, batch_size):
+    """Yields (first chunk id, list of chunk texts) for consecutive batches of a list-like chunk sequence."""
+    for start in range(0, len(chunks), batch_size):
+        yield start, [chunks[i] for i in range(start, min(start + batch_size, len(chunks)))]
+
+def vocabulary_drift(vectorizer, chunks):
+    """Fraction of the tokens in `chunks` that the fitted vocabulary does not know (transform silently drops them)."""
+    analyzer = vectorizer.build_analyzer()
+    tokens = [token for chunk in chunks for token in analyzer(chunk)]
+    if not tokens:
+        return 0.0
+    return sum(token not in vectorizer.vocabulary_ for token in tokens) / len(tokens)
+
+# Ids of the LSA projections in the embedding cache: the vectors depend on the fitted vocabulary, IDF weights
+# and SVD, so a refit starts a new cache model (TruncatedSVD is seeded, so refitting an unchanged corpus doesn't)
+LSA_CACHE_PREFIX = "tfidf-lsa:"
+
+def lsa_cache(vectorizer, svd):
+    """The embedding cache of LSA-projected vectors for this vectorizer and projection."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(sorted(vectorizer.vocabulary_)).encode("utf-8"))
+    digest.update(vectorizer.idf_.tobytes())
+    digest.update(svd.components_.tobytes())
+    return EmbeddingCache(EMBEDDING_CACHE_DIR, LSA_CACHE_PREFIX + digest.hexdigest()[:16])
+
+def build_index(chunks, vectorizer, backend, batch_size, lsa_dim, nlist, pq_m, hnsw_m, quantization="none"):
+    """
+    Builds the backend's index over the chunks, chunk i getting id i, transforming `batch_size` chunks at a time.
+    The flat backend adds every batch as soon as it is densified, so only batch_size x vocabulary dense floats exist
+    at once; the sparse and LSA backends keep the sparse TF-IDF matrix (their index, or the SVD input).
+    The flat backend stores its vectors with the given quantization (see quantization.py), trained on a sample.
+    LSA projections of chunks already in the embedding cache are read from it instead of recomputed; the flat and
+    sparse backends' vocabulary-width vectors are cheaper to recompute than to store.
+    Returns the index and the fitted LSA projection (None for backends without one).
+    """
+    if backend == "flat":
+        base = build_quantized_index(len(vectorizer.vocabulary_), quantization, len(chunks), pq_m)
+        if not base.is_trained:
+            sample = train_sample_ids(len(chunks))
+            base.train(vectorizer.transform([chunks[i] for i in sample]).toarray().astype('float32'))
+        # Ids so the vectors of one file can later be removed: IVF (pq) indexes store them natively, the others
+        # get an IndexIDMap (which cannot track removals from an IVF index)
+        index = base if isinstance(base, faiss.IndexIVF) else faiss.IndexIDMap(base)
+        for start, batch in iter_batches(chunks, batch_size):
+            vectors = vectorizer.transform(batch).toarray().astype('float32')
+            index.add_with_ids(vectors, np.arange(start, start + len(batch), dtype='int64'))
+        return index, None
+
+    embeddings = sp.vstack([vectorizer.transform(batch) for _, batch in iter_batches(chunks, batch_size)], format="csr")
+    if backend == "sparse":
+        # Row numbers are the chunk ids
+        return build_sparse_index(embeddings), None
+    svd = fit_lsa_projection(embeddings, lsa_dim)
+    cache = lsa_cache(vectorizer, svd)
+    vectors, cached = cache.get_or_compute(chunks, lambda missing: project(svd, embeddings[missing]))
+    print(f"   Embedding cache: {cached} of {len(chunks)} chunk projections reused.")
+    # Entries of older fits and of chunks no longer in the knowledge base can't be hit again
+    remove_models(EMBEDDING_CACHE_DIR, LSA_CACHE_PREFIX, cache.model_id)
+    cache.retain(chunks)
+    # IVF and HNSW number vectors in insertion order, which matches the chunk ids
+    return build_lsa_index(vectors, backend, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m), svd
 
-    print("Step 4: Creating FAISS index...")
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(embeddings).astype('float32'))
-    print(f"Step 4 Complete: FAISS index created. Number of embeddings in index: {index.ntotal}")
+def build_bm25_counts(chunks, vectorizer, batch_size):
+    """Term counts of every chunk (row = chunk id) over the vectorizer's vocabulary, tokenized `batch_size` chunks at a time."""
+    analyzer = vectorizer.build_analyzer()
+    return build_sparse_index(sp.vstack(
+        [term_counts(analyzer, vectorizer.vocabulary_, batch) for _, batch in iter_batches(chunks, batch_size)],
+        format="csr",
+    ))
+
+def save_bm25(counts):
+    """Writes the BM25 postings (precomputed weights, what the server searches) and the term counts they derive from."""
+    with atomic_output(BM25_INDEX_PATH) as tmp_path:
+        save_sparse_index(bm25_weights(counts, DEFAULT_K1, DEFAULT_B), tmp_path)
+    with atomic_output(BM25_COUNTS_PATH) as tmp_path:
+        save_sparse_index(counts, tmp_path)
+
+def save_index(index, backend, svd=None):
+    if backend == "sparse":
+        with atomic_output(SPARSE_INDEX_PATH) as tmp_path:
+            save_sparse_index(index, tmp_path)
+        return
+    with atomic_output(FAISS_INDEX_PATH) as tmp_path:
+        faiss.write_index(index, tmp_path)
+    if svd is not None:
+        with atomic_output(LSA_PROJECTION_PATH) as tmp_path:
+            joblib.dump(svd, tmp_path)
+
+def save_metadata_json(chunks):
+    """Writes the chunk texts as a JSON list (position = chunk id), one chunk at a time."""
+    with atomic_output(FAISS_METADATA_PATH) as tmp_path, open(tmp_path, 'w') as f:
+        f.write("[")
+        for i, chunk in enumerate(chunks):
+            f.write((", " if i else "") + json.dumps(chunk))
+        f.write("]")
+
+def save_chunks(chunks):
+    """Writes the chunk texts, position = chunk id (removed chunks are kept as empty strings)."""
+    save_metadata_json(chunks)
+    # Offsets + blob layout the server memory-maps instead of parsing the JSON
+    with atomic_output(CHUNK_STORE_PATH) as tmp_path:
+        write_chunk_store(chunks, tmp_path)
+
+def save_sources_and_documents(sources, documents):
+    """Writes the per-chunk source rows and the doc id -> file path table (None for deleted documents)."""
+    with atomic_output(SOURCES_PATH) as tmp_path:
+        save_sources(sources, tmp_path)
+    with atomic_output(DOCUMENTS_PATH) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(documents, f)
+
+def save_manifest_and_info(manifest, index_info):
+    with atomic_output(MANIFEST_PATH) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    index_info["created_at"] = time.time()
+    # Written last: rag_server.py watches this file to reload the index and invalidate its query cache
+    with atomic_output(INDEX_INFO_PATH) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(index_info, f)
+
+def print_throughput(num_documents, num_chunks, chunking_seconds, indexing_seconds):
+    total = chunking_seconds + indexing_seconds
+    print(f"Throughput: {num_documents / total:.1f} docs/s, {num_chunks / total:.1f} chunks/s overall "
+          f"(chunking {num_chunks / max(chunking_seconds, 1e-9):.1f} chunks/s in {chunking_seconds:.2f}s, "
+          f"vectorizing + indexing {num_chunks / max(indexing_seconds, 1e-9):.1f} chunks/s in {indexing_seconds:.2f}s)")
+
+def create_faiss_index(backend="flat", lsa_dim=DEFAULT_LSA_DIM, nlist=DEFAULT_NLIST, pq_m=DEFAULT_PQ_M,
+                       hnsw_m=DEFAULT_HNSW_M, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH,
+                       workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, quantization="none", rerank=DEFAULT_RERANK,
+                       chunk_overlap=0):
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend '{backend}'. Choose one of: {', '.join(INDEX_BACKENDS)}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}'. Choose one of: {', '.join(QUANTIZATIONS)}")
+    if quantization != "none" and backend != "flat":
+        # lsa-ivfpq already stores PQ codes, and sparse has no dense vectors to quantize
+        raise ValueError(f"Quantization applies to the flat backend only, not '{backend}'")
+    build_params = {"lsa_dim": lsa_dim, "nlist": nlist, "pq_m": pq_m, "hnsw_m": hnsw_m, "nprobe": nprobe, "ef_search": ef_search,
+                    "quantization": quantization, "rerank": rerank, "chunk_overlap": chunk_overlap}
 
     # Ensure the directory for FAISS index exists
     os.makedirs(os.path.dirname(FAISS_INDEX_PATH), exist_ok=True)
 
-    print(f"Step 5: Saving FAISS index to {FAISS_INDEX_PATH}...")
-    faiss.write_index(index, FAISS_INDEX_PATH)
-    print("Step 5 Complete: FAISS index saved successfully.")
+    print(f"Step 1: Streaming documents through {workers} chunking worker(s)...")
+    chunking_start = time.perf_counter()
+    filenames = list_documents()
+    # Chunks are spooled to disk as they are produced and read back through a memory map
+    doc_ids = {filename: doc_id for doc_id, filename in enumerate(filenames)}
+    writer = ChunkStoreWriter(CHUNK_SPOOL_PATH)
+    files, source_rows = spool_chunks(iter_chunked_documents(filenames, workers, chunk_overlap), writer.add, doc_ids)
+    writer.close()
+    chunks = ChunkStore(CHUNK_SPOOL_PATH)
+    chunking_seconds = time.perf_counter() - chunking_start
+    print(f"Step 1 Complete: {len(filenames)} documents split into {len(chunks)} chunks.")
 
-    print(f"Step 6: Saving metadata to {FAISS_METADATA_PATH}...")
-    with open(FAISS_METADATA_PATH, 'w') as f:
-        json.dump(chunks, f)
-    print("Step 6 Complete: Metadata saved successfully.")
+    indexing_start = time.perf_counter()
+    print("Step 2: Fitting TF-IDF Vectorizer...")
+    vectorizer = TfidfVectorizer()
+    # fit() consumes the chunks as an iterator, so they are never all decoded at once
+    vectorizer.fit(iter(chunks))
+    print(f"Step 2 Complete: Vocabulary size {len(vectorizer.vocabulary_)}.")
+
+    print(f"Step 3: Creating {backend} index in batches of {batch_size} chunks...")
+    index, svd = build_index(chunks, vectorizer, backend, batch_size, lsa_dim, nlist, pq_m, hnsw_m, quantization)
+    # Keyword postings for the server's hybrid (BM25 + vector) search mode, built for every backend
+    bm25_counts = build_bm25_counts(chunks, vectorizer, batch_size)
+    index_info = {"backend": backend, "bm25": {"k1": DEFAULT_K1, "b": DEFAULT_B}}
+    if svd is not None:
+        index_info.update({"lsa_dim": int(svd.n_components), "nprobe": nprobe, "ef_search": ef_search})
+    if quantization != "none":
+        index_info.update({"quantization": quantization, "rerank": rerank})
+    indexing_seconds = time.perf_counter() - indexing_start
+    print(f"Step 3 Complete: {backend} index created over {len(chunks)} chunks.")
+
+    print(f"Step 4: Saving {backend} index and BM25 postings...")
+    save_index(index, backend, svd)
+    save_bm25(bm25_counts)
+    print("Step 4 Complete: Index saved successfully.")
+
+    print(f"Step 5: Saving metadata to {FAISS_METADATA_PATH}, {CHUNK_STORE_PATH} and {SOURCES_PATH}...")
+    save_metadata_json(chunks)
+    save_sources_and_documents(sources_from_rows(source_rows), [os.path.join(KB_DIR, filename) for filename in filenames])
+    num_chunks = len(chunks)
+    chunks.close()
+    # The spool already has the chunk store layout; renaming it is the atomic swap
+    os.replace(CHUNK_SPOOL_PATH, CHUNK_STORE_PATH)
+    print("Step 5 Complete: Metadata saved successfully.")
+
+    print(f"Step 6: Saving TF-IDF Vectorizer to {TFIDF_VECTORIZER_PATH}...")
+    with atomic_output(TFIDF_VECTORIZER_PATH) as tmp_path:
+        joblib.dump(vectorizer, tmp_path)
+    print("Step 6 Complete: TF-IDF Vectorizer saved successfully.")
 
-    print(f"Step 7: Saving TF-IDF Vectorizer to {TFIDF_VECTORIZER_PATH}...")
-    joblib.dump(vectorizer, TFIDF_VECTORIZER_PATH)
-    print("Step 7 Complete: TF-IDF Vectorizer saved successfully.")
+    print(f"Step 7: Saving manifest to {MANIFEST_PATH} and index info to {INDEX_INFO_PATH}...")
+    manifest = {
+        "backend": backend,
+        "build_params": build_params,
+        "files": files,
+        "next_id": num_chunks,
+        "next_doc_id": len(filenames),
+        "num_live_chunks": num_chunks,
+        "chunks_changed_since_fit": 0,
+    }
+    index_info.update({"num_chunks": num_chunks, "vocabulary_size": len(vectorizer.vocabulary_)})
+    save_manifest_and_info(manifest, index_info)
+    print("Step 7 Complete: Manifest and index info saved successfully.")
+
+    print(f"\nIndex creation process completed using TF-IDF ({backend} backend).")
+    print_throughput(len(filenames), num_chunks, chunking_seconds, indexing_seconds)
+
+def update_faiss_index(drift_threshold=DEFAULT_DRIFT_THRESHOLD, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Incremental build: re-chunks and re-embeds only the files whose content hash changed since the last build,
+    removes the vectors of changed and deleted files by chunk id, and appends the new chunks with fresh ids.
+    Falls back to a full create_faiss_index() when there is no manifest, the backend cannot remove vectors,
+    or vocabulary drift exceeds `drift_threshold`.
+    """
+    manifest = None
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, 'r') as f:
+            manifest = json.load(f)
+    # Manifests without "next_doc_id" predate the chunk source table, and builds without BM25 counts predate
+    # hybrid search; neither can be updated in place
+    if (manifest is None or manifest["backend"] not in INCREMENTAL_BACKENDS or "next_doc_id" not in manifest
+            or not os.path.exists(BM25_COUNTS_PATH)):
+        print("No incremental manifest for this index (or its backend cannot remove vectors). Running a full build.")
+        if manifest is None:
+            return create_faiss_index(workers=workers, batch_size=batch_size)
+        return create_faiss_index(backend=manifest["backend"], workers=workers, batch_size=batch_size, **manifest["build_params"])
+    backend = manifest["backend"]
+
+    print("Step 1: Comparing knowledge base against manifest...")
+    filenames = list_documents()
+    old_files = manifest["files"]
+    # Hash one file at a time; only changed files are chunked
+    changed = [name for name in filenames
+               if name not in old_files or old_files[name]["sha256"] != content_hash(read_document(name))]
+    deleted = [name for name in old_files if name not in filenames]
+    print(f"Step 1 Complete: {len(changed)} new or changed, {len(deleted)} deleted, "
+          f"{len(filenames) - len(changed)} unchanged files.")
+    if not changed and not deleted:
+        print("\nIndex is up to date.")
+        return
+
+    print("Step 2: Splitting new and changed documents into chunks...")
+    chunking_start = time.perf_counter()
+    # Changed files keep their doc id, new files get the next free ones
+    doc_ids = {}
+    next_doc_id = manifest["next_doc_id"]
+    for name in changed:
+        if name in old_files:
+            doc_ids[name] = old_files[name]["doc_id"]
+        else:
+            doc_ids[name] = next_doc_id
+            next_doc_id += 1
+    new_chunks = []
+    # Changed files are chunked like the rest of the index was
+    overlap = manifest["build_params"].get("chunk_overlap", 0)
+    new_files, source_rows = spool_chunks(iter_chunked_documents(changed, workers, overlap), new_chunks.append, doc_ids,
+                                          first_id=manifest["next_id"])
+    chunking_seconds = time.perf_counter() - chunking_start
+    removed_ids = [chunk_id for name in changed + deleted if name in old_files
+                   for chunk_id in range(*old_files[name]["id_range"])]
+    print(f"Step 2 Complete: {len(new_chunks)} new chunks, {len(removed_ids)} chunks to remove.")
+
+    indexing_start = time.perf_counter()
+    print("Step 3: Checking vocabulary drift...")
+    vectorizer = joblib.load(TFIDF_VECTORIZER_PATH)
+    num_live_chunks = manifest["num_live_chunks"] - len(removed_ids) + len(new_chunks)
+    changed_since_fit = manifest["chunks_changed_since_fit"] + len(removed_ids) + len(new_chunks)
+    # Unknown terms are lost by transform, and IDF weights go stale as more of the corpus changes
+    drift = max(vocabulary_drift(vectorizer, new_chunks), changed_since_fit / max(1, num_live_chunks))
+    print(f"Step 3 Complete: Drift {drift:.3f} (threshold {drift_threshold}).")
+    if drift > drift_threshold:
+        print("Vocabulary drift exceeds the threshold. Running a full build to refit the vocabulary.\n")
+        return create_faiss_index(backend=backend, workers=workers, batch_size=batch_size, **manifest["build_params"])
+
+    print(f"Step 4: Updating {backend} index...")
+    if backend == "sparse":
+        index = remove_rows(load_sparse_index(SPARSE_INDEX_PATH), removed_ids)
+    else:
+        index = faiss.read_index(FAISS_INDEX_PATH)
+        if removed_ids:
+            index.remove_ids(np.array(removed_ids, dtype='int64'))
+        svd = joblib.load(LSA_PROJECTION_PATH) if backend in LSA_INDEX_KINDS else None
+    bm25_counts = remove_rows(load_sparse_index(BM25_COUNTS_PATH), removed_ids)
+    if new_chunks:
+        bm25_counts = append_rows(bm25_counts, term_counts(vectorizer.build_analyzer(), vectorizer.vocabulary_, new_chunks))
+    cache = lsa_cache(vectorizer, svd) if backend in LSA_INDEX_KINDS else None
+    cached = 0
+    for start, batch in iter_batches(new_chunks, batch_size):
+        if backend == "sparse":
+            # Appended rows get the next ids, matching manifest["next_id"] + start
+            index = append_rows(index, vectorizer.transform(batch))
+            continue
+        if cache is not None:
+            # Edited files mostly re-chunk into sentences that were indexed before
+            vectors, batch_cached = cache.get_or_compute(
+                batch, lambda missing: project(svd, vectorizer.transform([batch[i] for i in missing])))
+            cached += batch_cached
+        else:
+            vectors = vectorizer.transform(batch).toarray().astype('float32')
+        ids = np.arange(manifest["next_id"] + start, manifest["next_id"] + start + len(batch), dtype='int64')
+        index.add_with_ids(vectors, ids)
+    indexing_seconds = time.perf_counter() - indexing_start
+    if cache is not None:
+        print(f"   Embedding cache: {cached} of {len(new_chunks)} chunk projections reused.")
+    print(f"Step 4 Complete: Index now holds {num_live_chunks} chunks.")
+
+    print(f"Step 5: Saving {backend} index and BM25 postings...")
+    # The projection is unchanged, so only the index itself is rewritten; BM25 weights are recomputed from the
+    # updated counts, so IDF and the average chunk length stay exact
+    save_index(index, backend)
+    save_bm25(bm25_counts)
+    print("Step 5 Complete: Index saved successfully.")
+
+    print(f"Step 6: Saving metadata to {FAISS_METADATA_PATH}, {CHUNK_STORE_PATH} and {SOURCES_PATH}...")
+    with open(FAISS_METADATA_PATH, 'r') as f:
+        chunks = json.load(f)
+    for chunk_id in removed_ids:
+        chunks[chunk_id] = ""
+    save_chunks(chunks + new_chunks)
+    sources = np.array(load_sources(SOURCES_PATH, mmap=False))
+    sources["doc_id"][removed_ids] = -1
+    with open(DOCUMENTS_PATH, 'r') as f:
+        documents = json.load(f)
+    documents += [None] * (next_doc_id - len(documents))
+    for name in deleted:
+        documents[old_files[name]["doc_id"]] = None
+    for name, doc_id in doc_ids.items():
+        documents[doc_id] = os.path.join(KB_DIR, name)
+    save_sources_and_documents(np.concatenate([sources, sources_from_rows(source_rows)]), documents)
+    print("Step 6 Complete: Metadata saved successfully.")
 
-    print("\nFAISS index creation process completed using TF-IDF.")
+    print(f"Step 7: Saving manifest to {MANIFEST_PATH} and index info to {INDEX_INFO_PATH}...")
+    files = {name: entry for name, entry in old_files.items() if name not in changed and name not in deleted}
+    files.update(new_files)
+    manifest.update({
+        "files": files,
+        "next_id": manifest["next_id"] + len(new_chunks),
+        "next_doc_id": next_doc_id,
+        "num_live_chunks": num_live_chunks,
+        "chunks_changed_since_fit": changed_since_fit,
+    })
+    with open(INDEX_INFO_PATH, 'r') as f:
+        index_info = json.load(f)
+    index_info["num_chunks"] = num_live_chunks
+    save_manifest_and_info(manifest, index_info)
+    print("Step 7 Complete: Manifest and index info saved successfully.")
 
+    print(f"\nIncremental index update completed ({backend} backend).")
+    print_throughput(len(changed), len(new_chunks), chunking_seconds, indexing_seconds)
 
 if __name__ == "__main__":
-    create_faiss_index()
+    parser = argparse.ArgumentParser(description="Build the TF-IDF knowledge base index.")
+    parser.add_argument("--backend", choices=INDEX_BACKENDS, default="flat",
+                        help="Retrieval backend to build (default: flat)")
+    parser.add_argument("--lsa-dim", type=int, default=DEFAULT_LSA_DIM,
+                        help=f"lsa-* backends: TruncatedSVD output dimension (default: {DEFAULT_LSA_DIM})")
+    parser.add_argument("--nlist", type=int, default=DEFAULT_NLIST,
+                        help=f"lsa-ivfpq: number of inverted lists (default: {DEFAULT_NLIST})")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M,
+                        help=f"lsa-ivfpq and --quantization pq: number of PQ sub-quantizers (default: {DEFAULT_PQ_M})")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M,
+                        help=f"lsa-hnsw: graph neighbours per node (default: {DEFAULT_HNSW_M})")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE,
+                        help=f"lsa-ivfpq: default lists probed per query (default: {DEFAULT_NPROBE})")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_EF_SEARCH,
+                        help=f"lsa-hnsw: default search beam width (default: {DEFAULT_EF_SEARCH})")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none",
+                        help="flat: store vectors as float32 (none), float16, 8-bit scalar or PQ codes (default: none)")
+    parser.add_argument("--rerank", type=int, default=DEFAULT_RERANK,
+                        help=f"flat with --quantization: re-score this many candidates per hit exactly, 0 to disable "
+                             f"(default: {DEFAULT_RERANK}, overridable with RAG_RERANK when serving)")
+    parser.add_argument("--chunk-overlap", type=int, default=0,
+                        help="Characters of whole trailing sentences repeated at the start of the next chunk, "
+                             "within the 500-character chunk limit (default: 0)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-embed new/changed files, reusing the backend and parameters of the last build")
+    parser.add_argument("--drift-threshold", type=float, default=DEFAULT_DRIFT_THRESHOLD,
+                        help=f"--incremental: vocabulary drift above which a full rebuild runs (default: {DEFAULT_DRIFT_THRESHOLD})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Processes used to chunk documents (default: {DEFAULT_WORKERS}, i.e. one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Chunks vectorized and added to the index at a time (default: {DEFAULT_BATCH_SIZE})")
+    cli_args = parser.parse_args()
+    if cli_args.incremental:
+        update_faiss_index(drift_threshold=cli_args.drift_threshold, workers=cli_args.workers, batch_size=cli_args.batch_size)
+    else:
+        create_faiss_index(backend=cli_args.backend, lsa_dim=cli_args.lsa_dim, nlist=cli_args.nlist, pq_m=cli_args.pq_m,
+                           hnsw_m=cli_args.hnsw_m, nprobe=cli_args.nprobe, ef_search=cli_args.ef_search,
+                           workers=cli_args.workers, batch_size=cli_args.batch_size,
+                           quantization=cli_args.quantization, rerank=cli_args.rerank,
+                           chunk_overlap=cli_args.chunk_overlap)
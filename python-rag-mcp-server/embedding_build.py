@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from quantization import DEFAULT_PQ_M, quantize
+
+# Embedding build pipeline for the sentence-transformers vector store of rag_pipeline_usage_example.py.
+# Chunks are embedded in fixed-size batches by a pool of worker processes, each loading the model once
+# and pinned to its own share of the CPU cores (one torch thread per pinned core), so workers don't
+# oversubscribe the machine. Every finished batch is written to the checkpoint directory; a build
+# that is interrupted resumes with the batches that are missing.
+
+# Chunks per batch: the unit of work handed to a worker and of checkpointing
+DEFAULT_EMBEDDING_BATCH_SIZE = 256
+# Sentences per forward pass inside a worker (SentenceTransformer.encode's batch_size)
+DEFAULT_ENCODE_BATCH_SIZE = 32
+# Every worker holds its own copy of the model, so don't start one per core on large machines
+DEFAULT_EMBEDDING_WORKERS = min(8, os.cpu_count() or 1)
+
+BUILD_INFO_FILE = "build.json"
+
+# Set in each worker process by init_worker()
+worker_model = None
+worker_encode_batch_size = DEFAULT_ENCODE_BATCH_SIZE
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def core_groups(workers):
+    """Splits the cores this process may run on into `workers` contiguous, non-empty groups."""
+    cores = available_cores()
+    return [[int(core) for core in group] for group in np.array_split(cores, min(workers, len(cores)))]
+
+def init_worker(model_name, encode_batch_size, core_queue):
+    """Pool initializer: pins the worker to the next free group of cores and loads the model once."""
+    global worker_model, worker_encode_batch_size
+    cores = core_queue.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    worker_model = SentenceTransformer(model_name, device="cpu")
+    worker_encode_batch_size = encode_batch_size
+
+def batch_path(checkpoint_dir, batch_index):
+    return os.path.join(checkpoint_dir, f"batch_{batch_index:06d}.npy")
+
+def embed_batch(batch_index, texts, checkpoint_dir):
+    """Pool worker: embeds one batch and checkpoints it. Returns (batch index, number of chunks)."""
+    # Same preprocessing as HuggingFaceEmbeddings.embed_documents, so queries embedded by it match the store
+    vectors = worker_model.encode([text.replace("\n", " ") for text in texts], batch_size=worker_encode_batch_size,
+                                  show_progress_bar=False, convert_to_numpy=True)
+    path = batch_path(checkpoint_dir, batch_index)
+    # Written under a temporary name and renamed, so an interrupted build never leaves a partial batch behind
+    tmp_path = f"{path[:-len('.npy')]}.tmp.npy"
+    np.save(tmp_path, vectors.astype(np.float32))
+    os.replace(tmp_path, path)
+    return batch_index, len(texts)
+
+def build_fingerprint(texts, model_name, batch_size):
+    """Identifies what the checkpoints were computed from; batches are only reused for the same chunks and settings."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return {"model": model_name, "batch_size": batch_size, "num_chunks": len(texts), "chunks_sha256": digest.hexdigest()}
+
+def prepare_checkpoints(checkpoint_dir, fingerprint, log=print):
+    """Keeps the checkpoint directory if it belongs to the same build, otherwise starts it afresh."""
+    info_path = os.path.join(checkpoint_dir, BUILD_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as f:
+            if json.load(f) == fingerprint:
+                return
+        log(f"Discarding embedding checkpoints in {checkpoint_dir}: the chunks or build settings changed.")
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(info_path, 'w') as f:
+        json.dump(fingerprint, f)
+
+def clear_checkpoints(checkpoint_dir):
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+def embed_texts(texts, model_name, checkpoint_dir, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                encode_batch_size=DEFAULT_ENCODE_BATCH_SIZE, workers=DEFAULT_EMBEDDING_WORKERS, log=print):
+    """
+    Embeds `texts` in a pool of pinned worker processes, reusing batches already checkpointed in `checkpoint_dir`.
+    Returns a float32 matrix with one row per text.
+    """
+    if not texts:
+        raise ValueError("No chunks to embed")
+    prepare_checkpoints(checkpoint_dir, build_fingerprint(texts, model_name, batch_size), log)
+    num_batches = (len(texts) + batch_size - 1) // batch_size
+    pending = [i for i in range(num_batches) if not os.path.exists(batch_path(checkpoint_dir, i))]
+    resumed = len(texts) - sum(len(texts[i * batch_size:(i + 1) * batch_size]) for i in pending)
+    if resumed:
+        log(f"Resuming: {num_batches - len(pending)} of {num_batches} batches ({resumed} chunks) already embedded.")
+
+    start = time.perf_counter()
+    embedded = 0
+    if pending:
+        groups = core_groups(workers)
+        # spawn: workers start without the parent's torch/tokenizer threads, which don't survive a fork
+        context = multiprocessing.get_context("spawn")
+        core_queue = context.Queue()
+        for group in groups:
+            core_queue.put(group)
+        log(f"Embedding {len(texts) - resumed} chunks in {len(pending)} batches of up to {batch_size} "
+            f"with {len(groups)} workers pinned to cores {groups}...")
+        with ProcessPoolExecutor(max_workers=len(groups), mp_context=context, initializer=init_worker,
+                                 initargs=(model_name, encode_batch_size, core_queue)) as pool:
+            futures = [pool.submit(embed_batch, i, texts[i * batch_size:(i + 1) * batch_size], checkpoint_dir)
+                       for i in pending]
+            report_every = max(1, len(futures) // 20)
+            for done, future in enumerate(as_completed(futures), start=1):
+                embedded += future.result()[1]
+                if done % report_every == 0 or done == len(futures):
+                    elapsed = time.perf_counter() - start
+                    log(f"   {done}/{len(futures)} batches, {embedded} chunks, {embedded / elapsed:.1f} embeddings/s")
+    seconds = time.perf_counter() - start
+
+    vectors = np.concatenate([np.load(batch_path(checkpoint_dir, i)) for i in range(num_batches)])
+    if len(vectors) != len(texts):
+        raise RuntimeError(f"Embedding checkpoints in {checkpoint_dir} hold {len(vectors)} vectors for {len(texts)} chunks")
+    if embedded:
+        log(f"Throughput: {embedded / max(seconds, 1e-9):.1f} embeddings/s ({embedded} chunks in {seconds:.2f}s "
+            f"including worker start-up, {resumed} resumed from checkpoints)")
+    return vectors
+
+def build_faiss_store(documents, vectors, embeddings, quantization="none", pq_m=DEFAULT_PQ_M):
+    """
+    A LangChain FAISS store over precomputed vectors, laid out as FAISS.from_documents() would build it,
+    with the vectors stored in the given quantization (see quantization.py).
+    """
+    index = quantize(vectors, quantization, pq_m)
+    ids = [str(uuid.uuid4()) for _ in documents]
+    docstore = InMemoryDocstore(dict(zip(ids, documents)))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
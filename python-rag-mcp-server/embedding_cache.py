@@ -0,0 +1,170 @@
+import os
+import shutil
+import hashlib
+import unicodedata
+import numpy as np
+
+# Persistent, content-addressed cache of chunk embeddings shared by the index builders.
+#
+# Vectors are keyed by a hash of the normalized chunk text, in one directory per embedding
+# model. The model id must change whenever the vectors would: create_vector_store() uses the
+# sentence-transformers model name, and create_faiss_index.py a fingerprint of the fitted
+# TF-IDF vocabulary and LSA projection. A model directory holds
+#   vectors-<generation>.bin  raw rows of `dim` values in the cache dtype, appended to as chunks are
+#                             embedded and memory-mapped for reads
+#   index.npz                 the sorted 16-byte text hashes with the row of each (binary searched),
+#                             the model id, dimension, dtype and the name of the current vectors file
+# index.npz is replaced atomically and written after the vectors it points to, so an interrupted
+# build leaves at worst unreferenced rows behind.
+
+# float32, so a vector read from the cache is bit-identical to the freshly computed one: a rebuild from
+# the cache gives the same index, and the vectors kept for exact re-ranking stay exact
+DEFAULT_CACHE_DTYPE = "float32"
+KEY_DTYPE = "S16"
+INDEX_FILE = "index.npz"
+
+
+def normalize_text(text):
+    # Both embedders tokenize on words, so Unicode form and whitespace never change a vector
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text):
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+def text_keys(texts):
+    return np.array([text_key(text) for text in texts], dtype=KEY_DTYPE)
+
+
+def model_dir(cache_dir, model_id):
+    return os.path.join(cache_dir, hashlib.sha256(model_id.encode("utf-8")).hexdigest()[:16])
+
+
+def remove_models(cache_dir, prefix, keep_model_id):
+    """Deletes the cached vectors of every model whose id starts with `prefix` except `keep_model_id`."""
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        index_path = os.path.join(path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            continue
+        with np.load(index_path) as index:
+            model_id = str(index["model"])
+        if model_id.startswith(prefix) and model_id != keep_model_id:
+            shutil.rmtree(path)
+
+
+class EmbeddingCache:
+    """Text-hash -> vector store for one embedding model. Vectors are returned as float32."""
+
+    def __init__(self, cache_dir, model_id, dtype=DEFAULT_CACHE_DTYPE):
+        self.model_id = model_id
+        self.path = model_dir(cache_dir, model_id)
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.vectors_file = "vectors-0.bin"
+        self.keys = np.zeros(0, dtype=KEY_DTYPE)
+        self.rows = np.zeros(0, dtype=np.int64)
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with np.load(index_path) as index:
+                stored_dtype = np.dtype(str(index["dtype"]))
+                if stored_dtype == self.dtype:
+                    self.keys, self.rows = index["keys"], index["rows"]
+                    self.dim = int(index["dim"])
+                    self.vectors_file = str(index["vectors_file"])
+            if stored_dtype != self.dtype:
+                # Rows stored at another precision would change the vectors; start the model's cache afresh
+                shutil.rmtree(self.path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.path, self.vectors_file)
+
+    def num_rows(self):
+        """Rows in the vectors file, including any an interrupted build appended without indexing."""
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+
+    def vectors(self):
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self.num_rows(), self.dim))
+
+    def find(self, keys):
+        """Row of every key in the vectors file, -1 where it is not cached."""
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, self.rows[positions], -1)
+
+    def save_index(self):
+        tmp_path = os.path.join(self.path, "index.tmp.npz")
+        np.savez(tmp_path, keys=self.keys, rows=self.rows, model=self.model_id, dim=self.dim,
+                 dtype=self.dtype.name, vectors_file=self.vectors_file)
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+
+    def add(self, keys, vectors):
+        """Appends the vectors of keys that are not cached yet (the first one of duplicate keys)."""
+        keys, first = np.unique(np.asarray(keys, dtype=KEY_DTYPE), return_index=True)
+        vectors = np.asarray(vectors)[first]
+        new = self.find(keys) < 0
+        keys, vectors = keys[new], vectors[new]
+        if not len(keys):
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            os.makedirs(self.path, exist_ok=True)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding cache for {self.model_id} holds {self.dim}-d vectors, got {vectors.shape[1]}-d")
+        start = self.num_rows()
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+        all_keys = np.concatenate([self.keys, keys])
+        order = np.argsort(all_keys, kind="stable")
+        self.keys = all_keys[order]
+        self.rows = np.concatenate([self.rows, np.arange(start, start + len(keys), dtype=np.int64)])[order]
+        self.save_index()
+
+    def get_or_compute(self, texts, compute):
+        """
+        Vectors of `texts` (float32, one row each), read from the cache where possible.
+        `compute(indices)` must return the vectors of the texts at those indices of `texts`; they are cached.
+        Returns the vectors and the number of texts that were cached.
+        """
+        keys = text_keys(texts)
+        rows = self.find(keys)
+        hit = rows >= 0
+        missing = np.flatnonzero(~hit)
+        computed = np.asarray(compute(missing), dtype=np.float32) if len(missing) else None
+        dim = computed.shape[1] if computed is not None else self.dim
+        vectors = np.empty((len(keys), dim or 0), dtype=np.float32)
+        if hit.any():
+            vectors[hit] = self.vectors()[rows[hit]]
+        if computed is not None:
+            vectors[missing] = computed
+            self.add(keys[missing], computed)
+        return vectors, int(hit.sum())
+
+    def retain(self, texts):
+        """Drops the vectors of every text not in `texts` and rewrites the vectors file without them."""
+        keys = np.unique(text_keys(texts))
+        rows = self.find(keys)
+        keys, rows = keys[rows >= 0], rows[rows >= 0]
+        if len(keys) == self.num_rows():
+            return
+        old_path = self.vectors_path
+        generation = int(self.vectors_file[len("vectors-"):-len(".bin")]) + 1
+        vectors = np.array(self.vectors()[np.sort(rows)])
+        # Rows keep their relative order, so a key's new row is its rank among the kept rows
+        new_rows = np.searchsorted(np.sort(rows), rows)
+        self.vectors_file = f"vectors-{generation}.bin"
+        with open(self.vectors_path, "wb") as f:
+            f.write(vectors.tobytes())
+        self.keys, self.rows = keys, new_rows.astype(np.int64)
+        self.save_index()
+        os.remove(old_path)
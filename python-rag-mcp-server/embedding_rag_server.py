@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import threading
+from typing import List, Optional
+from mcp.server.fastmcp import FastMCP
+
+from rag_pipeline_usage_example import EMBEDDING_MODEL, Retriever
+
+# Alternative backend to rag_server.py: the same tools, answered by the sentence-transformers
+# vector store of rag_pipeline_usage_example.py instead of the TF-IDF index. The embedding
+# model and the store are loaded once, in the background while the MCP handshake happens,
+# and stay resident for every later query.
+
+mcp = FastMCP("RAG Knowledge Base (embeddings)")
+
+RAG_READY_TIMEOUT = float(os.environ.get("RAG_READY_TIMEOUT", "120"))
+retriever_ready = threading.Event()
+warmup_lock = threading.Lock()
+warmup_thread = None
+load_error = None
+retriever = None
+
+def warm_up():
+    global load_error, retriever
+    try:
+        # stdout carries the MCP protocol
+        retriever = Retriever(log=lambda message: print(message, file=sys.stderr))
+    except Exception as e:
+        load_error = f"Failed to load the vector store: {e}"
+    finally:
+        # Set even on failure so waiting tool calls report the error instead of hanging
+        retriever_ready.set()
+
+def start_warm_up():
+    global warmup_thread
+    with warmup_lock:
+        if warmup_thread is None:
+            warmup_thread = threading.Thread(target=warm_up, name="rag-warm-up", daemon=True)
+            warmup_thread.start()
+
+def wait_until_ready():
+    """Blocks until the retriever is loaded. Returns None when it is usable, otherwise a message for the agent."""
+    start_warm_up()
+    if not retriever_ready.wait(RAG_READY_TIMEOUT):
+        return "Knowledge base is still loading. Please try again shortly."
+    if load_error:
+        return f"Knowledge base not fully loaded: {load_error}"
+    return None
+
+def format_results(hits):
+    results = [f"Rank {i+1}: (Score: {score:.2f})\nSource: {doc.metadata.get('source', '?')}\n{doc.page_content}\n---"
+               for i, (doc, score) in enumerate(hits)]
+    if not results:
+        return "No relevant information found in the knowledge base."
+    return "\n".join(results)
+
+def run_search(queries, k, source=None):
+    k = 3 if k is None else int(k)
+    return [format_results(hits) for hits in retriever.retrieve_with_scores(queries, k, source)]
+
+@mcp.tool()
+def search_knowledge_base(query: str, k: Optional[int] = 3, source: Optional[str] = None) -> str:
+    """
+    Searches the knowledge base for top-k relevant chunks based on the query.
+    Args:
+        query (str): The user's query.
+        k (int): The number of top-k relevant chunks to retrieve. Defaults to 3.
+        source (str, optional): Only search documents whose path or file name matches this (wildcards allowed, e.g. "python*.txt").
+    Returns:
+        str: A formatted string containing the retrieved knowledge chunks.
+    """
+    not_ready = wait_until_ready()
+    if not_ready:
+        return not_ready
+    return run_search([query], k, source)[0]
+
+@mcp.tool()
+def search_knowledge_base_batch(queries: List[str], k: Optional[int] = 3, source: Optional[str] = None) -> List[str]:
+    """
+    Searches the knowledge base for several independent queries at once (e.g. the sub-questions of a larger question).
+    Prefer this over calling search_knowledge_base repeatedly.
+    Args:
+        queries (list[str]): The queries to search for.
+        k (int): The number of top-k relevant chunks to retrieve per query. Defaults to 3.
+        source (str, optional): Only search documents whose path or file name matches this (wildcards allowed).
+    Returns:
+        list[str]: One formatted result string per query, in the same order as `queries`.
+    """
+    not_ready = wait_until_ready()
+    if not_ready:
+        return [not_ready] * len(queries)
+    if not queries:
+        return []
+    return run_search(queries, k, source)
+
+@mcp.resource("rag://health")
+def rag_health() -> str:
+    """Readiness of the knowledge base: load status, backend, embedding model, chunk count and per-step load timings in milliseconds."""
+    if not retriever_ready.is_set():
+        status = "loading"
+    elif load_error:
+        status = "error"
+    else:
+        status = "ready"
+    return json.dumps({
+        "status": status,
+        "ready": status == "ready",
+        "backend": "embeddings",
+        "model": EMBEDDING_MODEL,
+        "num_chunks": len(retriever) if retriever else 0,
+        "load_timings_ms": retriever.load_timings if retriever else {},
+        "error": load_error,
+    })
+
+if __name__ == "__main__":
+    start_warm_up()
+    mcp.run()
@@ -0,0 +1,67 @@
+import numpy as np
+import faiss
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+# Dimensionality-reduced (LSA) dense retrieval over TF-IDF vectors.
+#
+# TruncatedSVD projects the vocabulary-width TF-IDF vectors down to a few hundred
+# dimensions, and the projected vectors go into an approximate FAISS index
+# (IVF-PQ or HNSW) instead of an exact scan over every vocabulary term.
+
+LSA_INDEX_KINDS = ["lsa-ivfpq", "lsa-hnsw"]
+
+DEFAULT_LSA_DIM = 256
+DEFAULT_NLIST = 100
+DEFAULT_PQ_M = 16
+DEFAULT_HNSW_M = 32
+DEFAULT_NPROBE = 8
+DEFAULT_EF_SEARCH = 64
+
+
+def fit_lsa_projection(embeddings, lsa_dim=DEFAULT_LSA_DIM):
+    """
+    Fits the SVD projection on the TF-IDF matrix.
+    The dimension is capped by the corpus: SVD cannot produce more components than chunks or terms.
+    """
+    lsa_dim = max(1, min(lsa_dim, embeddings.shape[0] - 1, embeddings.shape[1] - 1))
+    svd = TruncatedSVD(n_components=lsa_dim, random_state=42)
+    svd.fit(embeddings)
+    return svd
+
+
+def project(svd, tfidf_vectors):
+    # Re-normalize after projection so L2 distance ranks like cosine similarity
+    return normalize(svd.transform(tfidf_vectors)).astype('float32')
+
+
+def build_lsa_index(vectors, kind, nlist=DEFAULT_NLIST, pq_m=DEFAULT_PQ_M, hnsw_m=DEFAULT_HNSW_M):
+    """
+    Builds the approximate index over LSA-projected vectors.
+    IVF-PQ parameters are clamped to what the corpus can train: at least ~39 points per list,
+    a PQ sub-quantizer count that divides the dimension, and at most 2^bits <= number of vectors.
+    """
+    n, dimension = vectors.shape
+    if kind == "lsa-hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+    elif kind == "lsa-ivfpq":
+        nlist = max(1, min(nlist, n // 39))
+        pq_m = max(1, min(pq_m, dimension))
+        while dimension % pq_m:
+            pq_m -= 1
+        nbits = max(1, min(8, int(np.log2(n))))
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, nbits)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown LSA index kind '{kind}'. Choose one of: {', '.join(LSA_INDEX_KINDS)}")
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    """Applies the query-time accuracy/latency knobs of whichever index type was loaded."""
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
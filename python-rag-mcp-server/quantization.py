@@ -0,0 +1,86 @@
+import numpy as np
+import faiss
+
+from lsa_index import DEFAULT_PQ_M
+
+# Compressed storage for exact-scan (flat) vector indexes, with optional exact re-ranking.
+#
+#   none: float32 vectors in an IndexFlatL2 (4 bytes per dimension)
+#   fp16: half-precision scalar quantization (2 bytes per dimension, needs no training)
+#   sq8:  8-bit scalar quantization, trained per dimension (1 byte per dimension)
+#   pq:   product quantization into `pq_m` sub-vectors of up to 8-bit codes (pq_m bytes per vector),
+#         stored as a single-list IVF-PQ: the same exhaustive scan as IndexPQ, but it accepts the
+#         ID selectors of source-filtered searches
+#
+# The index is still scanned in full, but over much smaller codes. Quantized distances are
+# approximate; with re-ranking the index returns `rerank` x k candidates that are re-scored
+# against the original vectors, which the caller keeps off the heap (a memory-mapped file,
+# or recomputed from the chunk text).
+
+QUANTIZATIONS = ["none", "fp16", "sq8", "pq"]
+# Candidates per requested hit that are re-scored exactly; 0 disables re-ranking
+DEFAULT_RERANK = 4
+# Vectors sampled to train sq8/pq (the ranges / codebooks)
+DEFAULT_TRAIN_SIZE = 4096
+
+
+def pq_layout(dimension, n, pq_m=DEFAULT_PQ_M):
+    """Sub-quantizer count (a divisor of the dimension) and bits per code that `n` training vectors can support."""
+    pq_m = max(1, min(pq_m, dimension))
+    while dimension % pq_m:
+        pq_m -= 1
+    nbits = max(1, min(8, int(np.log2(max(2, n)))))
+    return pq_m, nbits
+
+
+def build_quantized_index(dimension, quantization, n, pq_m=DEFAULT_PQ_M):
+    """An empty index storing `dimension`-d vectors with the given quantization; `n` is the number of vectors to come."""
+    if quantization == "none":
+        return faiss.IndexFlatL2(dimension)
+    if quantization == "fp16":
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if quantization == "sq8":
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    if quantization == "pq":
+        pq_m, nbits = pq_layout(dimension, min(n, DEFAULT_TRAIN_SIZE), pq_m)
+        return faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, 1, pq_m, nbits)
+    raise ValueError(f"Unknown quantization '{quantization}'. Choose one of: {', '.join(QUANTIZATIONS)}")
+
+
+def train_sample_ids(n, train_size=DEFAULT_TRAIN_SIZE, seed=42):
+    """Sorted ids of the vectors to train on: all of them, or a random sample of `train_size`."""
+    if n <= train_size:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, train_size, replace=False))
+
+
+def quantize(vectors, quantization, pq_m=DEFAULT_PQ_M):
+    """Builds the quantized index over an in-memory float32 matrix."""
+    index = build_quantized_index(vectors.shape[1], quantization, len(vectors), pq_m)
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(vectors[train_sample_ids(len(vectors))]))
+    index.add(vectors)
+    return index
+
+
+def rerank(query_vectors, candidate_ids, original_vectors, k):
+    """
+    Re-scores every query's candidates (rows of a faiss Index.search id matrix, -1 padded) by exact squared L2
+    distance to the query. `original_vectors(ids)` returns the float32 vectors of an id array.
+    Returns (distances, indices) of the best k per query, -1 padded like faiss.
+    """
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+    distances = np.full((len(candidate_ids), k), np.inf, dtype=np.float32)
+    indices = np.full((len(candidate_ids), k), -1, dtype=np.int64)
+    # Candidates shared between queries are fetched once
+    unique_ids = np.unique(candidate_ids[candidate_ids >= 0])
+    if not len(unique_ids):
+        return distances, indices
+    vectors = np.asarray(original_vectors(unique_ids), dtype=np.float32)
+    for row, candidates in enumerate(candidate_ids):
+        candidates = candidates[candidates >= 0]
+        exact = ((vectors[np.searchsorted(unique_ids, candidates)] - query_vectors[row]) ** 2).sum(axis=1)
+        best = np.argsort(exact, kind="stable")[:k]
+        distances[row, :len(best)] = exact[best]
+        indices[row, :len(best)] = candidates[best]
+    return distances, indices
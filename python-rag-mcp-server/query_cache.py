@@ -0,0 +1,71 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+# In-process LRU cache for formatted search results, with a TTL per entry.
+
+
+def normalize_query(query):
+    # TfidfVectorizer lowercases and tokenizes on word characters, so case and whitespace
+    # differences never change the query vector
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+
+class QueryCache:
+    """
+    LRU cache keyed on (normalized query, k, source filter, index version).
+    Entries older than `ttl` seconds are treated as misses; `max_size` <= 0 disables caching.
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query, k, index_version, source=None):
+        return (normalize_query(query), k, source, index_version)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl > 0 and time.monotonic() - entry[0] > self.ttl):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -1,16 +1,44 @@
 import os
+import json
+import time
+import argparse
+import fnmatch
+import functools
+import numpy as np
 from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from embedding_build import (
+    DEFAULT_EMBEDDING_BATCH_SIZE, DEFAULT_ENCODE_BATCH_SIZE, DEFAULT_EMBEDDING_WORKERS,
+    embed_texts, build_faiss_store, clear_checkpoints,
+)
+from embedding_cache import EmbeddingCache
+from quantization import QUANTIZATIONS, DEFAULT_RERANK, DEFAULT_PQ_M, rerank as rerank_candidates
 
 # Define the path to the knowledge base directory
 KB_DIR = "knowledge_base"
 FAISS_INDEX_PATH = "faiss_index"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Batches embedded so far by an unfinished build (see embedding_build.py); removed once the store is saved
+EMBEDDING_CHECKPOINT_DIR = "faiss_index/embedding_batches"
+# Vectors of previously embedded chunks, shared with create_faiss_index.py (see embedding_cache.py)
+EMBEDDING_CACHE_DIR = "faiss_index/embedding_cache"
+# A quantized store keeps its float32 vectors next to it for exact re-ranking (memory-mapped, never loaded whole)
+QUANTIZATION_INFO_PATH = "faiss_index/index_quantization.json"
+ORIGINAL_VECTORS_PATH = "faiss_index/index_vectors.npy"
 
-def create_vector_store():
+def vector_store_exists(index_path=FAISS_INDEX_PATH):
+    # faiss_index/ also holds create_faiss_index.py's TF-IDF index, so look for the store's own file
+    return os.path.exists(os.path.join(index_path, "index.faiss"))
+
+def load_embeddings():
+    # Using a common model, e.g., 'sentence-transformers/all-MiniLM-L6-v2'
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+def split_documents(log=print):
     documents = []
-    for file_name in os.listdir(KB_DIR):
+    for file_name in sorted(os.listdir(KB_DIR)):
         if file_name.endswith(".txt"):
             file_path = os.path.join(KB_DIR, file_name)
             loader = TextLoader(file_path)
@@ -22,48 +50,168 @@ def create_vector_store():
     )
     texts = text_splitter.split_documents(documents)
 
-    print(f"Split {len(documents)} documents into {len(texts)} chunks.")
+    log(f"Split {len(documents)} documents into {len(texts)} chunks.")
+    return texts
 
-    # Initialize HuggingFace Embeddings
-    # Using a common model, e.g., 'sentence-transformers/all-MiniLM-L6-v2'
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+def save_quantization(vectors, quantization, rerank):
+    """Records how the store is quantized; re-ranking needs the original vectors, which are saved with it."""
+    for path in (QUANTIZATION_INFO_PATH, ORIGINAL_VECTORS_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+    if quantization == "none":
+        return
+    if rerank:
+        np.save(ORIGINAL_VECTORS_PATH, vectors)
+    with open(QUANTIZATION_INFO_PATH, 'w') as f:
+        json.dump({"quantization": quantization, "rerank": rerank}, f)
+
+def load_rerank(log=print):
+    """Re-ranking depth of the store on disk (RAG_RERANK overrides it) and its original vectors; (0, None) if off."""
+    if not os.path.exists(QUANTIZATION_INFO_PATH):
+        return 0, None
+    with open(QUANTIZATION_INFO_PATH, 'r') as f:
+        info = json.load(f)
+    depth = int(os.environ.get("RAG_RERANK", info["rerank"]))
+    if not depth or not os.path.exists(ORIGINAL_VECTORS_PATH):
+        return 0, None
+    log(f"{info['quantization']} store: re-ranking {depth} candidates per hit against {ORIGINAL_VECTORS_PATH}")
+    return depth, np.load(ORIGINAL_VECTORS_PATH, mmap_mode="r")
+
+def create_vector_store(embeddings=None, log=print, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                        encode_batch_size=DEFAULT_ENCODE_BATCH_SIZE, workers=DEFAULT_EMBEDDING_WORKERS,
+                        quantization="none", rerank=DEFAULT_RERANK, pq_m=DEFAULT_PQ_M):
+    texts = split_documents(log)
+
+    # Initialize HuggingFace Embeddings (used to embed queries against the store)
+    embeddings = embeddings or load_embeddings()
+
+    # Only chunks whose text isn't in the embedding cache are embedded, in a pool of worker processes
+    # that resumes an interrupted build from its checkpoints
+    chunk_texts = [text.page_content for text in texts]
+    cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL)
+    vectors, cached = cache.get_or_compute(chunk_texts, lambda missing: embed_texts(
+        [chunk_texts[i] for i in missing], EMBEDDING_MODEL, EMBEDDING_CHECKPOINT_DIR,
+        batch_size=batch_size, encode_batch_size=encode_batch_size, workers=workers, log=log))
+    log(f"Embedding cache: {cached} of {len(chunk_texts)} chunks were already embedded.")
 
     # Create a FAISS vector store
-    vector_store = FAISS.from_documents(texts, embeddings)
+    vector_store = build_faiss_store(texts, vectors, embeddings, quantization, pq_m)
     vector_store.save_local(FAISS_INDEX_PATH)
-    print(f"FAISS index created and saved to {FAISS_INDEX_PATH}")
+    save_quantization(vectors, quantization, rerank)
+    clear_checkpoints(EMBEDDING_CHECKPOINT_DIR)
+    cache.retain(chunk_texts)
+    log(f"FAISS index created and saved to {FAISS_INDEX_PATH}")
     return vector_store, embeddings
 
-def load_vector_store():
+def load_vector_store(embeddings=None, log=print):
     # Initialize HuggingFace Embeddings with the same model used for creation
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    embeddings = embeddings or load_embeddings()
     vector_store = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-    print(f"FAISS index loaded from {FAISS_INDEX_PATH}")
+    log(f"FAISS index loaded from {FAISS_INDEX_PATH}")
     return vector_store, embeddings
 
-def retrieve_chunks(query: str, k: int = 4):
-    if not os.path.exists(FAISS_INDEX_PATH):
-        vector_store, embeddings = create_vector_store()
-    else:
-        vector_store, embeddings = load_vector_store()
+def source_matches(pattern, path):
+    """Same rule as rag_server.py's source filter: case-insensitive wildcard match on the path or the file name."""
+    pattern, path = pattern.lower(), path.lower()
+    return fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(os.path.basename(path), pattern)
+
+class Retriever:
+    """
+    Loads the embedding model and the vector store once and keeps them resident, so a query only pays for
+    embedding the query text and the index lookup. Creates the store first if it doesn't exist yet.
+    `log` receives progress messages (an MCP server must keep them off stdout).
+    """
 
-    docs = vector_store.similarity_search(query, k=k)
-    return [doc.page_content for doc in docs]
+    def __init__(self, log=print):
+        self.load_timings = {}  # step name -> milliseconds
+        start = time.perf_counter()
+        self.embeddings = load_embeddings()
+        self.load_timings["model"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        if vector_store_exists():
+            self.vector_store, _ = load_vector_store(self.embeddings, log)
+        else:
+            self.vector_store, _ = create_vector_store(self.embeddings, log)
+        self.rerank, self.original_vectors = load_rerank(log)
+        self.load_timings["vector_store"] = (time.perf_counter() - start) * 1000
+
+    def __len__(self):
+        return self.vector_store.index.ntotal
+
+    def search(self, query_vector, k=4, source=None):
+        """(Document, score) pairs for one embedded query, best first; `source` keeps only matching documents."""
+        if self.rerank:
+            return self.search_reranked(query_vector, k, source)
+        if source:
+            # FAISS filters after the lookup: fetch enough candidates that k of them are likely to match
+            return self.vector_store.similarity_search_with_score_by_vector(
+                query_vector, k=k, fetch_k=max(20, 10 * k),
+                filter=lambda metadata: source_matches(source, metadata.get("source", "")))
+        return self.vector_store.similarity_search_with_score_by_vector(query_vector, k=k)
+
+    def search_reranked(self, query_vector, k, source=None):
+        """search() on a quantized store: a shortlist from the index, re-scored against the original vectors."""
+        fetch = (max(20, 10 * k) if source else k) * self.rerank
+        query = np.asarray([query_vector], dtype=np.float32)
+        _, candidates = self.vector_store.index.search(query, fetch)
+        distances, ids = rerank_candidates(query, candidates, lambda ids: self.original_vectors[ids], fetch)
+        hits = []
+        for distance, i in zip(distances[0], ids[0]):
+            if i < 0 or len(hits) == k:
+                break
+            doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[int(i)])
+            if not source or source_matches(source, doc.metadata.get("source", "")):
+                hits.append((doc, float(distance)))
+        return hits
+
+    def retrieve_with_scores(self, queries, k=4, source=None):
+        """Embeds all queries in one model call and searches them one by one. Returns one hit list per query."""
+        query_vectors = self.embeddings.embed_documents(list(queries))
+        return [self.search(vector, k, source) for vector in query_vectors]
+
+    def retrieve(self, query, k=4):
+        return [doc.page_content for doc, _ in self.search(self.embeddings.embed_query(query), k)]
+
+@functools.lru_cache(maxsize=None)
+def get_retriever():
+    """The process-wide Retriever, loaded on first use."""
+    return Retriever()
+
+def retrieve_chunks(query: str, k: int = 4):
+    return get_retriever().retrieve(query, k)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the embedding vector store, creating it first if needed.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild the vector store (resuming an interrupted build) instead of loading it")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_EMBEDDING_BATCH_SIZE,
+                        help=f"Chunks per embedding batch, the unit of work and of checkpointing (default: {DEFAULT_EMBEDDING_BATCH_SIZE})")
+    parser.add_argument("--encode-batch-size", type=int, default=DEFAULT_ENCODE_BATCH_SIZE,
+                        help=f"Sentences per model forward pass inside a worker (default: {DEFAULT_ENCODE_BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_EMBEDDING_WORKERS,
+                        help=f"Embedding processes, each pinned to its share of the cores (default: {DEFAULT_EMBEDDING_WORKERS})")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none",
+                        help="Store vectors as float32 (none), float16, 8-bit scalar or PQ codes (default: none)")
+    parser.add_argument("--rerank", type=int, default=DEFAULT_RERANK,
+                        help=f"With --quantization: re-score this many candidates per hit against the float32 vectors, "
+                             f"0 to disable (default: {DEFAULT_RERANK}, overridable with RAG_RERANK)")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M,
+                        help=f"--quantization pq: number of sub-quantizers (default: {DEFAULT_PQ_M})")
+    cli_args = parser.parse_args()
+    if cli_args.rebuild:
+        create_vector_store(batch_size=cli_args.batch_size, encode_batch_size=cli_args.encode_batch_size,
+                            workers=cli_args.workers, quantization=cli_args.quantization, rerank=cli_args.rerank,
+                            pq_m=cli_args.pq_m)
+
     # Example usage:
-    # This will create and save the vector store if it doesn't exist
-    # or load it if it does, then perform a retrieval.
-    query = "What are the key concepts of Object-Oriented Programming?"
-    print(f"\nQuery: {query}")
-    results = retrieve_chunks(query)
-    for i, chunk in enumerate(results):
-        print(f"--- Chunk {i+1} ---")
-        print(chunk)
-
-    query = "Explain variables in Python."
-    print(f"\nQuery: {query}")
-    results = retrieve_chunks(query)
-    for i, chunk in enumerate(results):
-        print(f"--- Chunk {i+1} ---")
-        print(chunk)
+    # The first call creates and saves the vector store if it doesn't exist or loads it if it
+    # does; later calls reuse the loaded model and store.
+    for query in ["What are the key concepts of Object-Oriented Programming?", "Explain variables in Python."]:
+        print(f"\nQuery: {query}")
+        start = time.perf_counter()
+        results = retrieve_chunks(query)
+        print(f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+        for i, chunk in enumerate(results):
+            print(f"--- Chunk {i+1} ---")
+            print(chunk)
@@ -3,14 +3,45 @@ import faiss
 import numpy as np
 import json
 import joblib
+import time
+import threading
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from mcp.server.fastmcp import FastMCP
 from sklearn.feature_extraction.text import TfidfVectorizer
-from typing import Optional  # <--- ADD THIS LINE
+from typing import List, Optional  # <--- ADD THIS LINE
+from sparse_index import load_sparse_index, search_sparse_index
+from chunk_store import ChunkStore, load_sources
+from query_cache import QueryCache
+from bm25_index import DEFAULT_RRF_K, term_counts, search_bm25, reciprocal_rank_fusion
+from lsa_index import LSA_INDEX_KINDS, DEFAULT_NPROBE, DEFAULT_EF_SEARCH, project, set_search_params
+from quantization import DEFAULT_RERANK, rerank
 
 # Configuration (must match create_faiss_index.py)
 FAISS_INDEX_PATH = "faiss_index/knowledge_base.faiss"
 FAISS_METADATA_PATH = "faiss_index/knowledge_base_metadata.json"
 TFIDF_VECTORIZER_PATH = "faiss_index/tfidf_vectorizer.joblib"
+SPARSE_INDEX_PATH = "faiss_index/knowledge_base_sparse.npz"
+INDEX_INFO_PATH = "faiss_index/index_info.json"
+LSA_PROJECTION_PATH = "faiss_index/lsa_projection.joblib"
+CHUNK_STORE_PATH = "faiss_index/knowledge_base_chunks.bin"
+SOURCES_PATH = "faiss_index/chunk_sources.npy"
+DOCUMENTS_PATH = "faiss_index/documents.json"
+BM25_INDEX_PATH = "faiss_index/knowledge_base_bm25.npz"
+
+# Memory-map the index and chunk texts instead of reading them into the process heap,
+# so many server processes share one copy in the page cache (set RAG_MMAP=0 to disable)
+RAG_MMAP = os.environ.get("RAG_MMAP", "1") != "0"
+
+# Retrieval mode: "vector" (the index backend only), "bm25" (keyword postings only) or "hybrid"
+# (both, run concurrently and fused with reciprocal rank fusion). Indexes built without BM25
+# postings fall back to "vector".
+SEARCH_MODES = ["vector", "bm25", "hybrid"]
+RAG_SEARCH_MODE = os.environ.get("RAG_SEARCH_MODE", "vector")
+# Hybrid mode: candidates taken from each retriever before fusion, and the RRF rank offset
+RAG_HYBRID_CANDIDATES = int(os.environ.get("RAG_HYBRID_CANDIDATES", "50"))
+RAG_RRF_K = int(os.environ.get("RAG_RRF_K", str(DEFAULT_RRF_K)))
 
 # 1. Initialize the Server at the module level
 mcp = FastMCP("RAG Knowledge Base")
@@ -19,87 +50,389 @@ mcp = FastMCP("RAG Knowledge Base")
 global_faiss_index = None
 global_metadata = None
 global_vectorizer = None
+global_backend = None
+global_lsa_projection = None
+global_index_version = None
+global_sources = None    # per chunk id: doc_id, ordinal, byte span (see chunk_store.SOURCE_DTYPE)
+global_documents = None  # doc_id -> file path, None for deleted documents
+source_ids_cache = {}    # source filter -> allowed chunk ids, reset on every load
+global_bm25_index = None
+global_bm25_analyzer = None
+global_search_mode = None
+global_rerank = 0        # candidates per hit re-scored exactly (quantized flat indexes only)
+
+# Runs the vector and BM25 searches of a hybrid query side by side (FAISS and scipy release the GIL)
+search_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-search")
+
+# Cache of formatted results per (normalized query, k, source filter, index version)
+query_cache = QueryCache(
+    max_size=int(os.environ.get("RAG_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("RAG_CACHE_TTL", "300")),
+)
+
+# Warm-up state: resources are loaded once in a background thread and tool calls wait on rag_ready
+RAG_READY_TIMEOUT = float(os.environ.get("RAG_READY_TIMEOUT", "60"))
+rag_ready = threading.Event()
+warmup_lock = threading.Lock()
+warmup_thread = None
+load_error = None
+load_timings = {}  # step name -> milliseconds
+
+def load_index_info():
+    # Indexes built before index_info.json existed are always flat FAISS indexes
+    if os.path.exists(INDEX_INFO_PATH):
+        with open(INDEX_INFO_PATH, 'r') as f:
+            return json.load(f)
+    return {"backend": "flat"}
+
+def read_index_version():
+    # create_faiss_index.py writes index_info.json last, so its mtime marks a completed build
+    for path in (INDEX_INFO_PATH, FAISS_INDEX_PATH):
+        if os.path.exists(path):
+            return os.stat(path).st_mtime_ns
+    return None
+
+def faiss_read_flags(backend):
+    if not RAG_MMAP:
+        return 0
+    if backend == "lsa-ivfpq":
+        # Inverted lists are mapped straight from the index file
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    # Flat codes (IndexFlat, HNSW storage); older FAISS builds don't support mapping them
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+@contextmanager
+def timed_step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        load_timings[name] = round((time.perf_counter() - start) * 1000, 3)
 
 def load_rag_resources():
-    global global_faiss_index, global_metadata, global_vectorizer
+    """
+    Loads the index, metadata and vectorizer into the resource holders.
+    Returns None on success, otherwise a message describing the missing artifact.
+    """
+    global global_faiss_index, global_metadata, global_vectorizer, global_backend, global_lsa_projection
+    global global_index_version, global_sources, global_documents
+    global global_bm25_index, global_bm25_analyzer, global_search_mode, global_rerank
 
-    if global_faiss_index and global_metadata and global_vectorizer:
-        # print("RAG resources already loaded.")
-        return
+    # Read before the artifacts, so a build finishing mid-load is picked up by the next check
+    global_index_version = read_index_version()
+    with timed_step("index_info"):
+        index_info = load_index_info()
+    backend = index_info.get("backend", "flat")
+
+    index_path = SPARSE_INDEX_PATH if backend == "sparse" else FAISS_INDEX_PATH
+    if not os.path.exists(index_path):
+        return f"Index not found at {index_path}. Please run create_faiss_index.py first."
+    with timed_step("index"):
+        if backend == "sparse":
+            global_faiss_index = load_sparse_index(index_path)
+        else:
+            global_faiss_index = faiss.read_index(index_path, faiss_read_flags(backend))
+    global_backend = backend
+    # Quantized flat codes give approximate distances; re-rank their shortlist (RAG_RERANK=0 disables it)
+    global_rerank = 0
+    if index_info.get("quantization", "none") != "none":
+        global_rerank = int(os.environ.get("RAG_RERANK", index_info.get("rerank", DEFAULT_RERANK)))
 
-    # print("Loading FAISS index...")
-    if os.path.exists(FAISS_INDEX_PATH):
-        global_faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-        # print("FAISS index loaded.")
+    if backend in LSA_INDEX_KINDS:
+        # Query-time knobs: build-time defaults, overridable per deployment
+        set_search_params(
+            global_faiss_index,
+            nprobe=int(os.environ.get("RAG_NPROBE", index_info.get("nprobe", DEFAULT_NPROBE))),
+            ef_search=int(os.environ.get("RAG_EF_SEARCH", index_info.get("ef_search", DEFAULT_EF_SEARCH))),
+        )
+        if not os.path.exists(LSA_PROJECTION_PATH):
+            return f"LSA projection not found at {LSA_PROJECTION_PATH}."
+        with timed_step("lsa_projection"):
+            global_lsa_projection = joblib.load(LSA_PROJECTION_PATH)
+
+    if RAG_MMAP and os.path.exists(CHUNK_STORE_PATH):
+        with timed_step("metadata"):
+            global_metadata = ChunkStore(CHUNK_STORE_PATH)
+    elif os.path.exists(FAISS_METADATA_PATH):
+        # Indexes built before the chunk store existed only have the JSON list
+        with timed_step("metadata"):
+            with open(FAISS_METADATA_PATH, 'r') as f:
+                global_metadata = json.load(f)
     else:
-        # print(f"Error: FAISS index not found at {FAISS_INDEX_PATH}. Please run create_faiss_index.py first.")
-        return
+        return f"Metadata not found at {FAISS_METADATA_PATH}."
 
-    # print("Loading metadata...")
-    if os.path.exists(FAISS_METADATA_PATH):
-        with open(FAISS_METADATA_PATH, 'r') as f:
-            global_metadata = json.load(f)
-        # print("Metadata loaded.")
+    source_ids_cache.clear()
+    if os.path.exists(SOURCES_PATH) and os.path.exists(DOCUMENTS_PATH):
+        with timed_step("sources"):
+            global_sources = load_sources(SOURCES_PATH, mmap=RAG_MMAP)
+            with open(DOCUMENTS_PATH, 'r') as f:
+                global_documents = json.load(f)
     else:
-        # print(f"Error: Metadata not found at {FAISS_METADATA_PATH}.")
-        return
+        # Indexes built before source metadata existed can still be searched, just not filtered by source
+        global_sources = global_documents = None
 
-    # print("Loading TF-IDF Vectorizer...")
-    if os.path.exists(TFIDF_VECTORIZER_PATH):
-        global_vectorizer = joblib.load(TFIDF_VECTORIZER_PATH)
-        # print("TF-IDF Vectorizer loaded.")
+    if RAG_SEARCH_MODE not in SEARCH_MODES:
+        return f"Unknown RAG_SEARCH_MODE '{RAG_SEARCH_MODE}'. Choose one of: {', '.join(SEARCH_MODES)}."
+    global_search_mode = RAG_SEARCH_MODE
+    if global_search_mode != "vector" and os.path.exists(BM25_INDEX_PATH):
+        with timed_step("bm25_index"):
+            global_bm25_index = load_sparse_index(BM25_INDEX_PATH)
     else:
-        # print(f"Error: TF-IDF Vectorizer not found at {TFIDF_VECTORIZER_PATH}.")
+        global_bm25_index = None
+        global_search_mode = "vector"
+
+    if not os.path.exists(TFIDF_VECTORIZER_PATH):
+        return f"TF-IDF Vectorizer not found at {TFIDF_VECTORIZER_PATH}."
+    with timed_step("vectorizer"):
+        global_vectorizer = joblib.load(TFIDF_VECTORIZER_PATH)
+        # BM25 queries are tokenized exactly like the indexed chunks
+        global_bm25_analyzer = global_vectorizer.build_analyzer()
+    return None
+
+def warm_up():
+    global load_error
+    load_timings.clear()
+    try:
+        with timed_step("total"):
+            load_error = load_rag_resources()
+    except Exception as e:
+        load_error = f"Failed to load RAG resources: {e}"
+    finally:
+        # Set even on failure so waiting tool calls report the error instead of hanging
+        rag_ready.set()
+
+def start_warm_up():
+    """Starts loading RAG resources in a background thread (only the first call does anything)."""
+    global warmup_thread
+    with warmup_lock:
+        if warmup_thread is None:
+            warmup_thread = threading.Thread(target=warm_up, name="rag-warm-up", daemon=True)
+            warmup_thread.start()
+
+def reload_if_index_changed():
+    """Picks up an index rebuilt by create_faiss_index.py: drops cached results and reloads in the background."""
+    global warmup_thread
+    if read_index_version() == global_index_version:
         return
-    # print("All RAG resources loaded successfully.")
+    with warmup_lock:
+        if not rag_ready.is_set():
+            # A load is already in progress
+            return
+        rag_ready.clear()
+        warmup_thread = None
+    query_cache.clear()
+    start_warm_up()
 
-# 2. Define a TOOL (Function the Agent can call)
-@mcp.tool()
-def search_knowledge_base(query: str, k: Optional[int] = 3) -> str:
+def wait_until_ready():
+    """Blocks until warm-up finished. Returns None when the knowledge base is usable, otherwise a message for the agent."""
+    start_warm_up()
+    if rag_ready.is_set():
+        reload_if_index_changed()
+    if not rag_ready.wait(RAG_READY_TIMEOUT):
+        return "Knowledge base is still loading. Please try again shortly."
+    if load_error:
+        return f"Knowledge base not fully loaded: {load_error}"
+    return None
+
+def source_chunk_ids(source):
     """
-    Searches the knowledge base for top-k relevant chunks based on the query.
-    Args:
-        query (str): The user's query.
-        k (int): The number of top-k relevant chunks to retrieve. Defaults to 3.
-    Returns:
-        str: A formatted string containing the retrieved knowledge chunks.
+    Chunk ids of the documents matching `source`: a file path or file name, optionally with shell-style
+    wildcards (e.g. "knowledge_base/python*.txt" or "*.md"), compared case-insensitively.
+    Returns None when the index has no source metadata, otherwise a sorted int64 array (empty if nothing matches).
+    """
+    if global_sources is None:
+        return None
+    allowed_ids = source_ids_cache.get(source)
+    if allowed_ids is None:
+        pattern = source.lower()
+        doc_ids = [doc_id for doc_id, path in enumerate(global_documents) if path is not None
+                   and (fnmatch.fnmatch(path.lower(), pattern) or fnmatch.fnmatch(os.path.basename(path).lower(), pattern))]
+        allowed_ids = np.flatnonzero(np.isin(global_sources["doc_id"], doc_ids)).astype('int64')
+        source_ids_cache[source] = allowed_ids
+    return allowed_ids
+
+def faiss_search_params(allowed_ids):
+    """SearchParameters restricting a FAISS search to `allowed_ids`, keeping the index's own nprobe/efSearch."""
+    selector = faiss.IDSelectorBatch(allowed_ids)
+    if isinstance(global_faiss_index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=global_faiss_index.nprobe)
+    elif isinstance(global_faiss_index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=global_faiss_index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # The Python object owns the selector, keep it alive for as long as params is used
+    params.selector_ref = selector
+    return params
+
+def search_vectors(query_vectors, k, allowed_ids=None):
     """
-    load_rag_resources() # Ensure resources are loaded when the tool is called
+    Runs one search for every row of the (sparse) TF-IDF query matrix. Returns (distances, indices) like faiss Index.search.
+    With `allowed_ids`, only those chunks are candidates: the filter is applied inside the search (a FAISS ID selector),
+    not on the top-k afterwards, so a filtered query still gets up to k hits.
+    """
+    if global_backend == "sparse":
+        # Scores are cosine similarities (higher is better), the queries stay sparse
+        return search_sparse_index(global_faiss_index, query_vectors, k, allowed_ids=allowed_ids)
+    params = faiss_search_params(allowed_ids) if allowed_ids is not None else None
+    if global_backend in LSA_INDEX_KINDS:
+        # Scores are (approximate) L2 distances between LSA-projected vectors
+        return global_faiss_index.search(project(global_lsa_projection, query_vectors), k, params=params)
+    # Scores are L2 distances (lower is better)
+    dense_queries = query_vectors.toarray().astype('float32')
+    if global_rerank:
+        _, candidates = global_faiss_index.search(dense_queries, k * global_rerank, params=params)
+        return rerank(dense_queries, candidates, chunk_vectors, k)
+    return global_faiss_index.search(dense_queries, k, params=params)
 
-    if not global_faiss_index or not global_metadata or not global_vectorizer:
-        return "Knowledge base not fully loaded. Check server startup logs."
+def chunk_vectors(ids):
+    """Exact TF-IDF vectors of the given chunks, recomputed from their text (re-ranking only fetches a few)."""
+    return global_vectorizer.transform([global_metadata[i] for i in ids]).toarray()
 
-    # print(f"Searching knowledge base for query: '{query}' with k={k}")
+def search_keywords(queries, k, allowed_ids=None):
+    """BM25 search for every query over the precomputed postings. Returns (scores, indices) like faiss Index.search."""
+    query_counts = term_counts(global_bm25_analyzer, global_vectorizer.vocabulary_, queries)
+    return search_bm25(global_bm25_index, query_counts, k, allowed_ids=allowed_ids)
 
+def search(queries, query_vectors, k, allowed_ids=None):
+    """Searches with the active retrieval mode. Returns (scores, indices) for every query, best first."""
+    if global_search_mode == "bm25":
+        return search_keywords(queries, k, allowed_ids)
+    if global_search_mode == "vector":
+        return search_vectors(query_vectors, k, allowed_ids)
+    # Hybrid: fuse a deeper candidate list from each retriever, searched concurrently
+    depth = max(k, RAG_HYBRID_CANDIDATES)
+    vector_future = search_executor.submit(search_vectors, query_vectors, depth, allowed_ids)
+    _, keyword_ids = search_keywords(queries, depth, allowed_ids)
+    _, vector_ids = vector_future.result()
+    return reciprocal_rank_fusion([vector_ids, keyword_ids], k, rrf_k=RAG_RRF_K)
+
+def format_source(idx):
+    if global_sources is None or idx >= len(global_sources):
+        return ""
+    row = global_sources[idx]
+    return f"Source: {global_documents[row['doc_id']]}, chunk {row['ordinal'] + 1}\n"
+
+def format_results(distances, indices):
+    results = []
+    for i, idx in enumerate(indices):
+        if idx < 0:
+            # Fewer than k matches (FAISS pads with -1)
+            continue
+        if idx < len(global_metadata):
+            results.append(f"Rank {i+1}: (Score: {distances[i]:.2f})\n{format_source(idx)}{global_metadata[idx]}\n---")
+        else:
+            results.append(f"Rank {i+1}: (Invalid index {idx} in metadata. Metadata size: {len(global_metadata)})")
+
+    if not results:
+        return "No relevant information found in the knowledge base."
+    return "\n".join(results)
+
+def run_search(queries, k, source=None):
+    """
+    Answers cached queries from query_cache; vectorizes the remaining ones in one transform call and searches them in one batch.
+    `source` restricts every query to the matching documents (see source_chunk_ids).
+    Returns one formatted result per query.
+    """
     # Handle the case where k is explicitly passed as None
     if k is None:
         k = 3
     # Ensure k is an integer
     k = int(k)
 
-    # Transform the query using the loaded TF-IDF vectorizer
+    keys = [QueryCache.make_key(query, k, global_index_version, source) for query in queries]
+    results = [query_cache.get(key) for key in keys]
+    misses = [row for row, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+
+    allowed_ids = None
+    if source:
+        allowed_ids = source_chunk_ids(source)
+        if allowed_ids is None:
+            return ["This index has no source metadata. Rebuild it with create_faiss_index.py to filter by source."] * len(queries)
+        if len(allowed_ids) == 0:
+            return [f"No documents in the knowledge base match source '{source}'."] * len(queries)
+
+    # Transform the queries using the loaded TF-IDF vectorizer
     # Ensure the vectorizer is fitted with some vocabulary, otherwise transform will fail
     # This might happen if create_faiss_index.py failed or if the KB is empty
+    miss_queries = [queries[row] for row in misses]
     try:
-        query_vector = global_vectorizer.transform([query]).toarray().astype('float32')
+        query_vectors = global_vectorizer.transform(miss_queries)
     except Exception as e:
         # print(f"Error transforming query: {e}. Ensure TF-IDF vectorizer is properly fitted.")
-        return "Error processing query for search."
+        return ["Error processing query for search."] * len(queries)
 
     # Perform similarity search
-    distances, indices = global_faiss_index.search(query_vector, k)
+    distances, indices = search(miss_queries, query_vectors, k, allowed_ids=allowed_ids)
+    for i, row in enumerate(misses):
+        results[row] = format_results(distances[i], indices[i])
+        query_cache.put(keys[row], results[row])
+    return results
 
-    results = []
-    for i, idx in enumerate(indices[0]):
-        if idx < len(global_metadata):
-            results.append(f"Rank {i+1}: (Score: {distances[0][i]:.2f})\n{global_metadata[idx]}\n---")
-        else:
-            results.append(f"Rank {i+1}: (Invalid index {idx} in metadata. Metadata size: {len(global_metadata)})")
+# 2. Define TOOLS (Functions the Agent can call)
+@mcp.tool()
+def search_knowledge_base(query: str, k: Optional[int] = 3, source: Optional[str] = None) -> str:
+    """
+    Searches the knowledge base for top-k relevant chunks based on the query.
+    Args:
+        query (str): The user's query.
+        k (int): The number of top-k relevant chunks to retrieve. Defaults to 3.
+        source (str, optional): Only search documents whose path or file name matches this (wildcards allowed, e.g. "python*.txt").
+    Returns:
+        str: A formatted string containing the retrieved knowledge chunks.
+    """
+    not_ready = wait_until_ready() # Warm-up normally finished long before the first call
+    if not_ready:
+        return not_ready
 
-    if not results:
-        return "No relevant information found in the knowledge base."
-    return "\n".join(results)
+    # print(f"Searching knowledge base for query: '{query}' with k={k}")
+    return run_search([query], k, source)[0]
+
+@mcp.tool()
+def search_knowledge_base_batch(queries: List[str], k: Optional[int] = 3, source: Optional[str] = None) -> List[str]:
+    """
+    Searches the knowledge base for several independent queries at once (e.g. the sub-questions of a larger question).
+    Prefer this over calling search_knowledge_base repeatedly.
+    Args:
+        queries (list[str]): The queries to search for.
+        k (int): The number of top-k relevant chunks to retrieve per query. Defaults to 3.
+        source (str, optional): Only search documents whose path or file name matches this (wildcards allowed).
+    Returns:
+        list[str]: One formatted result string per query, in the same order as `queries`.
+    """
+    not_ready = wait_until_ready()
+    if not_ready:
+        return [not_ready] * len(queries)
+    if not queries:
+        return []
+    return run_search(queries, k, source)
+
+# 3. Define a RESOURCE (Read-only state the client can inspect)
+@mcp.resource("rag://health")
+def rag_health() -> str:
+    """Readiness of the knowledge base: load status, backend, search mode, chunk count, per-step load timings in milliseconds and query cache statistics."""
+    if not rag_ready.is_set():
+        status = "loading"
+    elif load_error:
+        status = "error"
+    else:
+        status = "ready"
+    return json.dumps({
+        "status": status,
+        "ready": status == "ready",
+        "backend": global_backend,
+        "search_mode": global_search_mode,
+        "rerank": global_rerank,
+        "num_chunks": len(global_metadata) if global_metadata else 0,
+        "load_timings_ms": load_timings,
+        "index_version": global_index_version,
+        "query_cache": query_cache.stats(),
+        "error": load_error,
+    })
 
 if __name__ == "__main__":
     import sys
+    # Load in the background while the MCP handshake happens, so the first query doesn't pay for it
+    start_warm_up()
     mcp.run()
@@ -0,0 +1,128 @@
+import re
+
+# Sentence chunking with compiled regular expressions, replacing NLTK Punkt in the index builder.
+#
+# A sentence ends at a run of ".", "!" or "?" (plus any closing quotes or brackets) followed by
+# whitespace, as Punkt decides for ordinary words, except after common abbreviations ("e.g.",
+# "Dr.") and single-letter initials, or at an ellipsis followed by a lowercase word. Line breaks
+# alone never end a sentence. Sentences are stripped of surrounding whitespace.
+#
+# Sentences are then grouped into chunks in one streaming pass with the rules of the original
+# sentence_splitter(): sentences are packed while the chunk, joined with single spaces, stays
+# within max_chars, and packed chunks are merged while their combined length stays under
+# min_chars. Chunks are produced as the text is scanned; only the sentence offsets of the chunk
+# being built are held.
+
+SENTENCE_END = re.compile(r"""[.!?]+["')\]}]*(?=\s|\Z)""")
+NON_SPACE = re.compile(r"\S")
+OPENERS = "\"'([{"
+
+ABBREVIATIONS = frozenset({
+    "e.g", "i.e", "etc", "vs", "cf", "al", "approx", "ca", "viz",
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "rev", "gen", "sen", "rep", "gov",
+    "inc", "ltd", "corp", "dept", "univ", "fig", "eq", "vol", "pp", "ch", "sec",
+    "jan", "feb", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+    "a.m", "p.m", "u.s", "u.k", "u.n", "ph.d",
+})
+# Abbreviations that often end a sentence: they do when the next word is capitalized
+SENTENCE_FINAL_ABBREVIATIONS = frozenset({"etc"})
+# Characters looked back from a "." for the word it ends; longer than any abbreviation with its openers
+WORD_WINDOW = 8
+
+DEFAULT_MIN_CHARS = 100
+DEFAULT_MAX_CHARS = 500
+
+
+def word_before(text, position):
+    """The word ending at `position`, lowercased without opening quotes or brackets ("" if longer than WORD_WINDOW)."""
+    window = text[max(0, position - WORD_WINDOW):position]
+    if not window or window[-1].isspace():
+        return ""
+    word = window.split()[-1]
+    if len(word) == WORD_WINDOW and position > WORD_WINDOW:
+        return ""
+    return word.lstrip(OPENERS).lower()
+
+
+def is_boundary(text, match):
+    """Whether a match of SENTENCE_END ends a sentence."""
+    terminator = match.group().rstrip("\"')]}")
+    if terminator != "." and not terminator.startswith(".."):
+        return True
+    following = NON_SPACE.search(text, match.end())
+    if terminator.startswith(".."):
+        # An ellipsis inside a sentence is followed by a lowercase word
+        return following is None or not following.group().islower()
+    word = word_before(text, match.start())
+    if word in SENTENCE_FINAL_ABBREVIATIONS:
+        return following is not None and following.group().isupper()
+    if word in ABBREVIATIONS:
+        return False
+    # Initials: "J. Smith", "World War I. The"
+    return not (len(word) == 1 and word.isalpha())
+
+
+def iter_sentences(text):
+    """Yields the (start, end) character offsets of every sentence in `text`."""
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        if not is_boundary(text, match):
+            continue
+        first = NON_SPACE.search(text, start, match.end())
+        if first is not None:
+            yield first.start(), match.end()
+        start = match.end()
+    first = NON_SPACE.search(text, start)
+    if first is not None:
+        yield first.start(), len(text.rstrip())
+
+
+def pack(sentences, max_chars):
+    """Groups consecutive sentences while their space-joined length stays within `max_chars`. Yields (spans, length)."""
+    spans, length = [], 0
+    for start, end in sentences:
+        size = end - start
+        if spans and length + 1 + size > max_chars:
+            yield spans, length
+            spans = []
+        length = length + 1 + size if spans else size
+        spans.append((start, end))
+    if spans:
+        yield spans, length
+
+
+def merge_small(chunks, min_chars):
+    """Merges packed chunks while their combined length stays under `min_chars`. Yields lists of sentence spans."""
+    buffered, length = [], 0
+    for spans, chunk_length in chunks:
+        if length + chunk_length < min_chars:
+            length = length + 1 + chunk_length if buffered else chunk_length
+            buffered += spans
+        else:
+            if buffered:
+                yield buffered
+            buffered, length = spans, chunk_length
+    if buffered:
+        yield buffered
+
+
+def iter_chunks(text, min_chars=DEFAULT_MIN_CHARS, max_chars=DEFAULT_MAX_CHARS, overlap=0):
+    """
+    Yields (chunk, start, end) for every chunk of `text`: its sentences joined with single spaces and the character
+    offsets of its first and last sentence in `text`. With `overlap` > 0, every chunk after the first starts with the
+    trailing whole sentences of the previous one that fit in `overlap` characters and in what the chunk leaves of
+    `max_chars`, so overlap never makes a chunk longer than max_chars.
+    """
+    previous = []
+    for spans in merge_small(pack(iter_sentences(text), max_chars), min_chars):
+        chunk_length = sum(end - start for start, end in spans) + len(spans) - 1
+        budget = min(overlap, max_chars - chunk_length - 1)
+        carried, length = [], -1
+        for start, end in reversed(previous):
+            if length + 1 + (end - start) > budget:
+                break
+            carried.insert(0, (start, end))
+            length += 1 + (end - start)
+        previous = spans
+        spans = carried + spans
+        yield " ".join(text[start:end] for start, end in spans), spans[0][0], spans[-1][1]
@@ -0,0 +1,89 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Sparse-native retrieval over TF-IDF vectors.
+#
+# The chunk x vocabulary TF-IDF matrix is kept in CSC form, so its transpose is a
+# CSR matrix whose rows are the posting lists of each vocabulary term (an inverted
+# index). Scoring a query only walks the postings of the terms it contains instead
+# of scanning a dense, vocabulary-wide vector for every chunk.
+
+
+def build_sparse_index(embeddings):
+    """
+    Converts the TF-IDF matrix returned by TfidfVectorizer into the on-disk/in-memory
+    sparse index layout (float32 CSC).
+    """
+    return sp.csc_matrix(embeddings, dtype=np.float32)
+
+
+def save_sparse_index(matrix, path):
+    # Uncompressed so loading is a plain read of the three CSC arrays
+    sp.save_npz(path, matrix, compressed=False)
+
+
+def load_sparse_index(path):
+    return sp.load_npz(path).tocsc()
+
+
+def remove_rows(matrix, ids):
+    """Empties the rows of removed chunks. Rows are not deleted because row numbers are the chunk ids."""
+    keep = np.ones(matrix.shape[0], dtype=np.float32)
+    keep[np.asarray(ids, dtype=np.int64)] = 0
+    result = sp.csc_matrix(sp.diags(keep) @ matrix)
+    result.eliminate_zeros()
+    return result
+
+
+def append_rows(matrix, embeddings):
+    """Adds new chunks after the existing rows, so they get the next chunk ids."""
+    return sp.vstack([matrix, build_sparse_index(embeddings)], format="csc", dtype=np.float32)
+
+
+def sparse_index_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def search_sparse_index(matrix, query_vectors, k, allowed_ids=None):
+    """
+    Cosine top-k search over the inverted index.
+    TfidfVectorizer L2-normalizes both chunks and queries, so the dot product is the cosine similarity.
+    Args:
+        matrix: CSC chunk x vocabulary matrix from build_sparse_index/load_sparse_index.
+        query_vectors: Sparse (or dense) query x vocabulary matrix from vectorizer.transform.
+        k (int): Number of results per query.
+        allowed_ids: Optional array of chunk ids; other chunks are dropped before the top-k selection.
+    Returns:
+        (scores, indices): Arrays of shape (n_queries, k), best first, laid out like faiss Index.search.
+        Slots without a match have index -1 and score 0.
+    """
+    query_vectors = sp.csr_matrix(query_vectors, dtype=np.float32)
+    # (queries x vocab) @ (vocab x chunks): each query row only touches the postings of its own terms
+    scores = (query_vectors @ matrix.T).tocsr()
+
+    allowed = None
+    if allowed_ids is not None:
+        allowed = np.zeros(matrix.shape[0], dtype=bool)
+        allowed[np.asarray(allowed_ids, dtype=np.int64)] = True
+
+    n_queries = query_vectors.shape[0]
+    out_scores = np.zeros((n_queries, k), dtype=np.float32)
+    out_indices = np.full((n_queries, k), -1, dtype=np.int64)
+
+    for row in range(n_queries):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        row_scores = scores.data[start:end]
+        row_ids = scores.indices[start:end]
+        if allowed is not None:
+            keep = allowed[row_ids]
+            row_scores, row_ids = row_scores[keep], row_ids[keep]
+        if len(row_scores) > k:
+            # Partial sort: only the k best candidates get fully ordered
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            row_scores, row_ids = row_scores[top], row_ids[top]
+        order = np.argsort(-row_scores, kind="stable")
+        n = len(order)
+        out_scores[row, :n] = row_scores[order]
+        out_indices[row, :n] = row_ids[order]
+
+    return out_scores, out_indices